@@ -0,0 +1,7 @@
+# app/__init__.py
+#
+# Cold start is measured from the first import of the app package (see the startup phases in app/main.py).
+
+import time
+
+IMPORT_STARTED = time.perf_counter()
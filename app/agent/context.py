@@ -0,0 +1,198 @@
+# app/agent/context.py
+#
+# Builds the generator's context from the graded chunks:
+#   1. overlapping or adjacent chunks of the same source/page are merged back into one passage,
+#   2. near-duplicate passages (word-shingle Jaccard similarity) are dropped,
+#   3. the remaining passages are ordered with maximal marginal relevance (MMR),
+#   4. passages are packed under a hard token budget, each behind its `[SOURCE n]` header.
+# The returned documents are in `[SOURCE n]` order, so the API's source list matches the citations.
+
+from dataclasses import dataclass
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+import tiktoken
+from langchain_core.documents import Document
+
+# Chunk offsets index their page's text, in which elements are joined by this separator (data_ingestion/chunking.py)
+PASSAGE_SEPARATOR = "\n\n"
+
+
+@dataclass
+class BuiltContext:
+    text: str
+    documents: List[Document]
+    token_count: int
+    input_chunks: int
+
+
+def _shingles(text: str, size: int = 3) -> FrozenSet[Tuple[str, ...]]:
+    words = text.lower().split()
+    if len(words) <= size:
+        return frozenset([tuple(words)])
+    return frozenset(tuple(words[i:i + size]) for i in range(len(words) - size + 1))
+
+
+def _jaccard(a: FrozenSet, b: FrozenSet) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def _text_overlap(a: str, b: str, min_overlap: int) -> int:
+    """Length of the longest suffix of `a` that is a prefix of `b` (at least `min_overlap` chars), else 0."""
+    if len(a) < min_overlap or len(b) < min_overlap:
+        return 0
+    probe = b[:min_overlap]
+    start = max(0, len(a) - len(b))
+    while (position := a.find(probe, start)) != -1:
+        if b.startswith(a[position:]):
+            return len(a) - position
+        start = position + 1
+    return 0
+
+
+def _relevance(doc: Document, rank: int) -> float:
+    similarity = doc.metadata.get("similarity")
+    return float(similarity) if similarity is not None else 1.0 / (1 + rank)
+
+
+class ContextBuilder:
+    """
+    Chunks carrying a `start_index` (character offset in their page) are merged by offset;
+    otherwise a shared prefix/suffix of at least `min_overlap` characters marks them as overlapping.
+    """
+
+    def __init__(
+        self,
+        token_budget: int = 3000,
+        duplicate_threshold: float = 0.8,
+        mmr_lambda: float = 0.7,
+        model: str = "gpt-4o",
+        min_overlap: int = 20,
+        min_truncated_tokens: int = 64,
+    ):
+        self.token_budget = token_budget
+        self.duplicate_threshold = duplicate_threshold
+        self.mmr_lambda = mmr_lambda
+        self.min_overlap = min_overlap
+        self.min_truncated_tokens = min_truncated_tokens
+        self.encoding = tiktoken.encoding_for_model(model)
+
+    def build(self, documents: List[Document]) -> BuiltContext:
+        passages = self.merge_overlapping(documents)
+        passages = self.drop_near_duplicates(passages)
+        passages = self.mmr_order(passages)
+        text, packed, tokens = self.pack(passages)
+        return BuiltContext(text=text, documents=packed, token_count=tokens, input_chunks=len(documents))
+
+    # --- 1. Merge overlapping / adjacent chunks ---
+    def merge_overlapping(self, documents: List[Document]) -> List[Tuple[Document, float]]:
+        """Returns (passage, relevance) pairs; a merged passage keeps the best relevance of its parts."""
+        groups: Dict[Tuple, List[Tuple[Document, float]]] = {}
+        for rank, doc in enumerate(documents):
+            key = (doc.metadata.get("source"), doc.metadata.get("page_number"))
+            groups.setdefault(key, []).append((doc, _relevance(doc, rank)))
+
+        passages = []
+        for items in groups.values():
+            if all("start_index" in doc.metadata for doc, _ in items):
+                passages.extend(self._merge_by_offset(items))
+            else:
+                passages.extend(self._merge_by_text(items))
+        return passages
+
+    def _merge_by_offset(self, items: List[Tuple[Document, float]]) -> List[Tuple[Document, float]]:
+        merged: List[Tuple[Document, float]] = []
+        for doc, relevance in sorted(items, key=lambda item: item[0].metadata["start_index"]):
+            if merged:
+                last, last_relevance = merged[-1]
+                gap = doc.metadata["start_index"] - (last.metadata["start_index"] + len(last.page_content))
+                # Overlapping or touching spans of the same page, or consecutive chunks only a separator apart
+                if gap <= len(PASSAGE_SEPARATOR):
+                    tail = doc.page_content[-gap:] if gap <= 0 else PASSAGE_SEPARATOR + doc.page_content
+                    merged[-1] = (self._extend(last, tail), max(last_relevance, relevance))
+                    continue
+            merged.append((doc, relevance))
+        return merged
+
+    def _merge_by_text(self, items: List[Tuple[Document, float]]) -> List[Tuple[Document, float]]:
+        merged = list(items)
+        changed = True
+        while changed:
+            changed = False
+            for i in range(len(merged)):
+                for j in range(len(merged)):
+                    if i == j:
+                        continue
+                    (a, a_relevance), (b, b_relevance) = merged[i], merged[j]
+                    if b.page_content in a.page_content:
+                        combined = (a, max(a_relevance, b_relevance))
+                    elif overlap := _text_overlap(a.page_content, b.page_content, self.min_overlap):
+                        combined = (self._extend(a, b.page_content[overlap:]), max(a_relevance, b_relevance))
+                    else:
+                        continue
+                    merged[i] = combined
+                    del merged[j]
+                    changed = True
+                    break
+                if changed:
+                    break
+        return merged
+
+    @staticmethod
+    def _extend(doc: Document, tail: str) -> Document:
+        return Document(id=doc.id, page_content=doc.page_content + tail, metadata=dict(doc.metadata))
+
+    # --- 2. Near-duplicate removal ---
+    def drop_near_duplicates(self, passages: List[Tuple[Document, float]]) -> List[Tuple[Document, float]]:
+        kept: List[Tuple[Document, float]] = []
+        kept_shingles: List[FrozenSet] = []
+        for doc, relevance in sorted(passages, key=lambda item: item[1], reverse=True):
+            shingles = _shingles(doc.page_content)
+            if any(_jaccard(shingles, other) >= self.duplicate_threshold for other in kept_shingles):
+                continue
+            kept.append((doc, relevance))
+            kept_shingles.append(shingles)
+        return kept
+
+    # --- 3. MMR ordering ---
+    def mmr_order(self, passages: List[Tuple[Document, float]]) -> List[Document]:
+        """Greedy MMR: relevance minus redundancy (shingle similarity) with the passages already chosen."""
+        remaining = [(doc, relevance, _shingles(doc.page_content)) for doc, relevance in passages]
+        chosen: List[Tuple[Document, float, FrozenSet]] = []
+        while remaining:
+            def mmr(item):
+                redundancy = max((_jaccard(item[2], other[2]) for other in chosen), default=0.0)
+                return self.mmr_lambda * item[1] - (1 - self.mmr_lambda) * redundancy
+            best = max(remaining, key=mmr)
+            remaining.remove(best)
+            chosen.append(best)
+        return [doc for doc, _, _ in chosen]
+
+    # --- 4. Token-budgeted packing ---
+    def pack(self, documents: List[Document]) -> Tuple[str, List[Document], int]:
+        blocks: List[str] = []
+        packed: List[Document] = []
+        used = 0
+        for doc in documents:
+            header = ("\n\n" if blocks else "") + self._header(len(packed) + 1, doc)
+            header_tokens = len(self.encoding.encode_ordinary(header))
+            content_tokens = self.encoding.encode_ordinary(doc.page_content)
+            available = self.token_budget - used - header_tokens
+            if len(content_tokens) <= available:
+                content = doc.page_content
+            elif available >= self.min_truncated_tokens:
+                content = self.encoding.decode(content_tokens[:available])
+            else:
+                continue
+            blocks.append(header + content)
+            packed.append(Document(id=doc.id, page_content=content, metadata=doc.metadata))
+            used += header_tokens + min(len(content_tokens), available)
+        return "".join(blocks), packed, used
+
+    @staticmethod
+    def _header(number: int, doc: Document) -> str:
+        source: Optional[str] = doc.metadata.get("source")
+        page = doc.metadata.get("page_number")
+        details = ", ".join(part for part in (source, f"page {page}" if page is not None else None) if part)
+        return f"[SOURCE {number}]" + (f" ({details})" if details else "") + "\n"
@@ -0,0 +1,143 @@
+# app/agent/grading.py
+#
+# Per-chunk relevance grading, cheapest signal first:
+#   1. retrieval scores: chunks below the similarity and keyword-rank thresholds are dropped,
+#   2. an optional local cross-encoder scores the remaining chunks in concurrent batches,
+#   3. the LLM grader only sees borderline chunks, and only when no chunk was accepted outright.
+# Only the best `top_k` accepted chunks are passed on to the generator.
+
+import asyncio
+import threading
+from dataclasses import dataclass
+from typing import Awaitable, Callable, List, Optional, Sequence
+
+from langchain_core.documents import Document
+
+# Async (question, document) -> is the document relevant?
+LLMGrader = Callable[[str, Document], Awaitable[bool]]
+
+
+class CrossEncoderReranker:
+    """
+    Scores (question, chunk) pairs with a local cross-encoder, e.g. `cross-encoder/ms-marco-MiniLM-L-6-v2`.
+    transformers and torch (installed with unstructured[pdf]) are only imported when the model is first used.
+    """
+
+    def __init__(self, model_name: str, batch_size: int = 16, max_length: int = 512):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self._tokenizer = None
+        self._model = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        with self._lock:
+            if self._model is None:
+                from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+                self._tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+                self._model = AutoModelForSequenceClassification.from_pretrained(self.model_name).eval()
+        return self._tokenizer, self._model
+
+    def score(self, question: str, texts: Sequence[str]) -> List[float]:
+        """Relevance probabilities in [0, 1] for one batch of texts."""
+        import torch
+
+        tokenizer, model = self.load()
+        features = tokenizer(
+            [question] * len(texts), list(texts),
+            padding=True, truncation=True, max_length=self.max_length, return_tensors="pt",
+        )
+        with torch.inference_mode():
+            logits = model(**features).logits
+        # ms-marco style models output one relevance logit; two-class models put "relevant" last.
+        if logits.shape[-1] == 1:
+            return torch.sigmoid(logits[:, 0]).tolist()
+        return torch.softmax(logits, dim=-1)[:, -1].tolist()
+
+    async def ascore(self, question: str, texts: Sequence[str]) -> List[float]:
+        """Scores the texts in batches of `batch_size`, running the batches concurrently on the thread pool."""
+        batches = [texts[start:start + self.batch_size] for start in range(0, len(texts), self.batch_size)]
+        results = await asyncio.gather(*(asyncio.to_thread(self.score, question, batch) for batch in batches))
+        return [score for batch in results for score in batch]
+
+
+@dataclass
+class GradingResult:
+    documents: List[Document]  # accepted chunks, best first
+    borderline: int
+    dropped: int
+    used_llm: bool
+
+    @property
+    def relevance(self) -> str:
+        return "relevant" if self.documents else "irrelevant"
+
+
+class RelevanceGrader:
+    """
+    Grades retrieved chunks individually.
+
+    Without a reranker, a chunk's score is its cosine similarity (from the document metadata written by
+    the search): at least `accept_similarity` is relevant, anything lower that passed the thresholds is
+    borderline. With a reranker, its score decides: at least `reranker_accept` is relevant, at most
+    `reranker_reject` is dropped. Borderline chunks go to `llm_grader` (concurrently) only if nothing
+    was accepted; without an LLM grader they are kept in that case.
+    """
+
+    def __init__(
+        self,
+        *,
+        min_similarity: float = 0.25,
+        accept_similarity: float = 0.45,
+        min_lexical_score: float = 0.1,
+        top_k: int = 4,
+        reranker: Optional[CrossEncoderReranker] = None,
+        reranker_accept: float = 0.5,
+        reranker_reject: float = 0.05,
+        llm_grader: Optional[LLMGrader] = None,
+    ):
+        self.min_similarity = min_similarity
+        self.accept_similarity = accept_similarity
+        self.min_lexical_score = min_lexical_score
+        self.top_k = top_k
+        self.reranker = reranker
+        self.reranker_accept = reranker_accept
+        self.reranker_reject = reranker_reject
+        self.llm_grader = llm_grader
+
+    def passes_thresholds(self, doc: Document) -> bool:
+        similarity = doc.metadata.get("similarity")
+        if similarity is None:
+            return True
+        return similarity >= self.min_similarity or doc.metadata.get("lexical_score", 0.0) >= self.min_lexical_score
+
+    async def grade(self, question: str, documents: List[Document]) -> GradingResult:
+        # --- 1. Retrieval score thresholds ---
+        candidates = [doc for doc in documents if self.passes_thresholds(doc)]
+
+        # --- 2. Per-chunk scores: cross-encoder if configured, otherwise the retrieval similarity ---
+        if self.reranker is not None and candidates:
+            scores = await self.reranker.ascore(question, [doc.page_content for doc in candidates])
+            accept, reject = self.reranker_accept, self.reranker_reject
+        else:
+            scores = [doc.metadata.get("similarity", 0.0) for doc in candidates]
+            accept, reject = self.accept_similarity, float("-inf")
+        ranked = sorted(zip(candidates, scores), key=lambda pair: pair[1], reverse=True)
+        accepted = [doc for doc, score in ranked if score >= accept]
+        borderline = [doc for doc, score in ranked if reject < score < accept]
+
+        # --- 3. LLM grader, for borderline chunks only ---
+        used_llm = False
+        if not accepted and borderline:
+            borderline = borderline[:self.top_k]
+            if self.llm_grader is not None:
+                verdicts = await asyncio.gather(*(self.llm_grader(question, doc) for doc in borderline))
+                accepted = [doc for doc, relevant in zip(borderline, verdicts) if relevant]
+                used_llm = True
+            else:
+                accepted = borderline
+
+        kept = accepted[:self.top_k]
+        return GradingResult(documents=kept, borderline=len(borderline), dropped=len(documents) - len(kept), used_llm=used_llm)
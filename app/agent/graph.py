@@ -1,22 +1,52 @@
 # app/agent/graph.py (Phase 4 - With Query Transformation)
+#
+# Nothing is built at import time. `build_components()` creates the OpenAI clients, chains, embeddings and
+# pgvector search from the settings, except the ones passed in (e.g. stand-ins in tests and benchmarks), and
+# `RagAgent` compiles the graph over them. The API serves one agent per worker: it is built in the FastAPI
+# lifespan (app/main.py) or on first use by `get_agent()`, and can be replaced with `set_agent()`.
+
+import asyncio
+import logging
+import os
+import time
+from dataclasses import dataclass, fields
+from typing import Any, Dict, List, Literal, Optional, Tuple
 
-from typing import List, Literal
 import httpx
-
+import sqlalchemy
 from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.pydantic_v1 import BaseModel, Field
-from langchain_openai import ChatOpenAI, OpenAIEmbeddings
-from langchain_community.vectorstores.pgvector import PGVector
+from langchain_core.runnables import Runnable
 from langgraph.graph import StateGraph, END
 from typing import TypedDict
 
+from app.core.admission import (
+    AdmissionControl, AdmittedEmbeddings, AdmittedVectorSearch, Budget, StreamedOutputCallback, estimate_tokens,
+)
 from app.core.config import settings
-
-# --- Shared Components ---
-insecure_client = httpx.Client(verify=False)
-llm_args = {"temperature": 0, "openai_api_key": settings.OPENAI_API_KEY, "http_client": insecure_client}
+from app.core.metrics import LLMMetricsCallback, TracedEmbeddings, trace_node
+from app.core.tracing import get_logger, log_event
+from app.agent.context import ContextBuilder
+from app.agent.grading import CrossEncoderReranker, RelevanceGrader
+from app.agent.memory import ConversationMemory, FollowUpDetector, Turn
+from app.agent.routing import EmbeddingRouter, RouterExample, load_router_examples, parse_few_shot_examples
+from app.services.embedding_cache import CachedEmbeddings
+from app.services.retrieval import PgVectorSearch, multi_query_search
+from app.services.sessions import SessionStore, session_store_from_settings
+from app.services.storage import PgVectorStore
+
+logger = get_logger("graph")
+
+COLLECTION_NAME = "quasar_doc_collection"
+CHAT_MODEL = "gpt-4o"
+EMBEDDING_MODEL = "text-embedding-3-large"
+
+# Every chat model reports its latency and token usage to the Prometheus metrics, and the tokens it
+# streams, so that an answer already partly sent to the client is not retried.
+llm_callbacks = [LLMMetricsCallback(), StreamedOutputCallback()]
 
 # --- 1. DEFINE THE STATE ---
 class GraphState(TypedDict):
@@ -25,6 +55,12 @@ class GraphState(TypedDict):
     answer: str
     route: str
     relevance: str
+    filters: Optional[Dict[str, List[str]]]
+    question_embedding: Optional[List[float]]
+    # Carried over between the turns of a session: the trimmed history, and the compact embedding of the
+    # question that `context` was retrieved for (see app/agent/memory.py).
+    history: List[Turn]
+    context_embedding: Optional[List[float]]
 
 # --- 2. DEFINE ROUTING AND EVALUATION TOOLS ---
 class GradeDocuments(BaseModel):
@@ -41,6 +77,9 @@ class RouteQuery(BaseModel):
     """Route a user query to the most appropriate tool."""
     route: Literal["vectorstore", "conversational"]
 
+# Route of session follow-ups answered from the previous turn's context
+FOLLOWUP_ROUTE = "followup"
+
 # This is our improved prompt with examples (few-shot prompting)
 router_prompt_template = """You are an expert at routing a user question to a vectorstore or to a conversational agent.
 A 'vectorstore' question is one that requires looking up information from a knowledge base.
@@ -58,58 +97,28 @@ User question: {question}
 """
 router_prompt = ChatPromptTemplate.from_template(router_prompt_template)
 
+def router_examples() -> List[RouterExample]:
+    """The router prompt's few-shot examples plus the labeled examples in ROUTER_EXAMPLES_PATH."""
+    examples = parse_few_shot_examples(router_prompt_template)
+    if settings.ROUTER_EXAMPLES_PATH and os.path.exists(settings.ROUTER_EXAMPLES_PATH):
+        examples += load_router_examples(settings.ROUTER_EXAMPLES_PATH)
+    return examples
 
-# --- 3. DEFINE LLM CHAINS ---
-# Router Chain
-# We bind the structured output and the new prompt to the LLM
-routing_llm = ChatOpenAI(
-    model="gpt-4o", 
-    temperature=0, 
-    openai_api_key=settings.OPENAI_API_KEY, 
-    http_client=insecure_client
-).with_structured_output(RouteQuery)
-
-# The router chain now uses the more detailed prompt
-router_chain = router_prompt | routing_llm
-
-def query_router(state: GraphState):
-    """
-    This node will be the new entry point. It decides which path to take.
-    """
-    print("---NODE: QUERY ROUTER---")
-    question = state["question"]
-    # We now invoke the chain which includes the detailed prompt
-    route_decision = router_chain.invoke({"question": question})
-    
-    print(f"Router decision: '{route_decision.route}'")
-    return {"route": route_decision.route}
-
-
-# Query Transformer Chain (New)
-query_transformer_llm = ChatOpenAI(model="gpt-4o", **llm_args).with_structured_output(GeneratedQueries)
+# Query Transformer Prompt (New)
 query_transformer_prompt_template = """You are an expert at crafting search queries.
 Your task is to take a user's question and generate a list of 3 search queries that are optimized for a vector database.
 The queries should be different from each other and cover different aspects or phrasings of the original question.
+If the question follows up on the conversation, make every query self-contained.
 
-Original Question: {question}
+{history}Original Question: {question}
 """
 query_transformer_prompt = ChatPromptTemplate.from_template(query_transformer_prompt_template)
-query_transformer_chain = query_transformer_prompt | query_transformer_llm
 
-# Content Evaluator Chain
-evaluator_llm = ChatOpenAI(model="gpt-4o", **llm_args).with_structured_output(GradeDocuments)
+# Content Evaluator Prompt
 evaluator_prompt_template = "You are a grader assessing the relevance of a retrieved context to a user question...\nHere is the retrieved context:\n{context}\n\nHere is the user question:\n{question}\n\nGrade the relevance..."
 evaluator_prompt = ChatPromptTemplate.from_template(evaluator_prompt_template)
-evaluator_chain = evaluator_prompt | evaluator_llm
-def content_evaluator(state: GraphState):
-    print("---NODE: CONTENT EVALUATOR---")
-    question = state["question"]
-    context = state["context"]
-    relevance_decision = evaluator_chain.invoke({"question": question, "context": context})
-    print(f"Evaluator decision: '{relevance_decision.decision}'")
-    return {"relevance": relevance_decision.decision}
-
-# RAG Generation Chain
+
+# RAG Generation Prompt
 # rag_prompt_template = "You are an assistant for question-answering tasks...\nQuestion: {question}\nContext: {context}\nAnswer:"
 rag_prompt_template = """You are an assistant for question-answering tasks.
 Use the following pieces of retrieved context to answer the question.
@@ -119,91 +128,443 @@ When you use information from a specific source, you MUST cite it in your answer
 If you don't know the answer, just say that you don't know.
 Use three sentences maximum and keep the answer concise.
 
-Question: {question}
+{history}Question: {question}
 Context:
 {context}
 
 Answer (with citations):
 """
-
 rag_prompt = ChatPromptTemplate.from_template(rag_prompt_template)
-rag_llm = ChatOpenAI(model="gpt-4o", **llm_args)
-rag_chain = rag_prompt | rag_llm | StrOutputParser()
-def generate_answer(state: GraphState):
-    print("---NODE: GENERATING ANSWER---")
-    question = state["question"]
-    context = state["context"]
-    answer = rag_chain.invoke({"question": question, "context": context})
-    return {"answer": answer}
-
-# --- 4. DEFINE RAG PIPELINE NODES ---
-embeddings = OpenAIEmbeddings(model="text-embedding-3-large", openai_api_key=settings.OPENAI_API_KEY, http_client=insecure_client)
-vector_store = PGVector(connection_string=settings.DATABASE_URL, embedding_function=embeddings, collection_name="quasar_doc_collection")
-retriever = vector_store.as_retriever()
-
-# This is our new, adaptive retriever function
-def retrieve_context(state: GraphState):
+
+
+# --- 3. COMPONENT FACTORIES ---
+# langchain_openai and langchain_community are imported by the factories, not by this module:
+# together they take seconds to import, and code that injects its own components never needs them.
+def openai_client_args() -> Dict[str, Any]:
+    """
+    The API key and the pooled HTTP clients shared by every OpenAI model of an agent. The graph runs on the
+    event loop, so every call goes through the async client; the sync one serves scripts that call a chain directly.
     """
-    This node now transforms the query and then retrieves documents.
+    insecure_client = httpx.Client(verify=False)
+    insecure_async_client = httpx.AsyncClient(
+        verify=False,
+        limits=httpx.Limits(
+            max_connections=settings.OPENAI_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.OPENAI_MAX_CONNECTIONS,
+        ),
+    )
+    return {"openai_api_key": settings.OPENAI_API_KEY, "http_client": insecure_client, "http_async_client": insecure_async_client}
+
+def chat_model(client_args: Dict[str, Any], temperature: float = 0, **kwargs: Any):
+    from langchain_openai import ChatOpenAI
+
+    return ChatOpenAI(model=CHAT_MODEL, temperature=temperature, callbacks=llm_callbacks, **kwargs, **client_args)
+
+def build_router_chain(client_args: Dict[str, Any]) -> Runnable:
+    # We bind the structured output and the detailed few-shot prompt to the LLM
+    return router_prompt | chat_model(client_args).with_structured_output(RouteQuery)
+
+def build_query_transformer_chain(client_args: Dict[str, Any]) -> Runnable:
+    return query_transformer_prompt | chat_model(client_args).with_structured_output(GeneratedQueries)
+
+def build_evaluator_chain(client_args: Dict[str, Any]) -> Runnable:
+    return evaluator_prompt | chat_model(client_args).with_structured_output(GradeDocuments)
+
+def build_rag_chain(client_args: Dict[str, Any]) -> Runnable:
+    # stream_usage: streamed answers report their token usage too
+    return rag_prompt | chat_model(client_args, stream_usage=True) | StrOutputParser()
+
+def build_conversational_llm(client_args: Dict[str, Any]) -> Runnable:
+    return chat_model(client_args, temperature=0.7)
+
+def build_embeddings(client_args: Dict[str, Any], budget: Optional[Budget] = None) -> Embeddings:
+    """API calls go through `budget` when one is given; cache hits never do."""
+    from langchain_openai import OpenAIEmbeddings
+
+    embeddings = TracedEmbeddings(OpenAIEmbeddings(model=EMBEDDING_MODEL, dimensions=settings.EMBEDDING_DIMENSIONS, **client_args))
+    if budget is not None:
+        embeddings = AdmittedEmbeddings(embeddings, budget)
+    if settings.EMBEDDING_CACHE_ENABLED:
+        embeddings = CachedEmbeddings.for_openai(embeddings, settings.EMBEDDING_CACHE_DIR, settings.EMBEDDING_QUERY_CACHE_SIZE)
+    return embeddings
+
+def build_vector_search(embeddings: Embeddings) -> PgVectorSearch:
     """
-    print("---NODE: ADAPTIVE RETRIEVAL---")
-    question = state["question"]
-    
-    # 1. Transform the query
-    print("Transforming query...")
-    generated_queries = query_transformer_chain.invoke({"question": question})
-    all_queries = [question] + generated_queries.queries
-    print(f"Generated queries for retrieval: {all_queries}")
-    
-    # 2. Retrieve documents for all queries
-    all_retrieved_docs = []
-    for q in all_queries:
-        docs = retriever.invoke(q)
-        all_retrieved_docs.extend(docs)
-        
-    # 3. De-duplicate the results
-    unique_docs = {doc.page_content: doc for doc in all_retrieved_docs}.values()
-    print(f"Retrieved {len(unique_docs)} unique documents.")
-    
-    return {"context": list(unique_docs)}
-
-# Conversational Node
-conversational_llm = ChatOpenAI(model="gpt-4o", temperature=0.7, openai_api_key=settings.OPENAI_API_KEY, http_client=insecure_client)
-def conversational_agent(state: GraphState):
-    print("---NODE: CONVERSATIONAL AGENT---")
-    answer = conversational_llm.invoke(state["question"])
-    return {"answer": answer.content}
-
-# Clarification Node
-def clarification_node(state: GraphState):
-    print("---NODE: CLARIFICATION / FAILURE---")
-    message = "I'm sorry, but I could not find any documents in my knowledge base that are relevant to your question."
-    return {"answer": message}
-
-# --- 5. BUILD THE GRAPH ---
+    Connects to the database: PGVector creates the tables and the collection; searches go through
+    PgVectorSearch (or its asyncpg-pooled subclass PgVectorStore), which uses the ANN index.
+    """
+    from langchain_community.vectorstores.pgvector import PGVector
+
+    PGVector(connection_string=settings.DATABASE_URL, embedding_function=embeddings, collection_name=COLLECTION_NAME)
+    # With psycopg2 the searches run on the default executor, so the pool is sized for the number of concurrent
+    # chats a worker serves. With asyncpg this engine is only used for index management.
+    db_engine = sqlalchemy.create_engine(
+        settings.DATABASE_URL, pool_size=settings.DB_POOL_SIZE, max_overflow=settings.DB_MAX_OVERFLOW, pool_pre_ping=True
+    )
+    return vector_search_for(db_engine, COLLECTION_NAME)
+
+def vector_search_for(engine: sqlalchemy.engine.Engine, collection_name: str) -> PgVectorSearch:
+    """Search over `collection_name` with the configured VECTOR_STORE_DRIVER."""
+    if settings.VECTOR_STORE_DRIVER == "asyncpg":
+        return PgVectorStore.from_settings(engine, collection_name, settings)
+    if settings.VECTOR_STORE_DRIVER == "psycopg2":
+        return PgVectorSearch.from_settings(engine, collection_name, settings)
+    raise ValueError(f"Unknown VECTOR_STORE_DRIVER '{settings.VECTOR_STORE_DRIVER}'")
+
+
+@dataclass
+class AgentComponents:
+    router_chain: Runnable
+    query_transformer_chain: Runnable
+    evaluator_chain: Runnable
+    rag_chain: Runnable
+    conversational_llm: Runnable
+    embeddings: Embeddings
+    vector_search: PgVectorSearch
+    context_builder: ContextBuilder
+    reranker: Optional[CrossEncoderReranker] = None
+    admission: Optional[AdmissionControl] = None
+    sessions: Optional[SessionStore] = None
+    # Pools created by build_components (not those of components passed in), closed by RagAgent.aclose()
+    http_clients: Optional[Tuple[httpx.Client, httpx.AsyncClient]] = None
+    owns_vector_search: bool = False
+    owns_sessions: bool = False
+
+
+OPENAI_COMPONENTS = {"router_chain", "query_transformer_chain", "evaluator_chain", "rag_chain", "conversational_llm", "embeddings"}
+
+def build_components(**overrides: Any) -> AgentComponents:
+    """
+    Builds the agent's components from the settings, except those passed as keyword arguments.
+    OpenAI clients are only created when an OpenAI component is missing, and the database is only
+    contacted when `vector_search` is.
+    """
+    unknown = overrides.keys() - {field.name for field in fields(AgentComponents)}
+    if unknown:
+        raise TypeError(f"Unknown agent components: {', '.join(sorted(unknown))}")
+    components = dict(overrides)
+    admission = components.setdefault("admission", AdmissionControl.from_settings(settings))
+
+    if OPENAI_COMPONENTS - components.keys():
+        # The admission budgets retry rate-limited calls, so the SDK must not retry them as well.
+        client_args = {**openai_client_args(), "max_retries": 0}
+        components["http_clients"] = (client_args["http_client"], client_args["http_async_client"])
+        factories = {
+            "router_chain": build_router_chain,
+            "query_transformer_chain": build_query_transformer_chain,
+            "evaluator_chain": build_evaluator_chain,
+            "rag_chain": build_rag_chain,
+            "conversational_llm": build_conversational_llm,
+            "embeddings": lambda client_args: build_embeddings(client_args, admission.embedding),
+        }
+        for name, factory in factories.items():
+            if name not in components:
+                components[name] = factory(client_args)
+
+    if "vector_search" not in components:
+        components["vector_search"] = build_vector_search(components["embeddings"])
+        components["owns_vector_search"] = True
+    if "context_builder" not in components:
+        components["context_builder"] = ContextBuilder(
+            token_budget=settings.CONTEXT_TOKEN_BUDGET,
+            duplicate_threshold=settings.CONTEXT_DUPLICATE_THRESHOLD,
+            mmr_lambda=settings.CONTEXT_MMR_LAMBDA,
+            model=CHAT_MODEL,
+        )
+    if "sessions" not in components:
+        components["sessions"] = session_store_from_settings(settings)
+        components["owns_sessions"] = True
+    if "reranker" not in components and settings.GRADER_RERANKER_MODEL:
+        components["reranker"] = CrossEncoderReranker(settings.GRADER_RERANKER_MODEL, settings.GRADER_RERANKER_BATCH_SIZE)
+    return AgentComponents(**components)
+
+
+# --- 4. DEFINE THE AGENT AND ITS NODES ---
+class RagAgent:
+    """
+    The compiled RAG graph over one set of components. All nodes are coroutines: drive the graph
+    with `await agent.graph.ainvoke(...)` / `agent.graph.astream(...)`. Chat-model calls and searches go
+    through the admission budgets (embeddings built by `build_components` do too).
+
+    `graph` is stateless. With a session store, `session_graph` is the same graph compiled with its
+    checkpointer: it keeps the history and last context of each session (see `graph_for`).
+    """
+
+    def __init__(self, components: AgentComponents):
+        self.components = components
+        self.admission = components.admission or AdmissionControl.from_settings(settings)
+        self.vector_search = AdmittedVectorSearch(components.vector_search, self.admission.database)
+        self.relevance_grader = RelevanceGrader(
+            min_similarity=settings.GRADER_MIN_SIMILARITY,
+            accept_similarity=settings.GRADER_ACCEPT_SIMILARITY,
+            min_lexical_score=settings.GRADER_MIN_LEXICAL_SCORE,
+            top_k=settings.GRADER_TOP_K,
+            reranker=components.reranker,
+            reranker_accept=settings.GRADER_RERANKER_ACCEPT,
+            reranker_reject=settings.GRADER_RERANKER_REJECT,
+            llm_grader=self.llm_grade if settings.GRADER_LLM_FALLBACK else None,
+        )
+        self.hybrid_search_args = {
+            "semantic_weight": settings.HYBRID_SEMANTIC_WEIGHT,
+            "lexical_weight": settings.HYBRID_LEXICAL_WEIGHT,
+            "candidates": settings.HYBRID_CANDIDATES,
+        } if settings.HYBRID_SEARCH_ENABLED else None
+        self.memory = ConversationMemory(settings.SESSION_HISTORY_TOKENS, settings.SESSION_HISTORY_TURNS, model=CHAT_MODEL)
+        self.follow_ups = FollowUpDetector(
+            reuse_similarity=settings.FOLLOWUP_REUSE_SIMILARITY,
+            min_similarity=settings.FOLLOWUP_MIN_SIMILARITY,
+            dimensions=settings.FOLLOWUP_EMBEDDING_DIMENSIONS,
+        )
+        # Built on first use: the examples are embedded once (and then come from the embedding cache).
+        self.embedding_router: Optional[EmbeddingRouter] = None
+        self.graph = self._compile()
+        self.session_graph = self._compile(components.sessions.checkpointer) if components.sessions else None
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self.components.embeddings
+
+    async def get_embedding_router(self) -> EmbeddingRouter:
+        if self.embedding_router is None:
+            self.embedding_router = await EmbeddingRouter.build(self.embeddings, router_examples(), settings.ROUTER_MIN_MARGIN)
+        return self.embedding_router
+
+    async def call_chat(self, chain: Runnable, inputs: Any) -> Any:
+        """Invokes a chat-model chain within the chat budget, charged for its inputs plus an expected completion."""
+        texts = [str(value) for value in inputs.values()] if isinstance(inputs, dict) else [str(inputs)]
+        tokens = estimate_tokens(*texts) + settings.CHAT_COMPLETION_TOKEN_ESTIMATE
+        return await self.admission.chat.run(lambda: chain.ainvoke(inputs), tokens)
+
+    async def graph_for(self, session_id: Optional[str]) -> Tuple[Any, Dict[str, Any]]:
+        """
+        The graph and run config for a request: the stateless graph, or the session graph on the session's
+        thread (the store is opened on first use). Run the session graph with `checkpoint_during=False`,
+        so that a turn writes one checkpoint rather than one per node.
+        """
+        if session_id is None:
+            return self.graph, {}
+        if self.session_graph is None:
+            raise ValueError("Sessions are disabled (SESSION_STORE=none).")
+        await self.components.sessions.open()
+        return self.session_graph, {"configurable": {"thread_id": session_id}}
+
+    async def query_router(self, state: GraphState):
+        """
+        This node will be the new entry point. It decides which path to take.
+        In "embedding" mode the question embedding decides, and is kept in the state for retrieval;
+        the LLM router is only called when the embedding router is not confident.
+        In a session, a follow-up that the previous turn's context can answer skips retrieval.
+        """
+        question = state["question"]
+        update = {}
+        reuse_possible = bool(state.get("history") and state.get("context")) and not state.get("filters")
+        if settings.ROUTER_MODE == "embedding" or reuse_possible:
+            question_embedding = state.get("question_embedding") or await self.embeddings.aembed_query(question)
+            update["question_embedding"] = question_embedding
+        if reuse_possible and await self.is_follow_up(state, update["question_embedding"]):
+            return {**update, "route": FOLLOWUP_ROUTE}
+
+        if settings.ROUTER_MODE == "embedding":
+            decision = (await self.get_embedding_router()).classify(update["question_embedding"])
+            log_event(
+                logger, "route", router="embedding", route=decision.route, similarity=round(decision.similarity, 4),
+                margin=round(decision.margin, 4), confident=decision.confident,
+            )
+            if decision.confident:
+                return {**update, "route": decision.route}
+
+        # We now invoke the chain which includes the detailed prompt
+        route_decision = await self.call_chat(self.components.router_chain, {"question": question})
+
+        log_event(logger, "route", router="llm", route=route_decision.route)
+        return {**update, "route": route_decision.route}
+
+    async def is_follow_up(self, state: GraphState, question_embedding: List[float]) -> bool:
+        """Whether the question can be answered from the context retrieved for an earlier turn."""
+        decision = self.follow_ups.decide(question_embedding, state.get("context_embedding"))
+        reuse, used_llm = decision.reuse, False
+        if reuse is None:
+            used_llm = settings.FOLLOWUP_LLM_CHECK
+            context = Document(page_content="\n\n".join(doc.page_content for doc in state["context"]))
+            reuse = used_llm and await self.llm_grade(state["question"], context)
+        log_event(
+            logger, "follow_up", reuse=reuse, used_llm=used_llm,
+            similarity=round(decision.similarity, 4) if decision.similarity is not None else None,
+        )
+        return reuse
+
+    async def llm_grade(self, question: str, doc: Document) -> bool:
+        """Grades a single chunk with the LLM evaluator."""
+        decision = await self.call_chat(self.components.evaluator_chain, {"question": question, "context": doc.page_content})
+        return decision.decision == "relevant"
+
+    async def content_evaluator(self, state: GraphState):
+        """
+        Grades the retrieved chunks one by one (score thresholds, optional cross-encoder, LLM for borderline
+        chunks only) and keeps only the best relevant ones for generation.
+        """
+        question = state["question"]
+        context = state["context"]
+        result = await self.relevance_grader.grade(question, context)
+        log_event(
+            logger, "grading", relevance=result.relevance, kept=len(result.documents), dropped=result.dropped,
+            borderline=result.borderline, used_llm=result.used_llm,
+        )
+        return {"relevance": result.relevance, "context": result.documents}
+
+    async def generate_answer(self, state: GraphState):
+        """
+        Packs the graded chunks into a token-budgeted `[SOURCE n]` context and generates the answer.
+        The packed passages replace `context`, so the returned sources match the citation numbers.
+        Follow-ups are answered from the previous turn's passages.
+        """
+        question = state["question"]
+        built = self.components.context_builder.build(state["context"])
+        log_event(logger, "context", chunks=built.input_chunks, passages=len(built.documents), tokens=built.token_count)
+        inputs = {"question": question, "context": built.text, "history": self.memory.format(state.get("history"))}
+        answer = await self.call_chat(self.components.rag_chain, inputs)
+        return {"answer": answer, "context": built.documents}
+
+    # This is our new, adaptive retriever function
+    async def retrieve_context(self, state: GraphState):
+        """
+        This node now transforms the query and then retrieves documents.
+        """
+        question = state["question"]
+
+        # 1. Transform the query (optional: hybrid search already finds exact keyword matches)
+        all_queries = [question]
+        if settings.QUERY_TRANSFORM_ENABLED:
+            inputs = {"question": question, "history": self.memory.format(state.get("history"))}
+            generated_queries = await self.call_chat(self.components.query_transformer_chain, inputs)
+            all_queries += generated_queries.queries
+
+        # 2. Embed all queries in one batch (reusing the router's question embedding), search concurrently and fuse the rankings
+        query_vectors = {question: state["question_embedding"]} if state.get("question_embedding") else {}
+        fused = await multi_query_search(
+            self.vector_search, self.embeddings, all_queries, k=settings.RETRIEVAL_K, rrf_k=settings.RRF_K,
+            filter=state.get("filters"), hybrid=self.hybrid_search_args, query_vectors=query_vectors,
+        )
+        unique_docs = [doc for doc, _ in fused]
+        log_event(logger, "retrieval", queries=len(all_queries), documents=len(unique_docs))
+
+        # The question's embedding was computed here if the router did not need it (ROUTER_MODE=llm)
+        context_embedding = self.follow_ups.compact(query_vectors[question])
+        return {"context": unique_docs, "context_embedding": context_embedding}
+
+    # Conversational Node
+    async def conversational_agent(self, state: GraphState):
+        messages = self.memory.messages(state.get("history"), state["question"])
+        answer = await self.call_chat(self.components.conversational_llm, messages)
+        return {"answer": answer.content, "context": [], "context_embedding": None}
+
+    # Clarification Node
+    async def clarification_node(self, state: GraphState):
+        message = "I'm sorry, but I could not find any documents in my knowledge base that are relevant to your question."
+        return {"answer": message, "context": [], "context_embedding": None}
+
+    # Memory Node
+    async def remember_turn(self, state: GraphState):
+        """Adds the turn to the trimmed history. The full question embedding is dropped from the checkpoint."""
+        history = self.memory.remember(state.get("history"), state["question"], state["answer"])
+        return {"history": history, "question_embedding": None}
+
+    # --- 5. BUILD THE GRAPH ---
+    def _compile(self, checkpointer=None):
+        workflow = StateGraph(GraphState)
+
+        # Every node is wrapped to record its wall time (quasar_node_duration_seconds) and a structured log line.
+        workflow.add_node("router", trace_node("router", self.query_router))
+        workflow.add_node("retrieve", trace_node("retrieve", self.retrieve_context))
+        workflow.add_node("content_evaluator", trace_node("content_evaluator", self.content_evaluator))
+        workflow.add_node("generate", trace_node("generate", self.generate_answer))
+        workflow.add_node("conversational_agent", trace_node("conversational_agent", self.conversational_agent))
+        workflow.add_node("clarification_node", trace_node("clarification_node", self.clarification_node))
+        workflow.add_node("remember", trace_node("remember", self.remember_turn))
+
+        workflow.set_entry_point("router")
+        workflow.add_conditional_edges(
+            "router", decide_query_route,
+            {"vectorstore": "retrieve", "conversational": "conversational_agent", FOLLOWUP_ROUTE: "generate"},
+        )
+        workflow.add_edge("retrieve", "content_evaluator")
+        workflow.add_conditional_edges("content_evaluator", decide_relevance, {"relevant": "generate", "irrelevant": "clarification_node"})
+        workflow.add_edge("generate", "remember")
+        workflow.add_edge("conversational_agent", "remember")
+        workflow.add_edge("clarification_node", "remember")
+        workflow.add_edge("remember", END)
+        return workflow.compile(checkpointer=checkpointer)
+
+    # --- 6. WARM-UP AND SHUTDOWN ---
+    async def warm_up(self) -> Dict[str, float]:
+        """
+        Pays the first request's setup costs up front: fills the database pool, checks for the full-text column,
+        makes the first embedding call (building the embedding router), opens the session store and loads the
+        cross-encoder. A failed step is logged and skipped, since requests would retry it anyway. Returns the
+        seconds spent per step.
+        """
+        steps = {}
+        vector_search = self.components.vector_search
+        if hasattr(vector_search, "awarm_up"):
+            steps["db_pool"] = lambda: vector_search.awarm_up(settings.DB_POOL_SIZE)
+        if self.hybrid_search_args is not None:
+            # Logs once, up front, when the database predates hybrid search and retrieval falls back to vectors
+            if hasattr(vector_search, "ahas_text_search"):
+                steps["text_search"] = vector_search.ahas_text_search
+            elif hasattr(vector_search, "has_text_search"):
+                steps["text_search"] = lambda: asyncio.to_thread(vector_search.has_text_search)
+        if settings.ROUTER_MODE == "embedding":
+            steps["embedding_router"] = self.get_embedding_router
+        else:
+            steps["embeddings"] = lambda: self.embeddings.aembed_query("warm-up")
+        if self.components.sessions is not None:
+            steps["sessions"] = self.components.sessions.open
+        if self.components.reranker is not None:
+            steps["reranker"] = lambda: asyncio.to_thread(self.components.reranker.load)
+
+        timings = {}
+        for name, step in steps.items():
+            started = time.perf_counter()
+            try:
+                await step()
+            except Exception as e:
+                log_event(logger, "warm_up_failed", level=logging.WARNING, step=name, error=str(e))
+            timings[name] = time.perf_counter() - started
+        return timings
+
+    async def aclose(self):
+        """Closes the pools that `build_components` created."""
+        if self.components.http_clients:
+            http_client, http_async_client = self.components.http_clients
+            http_client.close()
+            await http_async_client.aclose()
+        if self.components.owns_vector_search:
+            await self.components.vector_search.aclose()
+        if self.components.owns_sessions and self.components.sessions is not None:
+            await self.components.sessions.aclose()
+
+
 def decide_query_route(state: GraphState):
     return state["route"]
 
 def decide_relevance(state: GraphState):
     return state["relevance"]
 
-print("---BUILDING THE FULL AGENTIC GRAPH---")
-workflow = StateGraph(GraphState)
-
-workflow.add_node("router", query_router)
-workflow.add_node("retrieve", retrieve_context)
-workflow.add_node("content_evaluator", content_evaluator)
-workflow.add_node("generate", generate_answer)
-workflow.add_node("conversational_agent", conversational_agent)
-workflow.add_node("clarification_node", clarification_node)
-
-workflow.set_entry_point("router")
-workflow.add_conditional_edges("router", decide_query_route, {"vectorstore": "retrieve", "conversational": "conversational_agent"})
-workflow.add_edge("retrieve", "content_evaluator")
-workflow.add_conditional_edges("content_evaluator", decide_relevance, {"relevant": "generate", "irrelevant": "clarification_node"})
-workflow.add_edge("generate", END)
-workflow.add_edge("conversational_agent", END)
-workflow.add_edge("clarification_node", END)
-
-rag_graph = workflow.compile()
-print("---AGENTIC GRAPH COMPILED---")
\ No newline at end of file
+
+# --- 7. THE AGENT OF THIS PROCESS ---
+_agent: Optional[RagAgent] = None
+
+def get_agent() -> RagAgent:
+    """The process-wide agent, built from the settings on first use."""
+    global _agent
+    if _agent is None:
+        _agent = RagAgent(build_components())
+    return _agent
+
+def set_agent(agent: Optional[RagAgent]):
+    """Installs `agent` (e.g. one built with stand-in components) as the process-wide agent; None resets it."""
+    global _agent
+    _agent = agent
+
+def has_agent() -> bool:
+    return _agent is not None
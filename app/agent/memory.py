@@ -0,0 +1,96 @@
+# app/agent/memory.py
+#
+# Conversation memory of a session, kept in the graph state and persisted by the checkpointer:
+#   - `ConversationMemory` stores past turns as compact {"question", "answer"} pairs, trimmed to a token budget
+#     (oldest turns first), and formats them for the prompts;
+#   - `FollowUpDetector` decides whether a question can be answered from the context retrieved for an earlier
+#     turn, by comparing its embedding with a truncated embedding of the question that context was retrieved for.
+
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+import tiktoken
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+
+# {"question": ..., "answer": ...}
+Turn = Dict[str, str]
+
+
+class ConversationMemory:
+    """Keeps at most `max_turns` turns and `token_budget` tokens of history; an oversized last answer is truncated."""
+
+    def __init__(self, token_budget: int = 1000, max_turns: int = 10, model: str = "gpt-4o"):
+        self.token_budget = token_budget
+        self.max_turns = max_turns
+        self.encoding = tiktoken.encoding_for_model(model)
+
+    def remember(self, history: Optional[List[Turn]], question: str, answer: str) -> List[Turn]:
+        """The history after this turn."""
+        turns = list(history or [])[-(self.max_turns - 1):] if self.max_turns > 1 else []
+        turns.append({"question": question, "answer": answer})
+        costs = [self._tokens(turn) for turn in turns]
+        while len(turns) > 1 and sum(costs) > self.token_budget:
+            turns.pop(0)
+            costs.pop(0)
+        if costs[0] > self.token_budget:
+            turns[0] = self._truncate(turns[0])
+        return turns
+
+    def _tokens(self, turn: Turn) -> int:
+        return len(self.encoding.encode_ordinary(turn["question"])) + len(self.encoding.encode_ordinary(turn["answer"]))
+
+    def _truncate(self, turn: Turn) -> Turn:
+        available = max(0, self.token_budget - len(self.encoding.encode_ordinary(turn["question"])))
+        answer_tokens = self.encoding.encode_ordinary(turn["answer"])
+        return {"question": turn["question"], "answer": self.encoding.decode(answer_tokens[:available])}
+
+    @staticmethod
+    def format(history: Optional[List[Turn]]) -> str:
+        """The history as a prompt section, or "" without history (so single-turn prompts are unchanged)."""
+        if not history:
+            return ""
+        lines = [f"User: {turn['question']}\nAssistant: {turn['answer']}" for turn in history]
+        return "Conversation so far:\n" + "\n".join(lines) + "\n\n"
+
+    @staticmethod
+    def messages(history: Optional[List[Turn]], question: str) -> List[BaseMessage]:
+        """The history and the new question as chat messages."""
+        messages: List[BaseMessage] = []
+        for turn in history or []:
+            messages += [HumanMessage(turn["question"]), AIMessage(turn["answer"])]
+        return messages + [HumanMessage(question)]
+
+
+@dataclass
+class FollowUpDecision:
+    reuse: Optional[bool]  # None: borderline, to be checked by the LLM
+    similarity: Optional[float]
+
+
+class FollowUpDetector:
+    """
+    A question at least `reuse_similarity` similar to the question the current context was retrieved for is
+    answered from that context; one below `min_similarity` is a new topic and goes through retrieval.
+    Embeddings are compared on their first `dimensions` dimensions, which is also how they are stored.
+    """
+
+    def __init__(self, reuse_similarity: float = 0.75, min_similarity: float = 0.3, dimensions: int = 256):
+        self.reuse_similarity = reuse_similarity
+        self.min_similarity = min_similarity
+        self.dimensions = dimensions
+
+    def compact(self, embedding: Sequence[float]) -> List[float]:
+        """Truncated and re-normalized (text-embedding-3 embeddings keep their meaning when truncated)."""
+        vector = np.asarray(embedding[:self.dimensions], dtype=np.float32)
+        return (vector / max(float(np.linalg.norm(vector)), 1e-12)).tolist()
+
+    def decide(self, question_embedding: Sequence[float], context_embedding: Optional[Sequence[float]]) -> FollowUpDecision:
+        if context_embedding is None:
+            return FollowUpDecision(reuse=None, similarity=None)
+        similarity = float(np.dot(self.compact(question_embedding), context_embedding))
+        if similarity >= self.reuse_similarity:
+            return FollowUpDecision(reuse=True, similarity=similarity)
+        if similarity < self.min_similarity:
+            return FollowUpDecision(reuse=False, similarity=similarity)
+        return FollowUpDecision(reuse=None, similarity=similarity)
@@ -0,0 +1,79 @@
+# app/agent/routing.py
+#
+# Embedding-based query routing. The question is embedded once and compared with one centroid per
+# route, built from labeled example questions. Only questions that fall between two routes need the
+# LLM router; the embedding is then reused by retrieval.
+
+import json
+import re
+from dataclasses import dataclass
+from typing import List, Sequence, Tuple
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+# (question, route)
+RouterExample = Tuple[str, str]
+
+_FEW_SHOT_PATTERN = re.compile(r"User question: '(.+?)', route: '(\w+)'")
+
+
+def parse_few_shot_examples(prompt_template: str) -> List[RouterExample]:
+    """Extracts the `User question: '...', route: '...'` examples of a few-shot router prompt."""
+    return _FEW_SHOT_PATTERN.findall(prompt_template)
+
+
+def load_router_examples(path: str) -> List[RouterExample]:
+    """Reads a JSON Lines file of {"question": ..., "route": ...} objects."""
+    examples = []
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                item = json.loads(line)
+                examples.append((item["question"], item["route"]))
+    return examples
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    return matrix / np.maximum(np.linalg.norm(matrix, axis=-1, keepdims=True), 1e-12)
+
+
+@dataclass
+class RouteDecision:
+    route: str
+    similarity: float  # cosine similarity to the chosen route's centroid
+    margin: float      # lead over the runner-up route
+    confident: bool
+
+
+class EmbeddingRouter:
+    """
+    Nearest-centroid classifier over question embeddings.
+    A decision is confident when the best route leads the runner-up by at least `min_margin`.
+    """
+
+    def __init__(self, routes: Sequence[str], example_vectors: Sequence[Sequence[float]], min_margin: float = 0.05):
+        labels = np.asarray(routes)
+        vectors = _normalize(np.asarray(example_vectors, dtype=np.float32))
+        self.routes = sorted(set(routes))
+        if len(self.routes) < 2:
+            raise ValueError("The embedding router needs labeled examples for at least two routes.")
+        self.centroids = _normalize(np.stack([vectors[labels == route].mean(axis=0) for route in self.routes]))
+        self.min_margin = min_margin
+
+    @classmethod
+    async def build(cls, embeddings: Embeddings, examples: Sequence[RouterExample], min_margin: float = 0.05) -> "EmbeddingRouter":
+        """Embeds the examples in one batch and computes the route centroids."""
+        vectors = await embeddings.aembed_documents([question for question, _ in examples])
+        return cls([route for _, route in examples], vectors, min_margin)
+
+    def classify(self, embedding: Sequence[float]) -> RouteDecision:
+        scores = self.centroids @ _normalize(np.asarray(embedding, dtype=np.float32))
+        best, runner_up = np.argsort(scores)[::-1][:2]
+        margin = float(scores[best] - scores[runner_up])
+        return RouteDecision(
+            route=self.routes[best],
+            similarity=float(scores[best]),
+            margin=margin,
+            confident=margin >= self.min_margin,
+        )
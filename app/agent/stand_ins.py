@@ -0,0 +1,134 @@
+# app/agent/stand_ins.py
+#
+# Deterministic, offline stand-ins for the OpenAI chat and embedding models, used by the benchmark
+# (scripts/run_evaluation.py). Each call sleeps for a configurable latency so that concurrency and
+# pipeline changes can be measured without network calls, API costs or run-to-run noise.
+
+import asyncio
+import re
+import time
+import zlib
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Set
+
+import numpy as np
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.runnables import Runnable, RunnableLambda
+
+STOPWORDS: Set[str] = {
+    "a", "about", "an", "and", "are", "as", "at", "be", "by", "does", "for", "from", "how", "in", "is", "it",
+    "of", "on", "or", "say", "that", "the", "this", "to", "was", "what", "which", "who", "with",
+}
+
+
+def content_words(text: str) -> List[str]:
+    return [word for word in re.findall(r"[a-z0-9]+", text.lower()) if word not in STOPWORDS]
+
+
+class DeterministicEmbeddings(Embeddings):
+    """
+    Feature-hashed bag-of-words vectors: texts sharing content words get similar embeddings,
+    and the same text always gets the same vector.
+    """
+
+    def __init__(self, dimensions: int = 3072, latency: float = 0.0):
+        self.dimensions = dimensions
+        self.latency = latency
+
+    def _embed(self, text: str) -> List[float]:
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for word in content_words(text) or ["<empty>"]:
+            digest = zlib.crc32(word.encode("utf-8"))
+            vector[digest % self.dimensions] += 1.0 if digest & (1 << 31) else -1.0
+        norm = np.linalg.norm(vector)
+        if norm == 0:
+            vector[0], norm = 1.0, 1.0
+        return (vector / norm).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        time.sleep(self.latency)
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        await asyncio.sleep(self.latency)
+        return [self._embed(text) for text in texts]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.aembed_documents([text]))[0]
+
+
+class StandInChatModel(BaseChatModel):
+    """
+    Chat model that answers after `first_token_latency` seconds and streams one word per `token_latency`.
+    Given a `[SOURCE n]` context it cites the first source; otherwise it replies with a greeting.
+    Reports word counts as token usage.
+    """
+
+    first_token_latency: float = 0.5
+    token_latency: float = 0.01
+
+    @property
+    def _llm_type(self) -> str:
+        return "stand-in"
+
+    @staticmethod
+    def _answer(messages: List[BaseMessage]) -> str:
+        prompt = str(messages[-1].content) if messages else ""
+        match = re.search(r"^\[SOURCE 1\][^\n]*\n(.+)", prompt, re.MULTILINE)
+        if match:
+            return "According to the documents, " + " ".join(match.group(1).split()[:40]) + " [1]"
+        return "Hello! How can I help you with the knowledge base today?"
+
+    @staticmethod
+    def _usage(messages: List[BaseMessage], answer: str) -> Dict[str, int]:
+        input_tokens = sum(len(str(message.content).split()) for message in messages)
+        output_tokens = len(answer.split())
+        return {"input_tokens": input_tokens, "output_tokens": output_tokens, "total_tokens": input_tokens + output_tokens}
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        answer = self._answer(messages)
+        time.sleep(self.first_token_latency + self.token_latency * len(answer.split()))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=answer, usage_metadata=self._usage(messages, answer)))])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Optional[AsyncCallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        answer = self._answer(messages)
+        await asyncio.sleep(self.first_token_latency + self.token_latency * len(answer.split()))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=answer, usage_metadata=self._usage(messages, answer)))])
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager: Optional[AsyncCallbackManagerForLLMRun] = None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        answer = self._answer(messages)
+        words = answer.split(" ")
+        await asyncio.sleep(self.first_token_latency)
+        for i, word in enumerate(words):
+            if i:
+                await asyncio.sleep(self.token_latency)
+            content = word if i == 0 else " " + word
+            # Usage is reported once, on the last chunk
+            usage = self._usage(messages, answer) if i == len(words) - 1 else None
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=content, usage_metadata=usage))
+            if run_manager:
+                await run_manager.on_llm_new_token(content, chunk=chunk)
+            yield chunk
+
+
+def stand_in_chain(respond: Callable[[dict], Any], latency: float = 0.5) -> Runnable:
+    """A runnable that returns `respond(inputs)` after `latency` seconds, in place of a structured-output LLM chain."""
+
+    async def ainvoke(inputs: dict) -> Any:
+        await asyncio.sleep(latency)
+        return respond(inputs)
+
+    def invoke(inputs: dict) -> Any:
+        time.sleep(latency)
+        return respond(inputs)
+
+    return RunnableLambda(invoke, afunc=ainvoke)
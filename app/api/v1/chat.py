@@ -1,18 +1,39 @@
 # app/api/v1/chat.py (Updated to return sources)
 
-from fastapi import APIRouter
+import asyncio
+import json
+import logging
+import time
+import sqlalchemy
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
 from pydantic import BaseModel, Field
-from typing import List, Dict, Any
+from typing import AsyncIterator, List, Dict, Any, Optional, Tuple
 
-# Import our compiled graph
-from app.agent.graph import rag_graph
+# The agent (compiled graph and its components) is built at startup, see app/main.py
+from app.agent.graph import get_agent, COLLECTION_NAME
+from app.core.config import settings
+from app.core.metrics import record_cache
+from app.core.tracing import get_logger, log_event
+from app.services.embedding_cache import aembed_queries
+from app.services.storage import AnswerCache, fetch_collection_version, normalize_question
 
 # Define the API router
 router = APIRouter()
+logger = get_logger("chat")
 
 # --- Pydantic Models ---
 class ChatRequest(BaseModel):
     question: str
+    filters: Optional[Dict[str, List[str]]] = Field(
+        default=None,
+        description="Restrict retrieval to chunks whose metadata matches, e.g. {'source': ['documents/report.pdf']}.",
+    )
+    session_id: Optional[str] = Field(
+        default=None, min_length=1, max_length=128,
+        description="Continue this conversation: earlier turns are used as history, and follow-ups can reuse their context.",
+    )
 
 # Our response will now include the answer and a list of source documents
 class Source(BaseModel):
@@ -22,6 +43,7 @@ class Source(BaseModel):
 class ChatResponse(BaseModel):
     answer: str
     sources: List[Source]
+    session_id: Optional[str] = None
 
 
 # --- Primary Chat Endpoint (Updated) ---
@@ -30,27 +52,348 @@ async def chat_with_agent(request: ChatRequest) -> ChatResponse:
     """
     This endpoint takes a user's question, runs it through the RAG agent,
     and returns the final answer along with the source documents used.
+    Answers 429 with Retry-After when the request queue is full (see app/core/admission.py).
     """
-    print("--- CHAT ENDPOINT: Waiting for full response... ---")
-    
-    final_result = rag_graph.invoke({"question": request.question})
-    
-    print("--- CHAT ENDPOINT: Full response received. ---")
+    async with get_agent().admission.requests.admitted():
+        cached_response, question_embedding = await lookup_cached_answer(request)
+        if cached_response is not None:
+            return cached_response
 
-    # Extract the context documents and format them for the response
+        # Await the graph so slow LLM / database calls yield the event loop to other requests.
+        graph, config = await graph_for(request.session_id)
+        final_result = await graph.ainvoke(graph_inputs(request, question_embedding), config, checkpoint_during=False)
+
+    response = ChatResponse(
+        answer=final_result.get("answer", "No answer found."),
+        sources=format_sources(final_result.get("context")),
+        session_id=request.session_id,
+    )
+    cache_answer(request, response, question_embedding)
+    return response
+
+
+def graph_inputs(request: ChatRequest, question_embedding: Optional[List[float]]) -> Dict[str, Any]:
+    """
+    Initial graph state. A question embedding computed for the cache lookup is passed on to the router and retriever.
+    In a session, the other keys (history, last context) come from the session's checkpoint.
+    """
+    return {"question": request.question, "filters": request.filters, "question_embedding": question_embedding}
+
+
+async def graph_for(session_id: Optional[str]):
+    """The agent's stateless graph, or its session graph and the session's run config."""
+    try:
+        return await get_agent().graph_for(session_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def format_sources(context) -> List[Source]:
+    """Extracts the source filename and page of every context document."""
     source_documents = []
-    if final_result.get("context"):
-        for doc in final_result["context"]:
-            # Ensure metadata and source exist before trying to access them
-            if doc.metadata and 'source' in doc.metadata:
-                source_documents.append(
-                    Source(
-                        source=doc.metadata.get('source', 'Unknown'),
-                        page=doc.metadata.get('page_number', 'N/A')
-                    )
+    for doc in context or []:
+        # Ensure metadata and source exist before trying to access them
+        if doc.metadata and 'source' in doc.metadata:
+            source_documents.append(
+                Source(
+                    source=doc.metadata.get('source', 'Unknown'),
+                    page=doc.metadata.get('page_number', 'N/A')
                 )
-    
-    return ChatResponse(
-        answer=final_result.get("answer", "No answer found."),
-        sources=source_documents
-    )
\ No newline at end of file
+            )
+    return source_documents
+
+
+# --- Answer Cache ---
+answer_cache = AnswerCache(
+    ttl_seconds=settings.ANSWER_CACHE_TTL_SECONDS,
+    max_entries=settings.ANSWER_CACHE_MAX_ENTRIES,
+    max_bytes=settings.ANSWER_CACHE_MAX_BYTES,
+    similarity_threshold=settings.ANSWER_CACHE_SIMILARITY_THRESHOLD,
+)
+# A tiny dedicated pool: it is only used to poll the collection version. Created on the first check,
+# so importing the app opens nothing; disposed by the lifespan at shutdown.
+cache_version_engine: Optional[sqlalchemy.engine.Engine] = None
+last_version_check = 0.0
+
+
+def get_cache_version_engine() -> sqlalchemy.engine.Engine:
+    global cache_version_engine
+    if cache_version_engine is None:
+        cache_version_engine = sqlalchemy.create_engine(settings.DATABASE_URL, pool_size=1, max_overflow=0, pool_pre_ping=True)
+    return cache_version_engine
+
+
+def close_cache_version_engine():
+    global cache_version_engine
+    if cache_version_engine is not None:
+        cache_version_engine.dispose()
+        cache_version_engine = None
+
+
+async def refresh_cache_version():
+    """Invalidates the answer cache when the collection has been re-ingested (checked at most every N seconds)."""
+    global last_version_check
+    now = time.monotonic()
+    if now - last_version_check < settings.ANSWER_CACHE_VERSION_CHECK_SECONDS:
+        return
+    last_version_check = now
+    try:
+        version = await asyncio.to_thread(fetch_collection_version, get_cache_version_engine(), COLLECTION_NAME)
+    except Exception as e:
+        log_event(logger, "cache_version_check_failed", level=logging.WARNING, error=str(e))
+        return
+    answer_cache.ensure_version(version)
+
+
+def is_cacheable(request: ChatRequest) -> bool:
+    # Filtered and session answers depend on more than the question, so they are never cached.
+    return settings.ANSWER_CACHE_ENABLED and not request.filters and not getattr(request, "session_id", None)
+
+
+async def lookup_cached_answer(request: ChatRequest) -> Tuple[Optional[ChatResponse], Optional[List[float]]]:
+    """
+    Checks the exact tier, then the semantic tier of the answer cache.
+    Also returns the question embedding computed for the semantic lookup so it can be cached with the answer.
+    """
+    if not is_cacheable(request):
+        return None, None
+
+    await refresh_cache_version()
+    cached_response = answer_cache.get_exact(request.question)
+    if cached_response is not None:
+        record_cache("answer", hits=1)
+        log_event(logger, "answer_cache_hit", tier="exact")
+        return cached_response, None
+
+    question_embedding = await get_agent().embeddings.aembed_query(request.question)
+    cached_response = answer_cache.get_semantic(question_embedding)
+    if cached_response is not None:
+        record_cache("answer", hits=1)
+        log_event(logger, "answer_cache_hit", tier="semantic")
+    else:
+        record_cache("answer", misses=1)
+    return cached_response, question_embedding
+
+
+def cache_answer(request: ChatRequest, response: ChatResponse, question_embedding: Optional[List[float]]):
+    if is_cacheable(request):
+        answer_cache.put(request.question, response, question_embedding, size=len(response.model_dump_json()))
+
+
+@router.get("/cache/stats", summary="Answer cache hit/miss counters")
+async def get_cache_stats() -> Dict[str, Any]:
+    return answer_cache.stats()
+
+
+@router.post("/cache/invalidate", summary="Drop every cached answer")
+async def invalidate_cache() -> Dict[str, Any]:
+    answer_cache.invalidate()
+    return answer_cache.stats()
+
+
+# --- Sessions ---
+@router.get("/sessions/{session_id}", summary="History of a chat session")
+async def get_session(session_id: str) -> Dict[str, Any]:
+    graph, config = await graph_for(session_id)
+    snapshot = await graph.aget_state(config)
+    return {"session_id": session_id, "turns": snapshot.values.get("history", [])}
+
+
+@router.delete("/sessions/{session_id}", summary="Forget a chat session")
+async def delete_session(session_id: str) -> Dict[str, Any]:
+    await graph_for(session_id)
+    await get_agent().components.sessions.delete(session_id)
+    return {"session_id": session_id, "deleted": True}
+
+
+@router.get("/admission/stats", summary="Running and queued requests and upstream calls of this worker")
+async def get_admission_stats() -> Dict[str, Dict[str, Any]]:
+    return get_agent().admission.stats()
+
+
+# --- Streaming Chat Endpoint (Server-Sent Events) ---
+# Only these nodes produce user-facing text; tokens from the router, query transformer
+# and evaluator (structured outputs) are never forwarded to the client.
+ANSWER_NODES = {"generate", "conversational_agent"}
+
+def sse_event(event: str, data: Dict[str, Any]) -> str:
+    """Formats one Server-Sent Event frame."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def stream_agent_events(request: ChatRequest, graph: Any, config: Dict[str, Any]) -> AsyncIterator[str]:
+    """
+    Runs the graph and yields SSE frames as it goes:
+    `node` when a node finishes, `token` for every generated answer token,
+    then a final `sources` event carrying the full answer and its sources.
+    """
+    final_state: Dict[str, Any] = {}
+    streamed_answer = False
+    try:
+        # Inside the try: the lookup embeds the question, and a failure there must still end the stream with `error`
+        cached_response, question_embedding = await lookup_cached_answer(request)
+        if cached_response is not None:
+            yield sse_event("token", {"content": cached_response.answer})
+            yield sse_event("sources", cached_response.model_dump())
+            return
+
+        inputs = graph_inputs(request, question_embedding)
+        async for mode, chunk in graph.astream(inputs, config, stream_mode=["updates", "messages"], checkpoint_during=False):
+            if mode == "messages":
+                message, metadata = chunk
+                if metadata.get("langgraph_node") in ANSWER_NODES and message.content:
+                    streamed_answer = True
+                    yield sse_event("token", {"content": message.content})
+            else:
+                for node, update in chunk.items():
+                    final_state.update(update or {})
+                    yield sse_event("node", {"node": node})
+    except Exception:
+        logger.exception("stream_failed")
+        yield sse_event("error", {"message": "The agent failed to answer this question."})
+        return
+
+    answer = final_state.get("answer", "No answer found.")
+    if not streamed_answer:
+        # Nodes such as the clarification node answer without calling an LLM.
+        yield sse_event("token", {"content": answer})
+
+    response = ChatResponse(answer=answer, sources=format_sources(final_state.get("context")), session_id=request.session_id)
+    cache_answer(request, response, question_embedding)
+    yield sse_event("sources", response.model_dump())
+
+
+@router.post("/chat/stream", summary="Chat with the agent, streaming the answer")
+async def stream_chat_with_agent(request: ChatRequest) -> StreamingResponse:
+    """
+    Same as /chat, but streams progress and answer tokens as Server-Sent Events
+    so the client can render the answer as soon as the first token is generated.
+    The request is admitted before the response starts, so an overloaded worker can still answer 429.
+    """
+    graph, config = await graph_for(request.session_id)
+    return await admitted_stream(stream_agent_events(request, graph, config), media_type="text/event-stream")
+
+
+async def admitted_stream(frames: AsyncIterator[str], media_type: str) -> StreamingResponse:
+    """
+    Admits the request before the response starts (so it can still be rejected with 429) and
+    holds its slot until the last frame is sent.
+    """
+    gate = get_agent().admission.requests
+    admitted = await gate.acquire()
+    released = False
+
+    def release():
+        nonlocal released
+        if not released:
+            released = True
+            gate.release(admitted)
+
+    async def admitted_frames() -> AsyncIterator[str]:
+        try:
+            async for frame in frames:
+                yield frame
+        finally:
+            release()
+
+    return StreamingResponse(
+        admitted_frames(),
+        media_type=media_type,
+        # Disable proxy buffering (nginx) so every frame reaches the client immediately.
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        # Also releases the slot if the stream never started (client gone before the first frame).
+        background=BackgroundTask(release),
+    )
+
+
+# --- Batch Chat Endpoint (NDJSON) ---
+# One request carries many questions. It takes a single admission slot; inside it, all questions are
+# embedded in one batched call and the graph runs them with bounded concurrency. Identical questions
+# (after normalization) are answered once.
+class BatchChatRequest(BaseModel):
+    questions: List[str] = Field(min_length=1, max_length=settings.BATCH_MAX_QUESTIONS)
+    filters: Optional[Dict[str, List[str]]] = Field(default=None, description="Applied to every question.")
+    max_concurrency: Optional[int] = Field(
+        default=None, ge=1, le=settings.BATCH_MAX_CONCURRENCY,
+        description="Questions answered at once (default BATCH_DEFAULT_CONCURRENCY).",
+    )
+
+class BatchChatResult(BaseModel):
+    index: int = Field(description="Position of the question in the request.")
+    question: str
+    answer: Optional[str] = None
+    sources: List[Source] = Field(default_factory=list)
+    cached: bool = False
+    error: Optional[str] = None
+
+
+async def answer_batch(request: BatchChatRequest) -> AsyncIterator[BatchChatResult]:
+    """Yields a result for every question as soon as it is answered: cached answers first, then graph answers."""
+    agent = get_agent()
+    positions: Dict[str, List[int]] = {}
+    for index, question in enumerate(request.questions):
+        positions.setdefault(normalize_question(question), []).append(index)
+    pending = {key: ChatRequest(question=request.questions[indexes[0]], filters=request.filters) for key, indexes in positions.items()}
+
+    def results(key: str, **fields: Any) -> List[BatchChatResult]:
+        return [BatchChatResult(index=index, question=request.questions[index], **fields) for index in positions[key]]
+
+    cacheable = is_cacheable(request)
+    if cacheable:
+        await refresh_cache_version()
+        for key, chat_request in list(pending.items()):
+            cached_response = answer_cache.get_exact(chat_request.question)
+            if cached_response is not None:
+                del pending[key]
+                record_cache("answer", hits=1)
+                for result in results(key, answer=cached_response.answer, sources=cached_response.sources, cached=True):
+                    yield result
+    if not pending:
+        return
+
+    # All remaining questions in one embedding call (cache misses only); the router and retriever reuse them.
+    vectors = await aembed_queries(agent.embeddings, [chat_request.question for chat_request in pending.values()])
+    embeddings = dict(zip(pending, vectors))
+    if cacheable:
+        for key in list(pending):
+            cached_response = answer_cache.get_semantic(embeddings[key])
+            record_cache("answer", hits=int(cached_response is not None), misses=int(cached_response is None))
+            if cached_response is not None:
+                del pending[key]
+                for result in results(key, answer=cached_response.answer, sources=cached_response.sources, cached=True):
+                    yield result
+
+    keys = list(pending)
+    inputs = [graph_inputs(pending[key], embeddings[key]) for key in keys]
+    config = {"max_concurrency": request.max_concurrency or settings.BATCH_DEFAULT_CONCURRENCY}
+    log_event(logger, "batch", questions=len(request.questions), unique=len(positions), running=len(inputs), concurrency=config["max_concurrency"])
+    async for position, output in agent.graph.abatch_as_completed(inputs, config, return_exceptions=True):
+        key = keys[position]
+        if isinstance(output, Exception):
+            log_event(logger, "batch_question_failed", level=logging.WARNING, index=positions[key][0], error=str(output))
+            for result in results(key, error="The agent failed to answer this question."):
+                yield result
+            continue
+        response = ChatResponse(answer=output.get("answer", "No answer found."), sources=format_sources(output.get("context")))
+        cache_answer(pending[key], response, embeddings[key])
+        for result in results(key, answer=response.answer, sources=response.sources):
+            yield result
+
+
+async def batch_ndjson(request: BatchChatRequest) -> AsyncIterator[str]:
+    try:
+        async for result in answer_batch(request):
+            yield result.model_dump_json() + "\n"
+    except Exception:
+        # e.g. the embedding call failed: the questions without a line yet were not answered
+        logger.exception("batch_failed")
+        yield json.dumps({"error": "The batch was aborted."}) + "\n"
+
+
+@router.post("/chat/batch", summary="Answer many questions, streaming results as NDJSON")
+async def batch_chat_with_agent(request: BatchChatRequest) -> StreamingResponse:
+    """
+    Answers every question of the batch and streams one JSON line per question, in completion order
+    (use `index` to match them to the request). Use this rather than one /chat call per question for bulk jobs.
+    """
+    return await admitted_stream(batch_ndjson(request), media_type="application/x-ndjson")
@@ -0,0 +1,370 @@
+# app/core/admission.py
+#
+# Admission control for the chat API. A `/chat` request first passes the request gate: a bounded number of
+# requests run at once, a bounded number wait in a FIFO queue, and the rest are rejected at once with
+# `429 Retry-After` (`Overloaded`). Inside the graph, every chat-completion, embedding and database call goes
+# through its own `Budget`: a concurrency limit, an optional tokens-per-minute rate, and retries with
+# full-jitter exponential backoff on 429s and transient errors. All limits are per worker process.
+
+import asyncio
+import math
+import random
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, List, Optional, Tuple, TypeVar
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from app.core.metrics import ADMISSION_IN_FLIGHT, ADMISSION_QUEUE_DEPTH, ADMISSION_REJECTED, ADMISSION_WAIT_SECONDS, UPSTREAM_RETRIES
+from app.core.tracing import get_logger, log_event
+
+logger = get_logger("admission")
+
+T = TypeVar("T")
+
+# Retried upstream statuses: rate limited, timeouts/conflicts and server errors, as the OpenAI SDK does.
+RETRY_STATUSES = {408, 409, 429, 500, 502, 503, 504}
+RETRY_ERRORS = {"APIConnectionError", "APITimeoutError"}
+
+
+class Overloaded(Exception):
+    """The request queue is full (or the request waited too long): answered with 429 and `Retry-After`."""
+
+    def __init__(self, stage: str, retry_after: float, reason: str):
+        super().__init__(f"{stage} queue is {reason}; retry after {retry_after:.0f}s")
+        self.stage = stage
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+def estimate_tokens(*texts: str) -> int:
+    """Rough token count (4 characters per token) used to charge the rate budgets before a call."""
+    return sum(len(text) for text in texts) // 4 + 1
+
+
+# --- Limits ---
+class Limiter:
+    """
+    At most `max_concurrency` holders; the others wait in FIFO order. Unlike `asyncio.Semaphore` it reports its
+    queue depth, can bound the queue and the wait, and is not bound to the event loop it was first used on.
+    """
+
+    def __init__(self, stage: str, max_concurrency: int, max_waiting: Optional[int] = None):
+        self.stage = stage
+        self.max_concurrency = max_concurrency
+        self.max_waiting = max_waiting
+        self.active = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self, timeout: Optional[float] = None):
+        """Takes a slot, waiting up to `timeout` seconds. Raises `Overloaded` when the queue is full or the wait times out."""
+        if self.active < self.max_concurrency and not self._waiters:
+            self.active += 1
+            self._report()
+            return
+        if self.max_waiting is not None and len(self._waiters) >= self.max_waiting:
+            raise Overloaded(self.stage, 0, "full")
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self._report()
+        try:
+            await asyncio.wait_for(waiter, timeout)
+        except BaseException as e:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over just as the wait was given up
+                self.release()
+            elif waiter in self._waiters:
+                self._waiters.remove(waiter)
+                self._report()
+            if isinstance(e, asyncio.TimeoutError):
+                raise Overloaded(self.stage, 0, "timed out") from None
+            raise
+
+    def release(self):
+        """Hands the slot to the longest-waiting caller, or frees it."""
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                self._report()
+                return
+        self.active -= 1
+        self._report()
+
+    def _report(self):
+        ADMISSION_IN_FLIGHT.labels(self.stage).set(self.active)
+        ADMISSION_QUEUE_DEPTH.labels(self.stage).set(len(self._waiters))
+
+
+class TokenBucket:
+    """
+    Tokens-per-minute budget. Callers reserve their tokens in arrival order, and sleep until the bucket has
+    refilled to cover them; a call larger than one minute's budget is charged the full minute.
+    """
+
+    def __init__(self, tokens_per_minute: int):
+        self.capacity = float(tokens_per_minute)
+        self.rate = tokens_per_minute / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    async def take(self, tokens: int):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+        tokens = min(float(tokens), self.capacity)
+        self.level -= tokens
+        if self.level >= 0:
+            return
+        try:
+            await asyncio.sleep(-self.level / self.rate)
+        except asyncio.CancelledError:
+            self.level += tokens
+            raise
+
+
+# --- Upstream budgets ---
+# Flag of the `Budget.run` attempt in progress, set once the call streamed output to the client
+_attempt_streamed: ContextVar[Optional[List[bool]]] = ContextVar("attempt_streamed", default=None)
+
+
+class Budget:
+    """Concurrency and token-rate budget of one upstream (chat completions, embeddings or the database)."""
+
+    def __init__(
+        self,
+        stage: str,
+        max_concurrency: int,
+        tokens_per_minute: Optional[int] = None,
+        max_retries: int = 0,
+        backoff_base: float = 0.5,
+        backoff_max: float = 20.0,
+    ):
+        self.stage = stage
+        self.limiter = Limiter(stage, max_concurrency)
+        self.bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+    @asynccontextmanager
+    async def slot(self, tokens: int = 1) -> AsyncIterator[None]:
+        """Waits for the rate budget, then for a concurrency slot."""
+        started = time.perf_counter()
+        if self.bucket is not None:
+            await self.bucket.take(tokens)
+        await self.limiter.acquire()
+        ADMISSION_WAIT_SECONDS.labels(self.stage).observe(time.perf_counter() - started)
+        try:
+            yield
+        finally:
+            self.limiter.release()
+
+    async def run(self, call: Callable[[], Awaitable[T]], tokens: int = 1) -> T:
+        """
+        Runs `call()` within the budget, retrying rate-limited and transient failures with jittered backoff.
+        An attempt that already streamed tokens to the client (see `StreamedOutputCallback`) is not retried,
+        since the client would receive the start of the answer twice.
+        """
+        attempt = 0
+        while True:
+            streamed = [False]
+            reset_token = _attempt_streamed.set(streamed)
+            async with self.slot(tokens):
+                try:
+                    return await call()
+                except Exception as e:
+                    status = retry_status(e)
+                    if status is None or attempt >= self.max_retries or streamed[0]:
+                        raise
+                    delay = self.backoff(attempt, retry_after(e))
+                finally:
+                    _attempt_streamed.reset(reset_token)
+            attempt += 1
+            UPSTREAM_RETRIES.labels(self.stage, status).inc()
+            log_event(logger, "upstream_retry", stage=self.stage, status=status, attempt=attempt, delay_ms=round(delay * 1000))
+            # The slot is released while backing off, so other calls can use it.
+            await asyncio.sleep(delay)
+
+    def backoff(self, attempt: int, retry_after_seconds: Optional[float] = None) -> float:
+        """Full jitter: uniform in [0, base * 2^attempt], capped; never shorter than the server's Retry-After."""
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        if retry_after_seconds is not None:
+            delay = max(delay, min(retry_after_seconds, self.backoff_max))
+        return delay
+
+    def stats(self) -> Dict[str, Any]:
+        return {"active": self.limiter.active, "waiting": self.limiter.waiting, "max_concurrency": self.limiter.max_concurrency}
+
+
+class StreamedOutputCallback(BaseCallbackHandler):
+    """Marks the current `Budget.run` attempt as not retryable once a chat model streams its first token."""
+
+    # Only sets a flag: cheap enough to run on the event loop.
+    run_inline = True
+
+    def on_llm_new_token(self, token: str, **kwargs: Any):
+        streamed = _attempt_streamed.get()
+        if token and streamed is not None:
+            streamed[0] = True
+
+
+def retry_status(error: Exception) -> Optional[str]:
+    """The status label of a retryable upstream error (OpenAI SDK errors carry `status_code`), or None."""
+    status = getattr(error, "status_code", None)
+    if status in RETRY_STATUSES:
+        return str(status)
+    if type(error).__name__ in RETRY_ERRORS:
+        return "connection"
+    return None
+
+
+def retry_after(error: Exception) -> Optional[float]:
+    """Seconds from the `retry-after-ms` / `retry-after` headers of an upstream error response."""
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    for header, scale in (("retry-after-ms", 0.001), ("retry-after", 1.0)):
+        try:
+            return float(headers[header]) * scale
+        except (KeyError, TypeError, ValueError):
+            continue
+    return None
+
+
+# --- Request gate ---
+class RequestGate:
+    """
+    Admission of whole `/chat` requests: `max_concurrency` run at once, up to `max_queued` wait (each at most
+    `queue_timeout` seconds), the rest get `Overloaded` right away. Its Retry-After estimate is the time the
+    current queue needs to drain, from a moving average of request durations.
+    """
+
+    def __init__(self, max_concurrency: int, max_queued: int, queue_timeout: Optional[float] = None):
+        self.limiter = Limiter("requests", max_concurrency, max_waiting=max_queued)
+        self.queue_timeout = queue_timeout
+        self.mean_seconds = 1.0
+
+    async def acquire(self) -> float:
+        """Admits a request; returns the admission time to pass to `release`."""
+        started = time.perf_counter()
+        try:
+            await self.limiter.acquire(self.queue_timeout)
+        except Overloaded as e:
+            ADMISSION_REJECTED.labels("requests", e.reason).inc()
+            log_event(logger, "request_rejected", reason=e.reason, waiting=self.limiter.waiting, active=self.limiter.active)
+            raise Overloaded("requests", self.retry_after(), e.reason) from None
+        admitted = time.perf_counter()
+        ADMISSION_WAIT_SECONDS.labels("requests").observe(admitted - started)
+        return admitted
+
+    def release(self, admitted: float):
+        self.mean_seconds = 0.9 * self.mean_seconds + 0.1 * (time.perf_counter() - admitted)
+        self.limiter.release()
+
+    @asynccontextmanager
+    async def admitted(self) -> AsyncIterator[None]:
+        admitted = await self.acquire()
+        try:
+            yield
+        finally:
+            self.release(admitted)
+
+    def retry_after(self) -> int:
+        batches = (self.limiter.waiting + 1) / self.limiter.max_concurrency
+        return max(1, math.ceil(batches * self.mean_seconds))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "active": self.limiter.active, "waiting": self.limiter.waiting, "max_concurrency": self.limiter.max_concurrency,
+            "max_queued": self.limiter.max_waiting, "mean_request_seconds": round(self.mean_seconds, 3),
+        }
+
+
+@dataclass
+class AdmissionControl:
+    requests: RequestGate
+    chat: Budget
+    embedding: Budget
+    database: Budget
+
+    @classmethod
+    def from_settings(cls, settings) -> "AdmissionControl":
+        retries = {
+            "max_retries": settings.UPSTREAM_MAX_RETRIES,
+            "backoff_base": settings.UPSTREAM_BACKOFF_BASE_SECONDS,
+            "backoff_max": settings.UPSTREAM_BACKOFF_MAX_SECONDS,
+        }
+        pool_size = (
+            settings.DB_ASYNC_POOL_MAX_SIZE if settings.VECTOR_STORE_DRIVER == "asyncpg" else settings.DB_POOL_SIZE + settings.DB_MAX_OVERFLOW
+        )
+        return cls(
+            requests=RequestGate(
+                settings.ADMISSION_MAX_CONCURRENT_REQUESTS, settings.ADMISSION_MAX_QUEUED_REQUESTS, settings.ADMISSION_QUEUE_TIMEOUT_SECONDS
+            ),
+            chat=Budget("chat", settings.CHAT_MAX_CONCURRENCY, settings.CHAT_TOKENS_PER_MINUTE, **retries),
+            embedding=Budget("embedding", settings.EMBEDDING_MAX_CONCURRENCY, settings.EMBEDDING_TOKENS_PER_MINUTE, **retries),
+            database=Budget("database", settings.DB_MAX_CONCURRENCY or pool_size, settings.DB_QUERIES_PER_MINUTE),
+        )
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {
+            "requests": self.requests.stats(), "chat": self.chat.stats(),
+            "embedding": self.embedding.stats(), "database": self.database.stats(),
+        }
+
+
+# --- Admitted components ---
+class AdmittedEmbeddings(Embeddings):
+    """
+    Sends async embedding calls through the embedding budget, charged by text length. Wrap it inside the
+    embedding cache, so cache hits are never queued. Sync calls (scripts, ingestion) pass straight through.
+    """
+
+    def __init__(self, underlying: Embeddings, budget: Budget):
+        self.underlying = underlying
+        self.budget = budget
+
+    def __getattr__(self, name: str):
+        if name == "underlying":
+            raise AttributeError(name)
+        return getattr(self.underlying, name)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.underlying.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.underlying.embed_query(text)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await self.budget.run(lambda: self.underlying.aembed_documents(texts), estimate_tokens(*texts))
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.aembed_documents([text]))[0]
+
+
+class AdmittedVectorSearch:
+    """Sends the async searches of a `PgVectorSearch` through the database budget (one unit per query)."""
+
+    def __init__(self, underlying: Any, budget: Budget):
+        self.underlying = underlying
+        self.budget = budget
+
+    def __getattr__(self, name: str):
+        if name == "underlying":
+            raise AttributeError(name)
+        return getattr(self.underlying, name)
+
+    async def asearch(self, embedding: List[float], k: int = 4, **kwargs) -> List[Tuple[Document, float]]:
+        return await self.budget.run(lambda: self.underlying.asearch(embedding, k, **kwargs))
+
+    async def ahybrid_search(self, query_text: str, embedding: List[float], k: int = 4, **kwargs) -> List[Tuple[Document, float]]:
+        return await self.budget.run(lambda: self.underlying.ahybrid_search(query_text, embedding, k, **kwargs))
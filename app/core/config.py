@@ -1,5 +1,6 @@
 # app/core/config.py
 
+from typing import Optional
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 class Settings(BaseSettings):
@@ -7,6 +8,152 @@ class Settings(BaseSettings):
     OPENAI_API_KEY: str
     DATABASE_URL: str
 
+    # Connection pools shared by all concurrent requests in a worker.
+    OPENAI_MAX_CONNECTIONS: int = 100
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 20
+    # Serving-side pgvector driver: "asyncpg" runs searches on one shared asyncpg pool (binary vectors, no
+    # threads); "psycopg2" runs them on the default executor over the SQLAlchemy pool above.
+    VECTOR_STORE_DRIVER: str = "asyncpg"
+    DB_ASYNC_POOL_MIN_SIZE: int = 4
+    DB_ASYNC_POOL_MAX_SIZE: int = 20
+
+    # Retrieval: results per query variant and the reciprocal rank fusion constant.
+    RETRIEVAL_K: int = 4
+    RRF_K: int = 60
+
+    # Embedding size requested from the API (text-embedding-3-large is natively 3072-d; smaller values
+    # are Matryoshka-truncated by OpenAI) and the column type used to store it ("vector" or "halfvec").
+    EMBEDDING_DIMENSIONS: int = 3072
+    VECTOR_STORAGE_TYPE: str = "vector"
+
+    # Vector index: "hnsw", "ivfflat" or "none" (exact scan), with build and per-query search knobs.
+    # The index covers the first VECTOR_INDEX_DIMENSIONS dimensions at VECTOR_INDEX_PRECISION; when that is
+    # lossy, k * VECTOR_RESCORE_FACTOR candidates are re-ranked against the full stored vectors.
+    # VECTOR_ITERATIVE_SCAN (pgvector >= 0.8) keeps metadata-filtered queries on the index; None disables it.
+    VECTOR_INDEX_DIMENSIONS: Optional[int] = 1024
+    VECTOR_INDEX_PRECISION: str = "halfvec"
+    VECTOR_RESCORE_FACTOR: int = 4
+    VECTOR_INDEX_TYPE: str = "hnsw"
+    HNSW_M: int = 16
+    HNSW_EF_CONSTRUCTION: int = 64
+    HNSW_EF_SEARCH: int = 40
+    IVFFLAT_LISTS: int = 100
+    IVFFLAT_PROBES: int = 10
+    VECTOR_ITERATIVE_SCAN: Optional[str] = "relaxed_order"
+
+    # Hybrid search: fused score = semantic weight * cosine similarity + lexical weight * normalized ts_rank_cd,
+    # over HYBRID_CANDIDATES candidates from each index. QUERY_TRANSFORM_ENABLED adds 3 gpt-4o query rewrites.
+    HYBRID_SEARCH_ENABLED: bool = True
+    HYBRID_SEMANTIC_WEIGHT: float = 0.7
+    HYBRID_LEXICAL_WEIGHT: float = 0.3
+    HYBRID_CANDIDATES: int = 20
+    TEXT_SEARCH_CONFIG: str = "english"
+    QUERY_TRANSFORM_ENABLED: bool = True
+
+    # Query routing: "embedding" classifies the question against centroids of labeled examples (the router
+    # prompt's few-shot examples plus ROUTER_EXAMPLES_PATH) and calls the LLM router only when the best
+    # route leads the runner-up by less than ROUTER_MIN_MARGIN. "llm" always calls the LLM router.
+    ROUTER_MODE: str = "embedding"
+    ROUTER_EXAMPLES_PATH: Optional[str] = "app/agent/router_examples.jsonl"
+    ROUTER_MIN_MARGIN: float = 0.05
+
+    # Relevance grading of retrieved chunks (see app/agent/grading.py). GRADER_RERANKER_MODEL enables a
+    # local cross-encoder, e.g. "cross-encoder/ms-marco-MiniLM-L-6-v2". GRADER_LLM_FALLBACK sends borderline
+    # chunks to gpt-4o when no chunk was accepted outright.
+    GRADER_MIN_SIMILARITY: float = 0.25
+    GRADER_ACCEPT_SIMILARITY: float = 0.45
+    GRADER_MIN_LEXICAL_SCORE: float = 0.1
+    GRADER_TOP_K: int = 8
+    GRADER_RERANKER_MODEL: Optional[str] = None
+    GRADER_RERANKER_BATCH_SIZE: int = 16
+    GRADER_RERANKER_ACCEPT: float = 0.5
+    GRADER_RERANKER_REJECT: float = 0.05
+    GRADER_LLM_FALLBACK: bool = True
+
+    # Context assembly for generation: merged, de-duplicated (shingle Jaccard >= threshold), MMR-ordered
+    # passages packed into CONTEXT_TOKEN_BUDGET tokens of the generation model's tokenizer.
+    CONTEXT_TOKEN_BUDGET: int = 3000
+    CONTEXT_DUPLICATE_THRESHOLD: float = 0.8
+    CONTEXT_MMR_LAMBDA: float = 0.7
+
+    # Startup: the agent is built in the app lifespan; AGENT_WARMUP also fills the database pool, makes the
+    # first embedding call and loads the cross-encoder before the first request is served.
+    AGENT_WARMUP: bool = True
+
+    # Admission control, per worker process (split the organization's OpenAI limits across workers). Up to
+    # ADMISSION_MAX_CONCURRENT_REQUESTS chats run at once and ADMISSION_MAX_QUEUED_REQUESTS wait, each at most
+    # ADMISSION_QUEUE_TIMEOUT_SECONDS; beyond that the API answers 429 with Retry-After. Chat-completion,
+    # embedding and database calls each have a concurrency limit and a rate budget (tokens, or queries for the
+    # database, per minute; None = unlimited). DB_MAX_CONCURRENCY defaults to the pool size. Calls failing
+    # with 429 or a transient error are retried UPSTREAM_MAX_RETRIES times with full-jitter exponential backoff.
+    ADMISSION_MAX_CONCURRENT_REQUESTS: int = 32
+    ADMISSION_MAX_QUEUED_REQUESTS: int = 64
+    ADMISSION_QUEUE_TIMEOUT_SECONDS: Optional[float] = 10
+    CHAT_MAX_CONCURRENCY: int = 16
+    CHAT_TOKENS_PER_MINUTE: Optional[int] = None
+    CHAT_COMPLETION_TOKEN_ESTIMATE: int = 300
+    EMBEDDING_MAX_CONCURRENCY: int = 8
+    EMBEDDING_TOKENS_PER_MINUTE: Optional[int] = None
+    DB_MAX_CONCURRENCY: Optional[int] = None
+    DB_QUERIES_PER_MINUTE: Optional[int] = None
+    UPSTREAM_MAX_RETRIES: int = 4
+    UPSTREAM_BACKOFF_BASE_SECONDS: float = 0.5
+    UPSTREAM_BACKOFF_MAX_SECONDS: float = 20
+
+    # Batch chat (/api/v1/chat/batch): questions per request, and questions answered at once by default and
+    # at most. A batch holds one request slot; its upstream calls still go through the budgets above.
+    BATCH_MAX_QUESTIONS: int = 5000
+    BATCH_DEFAULT_CONCURRENCY: int = 16
+    BATCH_MAX_CONCURRENCY: int = 64
+
+    # Chat sessions (requests carrying a session_id): SESSION_STORE is "postgres" (LangGraph checkpoint tables in
+    # DATABASE_URL), "memory" (per process) or "none". History is trimmed to SESSION_HISTORY_TOKENS tokens and
+    # SESSION_HISTORY_TURNS turns. A question at least FOLLOWUP_REUSE_SIMILARITY similar to the one the session's
+    # context was retrieved for is answered from that context, without retrieval; below FOLLOWUP_MIN_SIMILARITY
+    # it is retrieved for; in between, FOLLOWUP_LLM_CHECK lets the gpt-4o evaluator decide (else: retrieval).
+    SESSION_STORE: str = "postgres"
+    SESSION_POOL_SIZE: int = 10
+    SESSION_HISTORY_TOKENS: int = 1000
+    SESSION_HISTORY_TURNS: int = 10
+    FOLLOWUP_REUSE_SIMILARITY: float = 0.75
+    FOLLOWUP_MIN_SIMILARITY: float = 0.3
+    FOLLOWUP_EMBEDDING_DIMENSIONS: int = 256
+    FOLLOWUP_LLM_CHECK: bool = True
+
+    # Structured (JSON) logs of the `quasar.*` loggers
+    LOG_LEVEL: str = "INFO"
+
+    # Persistent embedding cache keyed on (model, dimensions, sha256(text)), shared with ingestion. Query
+    # embeddings are kept apart, in a per-process LRU of EMBEDDING_QUERY_CACHE_SIZE entries.
+    EMBEDDING_CACHE_ENABLED: bool = True
+    EMBEDDING_CACHE_DIR: str = ".cache/embeddings"
+    EMBEDDING_QUERY_CACHE_SIZE: int = 10000
+
+    # Ingestion pipeline: parser processes (None = one per CPU), concurrent embedding
+    # threads, texts per embedding request and documents buffered between stages.
+    INGEST_LOAD_WORKERS: Optional[int] = None
+    INGEST_EMBED_WORKERS: int = 4
+    INGEST_EMBED_BATCH_SIZE: int = 256
+    INGEST_QUEUE_SIZE: int = 8
+
+    # Chunking (see data_ingestion/chunking.py): "structured" packs a document's elements into chunks of at most
+    # CHUNK_MAX_TOKENS embedding tokens, never across pages and starting a new chunk at a section title once the
+    # chunk holds CHUNK_MIN_TOKENS; only longer elements are split, with CHUNK_OVERLAP_TOKENS of overlap.
+    # "recursive" is the former 1000/200-character splitter. Run a --rebuild after changing these.
+    CHUNKER: str = "structured"
+    CHUNK_MAX_TOKENS: int = 512
+    CHUNK_MIN_TOKENS: int = 128
+    CHUNK_OVERLAP_TOKENS: int = 64
+
+    # Answer cache: exact normalized-question tier plus a semantic (cosine similarity) tier.
+    ANSWER_CACHE_ENABLED: bool = True
+    ANSWER_CACHE_TTL_SECONDS: float = 3600
+    ANSWER_CACHE_MAX_ENTRIES: int = 1000
+    ANSWER_CACHE_MAX_BYTES: int = 64 * 1024 * 1024
+    ANSWER_CACHE_SIMILARITY_THRESHOLD: float = 0.95
+    ANSWER_CACHE_VERSION_CHECK_SECONDS: float = 30
+
     model_config = SettingsConfigDict(env_file=".env", env_file_encoding="utf-8")
 
 # This line creates the 'settings' object that your other scripts can import.
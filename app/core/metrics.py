@@ -0,0 +1,153 @@
+# app/core/metrics.py
+#
+# Prometheus metrics for the graph nodes and every external call (LLM, embeddings, pgvector), plus
+# cache hit/miss counters. Served by the `/metrics` endpoint in app/main.py. Each uvicorn worker
+# process keeps its own registry, so scrape the workers individually.
+
+import time
+from typing import Any, Awaitable, Callable, Dict, List
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.embeddings import Embeddings
+from langchain_core.outputs import LLMResult
+from prometheus_client import Counter, Gauge, Histogram
+
+from app.core.tracing import get_logger, log_event
+
+logger = get_logger("metrics")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+REQUEST_SECONDS = Histogram("quasar_request_duration_seconds", "HTTP request time (to the response headers for streams).", ["method", "path", "status"], buckets=LATENCY_BUCKETS)
+NODE_SECONDS = Histogram("quasar_node_duration_seconds", "Wall time of each graph node.", ["node"], buckets=LATENCY_BUCKETS)
+NODE_ERRORS = Counter("quasar_node_errors_total", "Graph node failures.", ["node"])
+LLM_SECONDS = Histogram("quasar_llm_call_duration_seconds", "Chat model call time.", ["model"], buckets=LATENCY_BUCKETS)
+LLM_TOKENS = Counter("quasar_llm_tokens_total", "Chat model tokens.", ["model", "type"])
+EMBEDDING_SECONDS = Histogram("quasar_embedding_call_duration_seconds", "Embedding API call time.", ["model"], buckets=LATENCY_BUCKETS)
+EMBEDDING_TEXTS = Counter("quasar_embedding_texts_total", "Texts sent to the embedding API.", ["model"])
+DB_SECONDS = Histogram("quasar_db_query_duration_seconds", "pgvector query time.", ["operation"], buckets=LATENCY_BUCKETS)
+DB_ROWS = Histogram("quasar_db_rows_returned", "Rows returned per pgvector query.", ["operation"], buckets=(0, 1, 2, 4, 8, 16, 32, 64, 128, 256))
+CACHE_REQUESTS = Counter("quasar_cache_requests_total", "Cache lookups.", ["cache", "result"])
+STARTUP_SECONDS = Gauge("quasar_startup_duration_seconds", "Cold start time of this worker, per phase.", ["phase"])
+# Admission stages: "requests" (whole /chat requests), "chat", "embedding" and "database" (upstream calls)
+ADMISSION_QUEUE_DEPTH = Gauge("quasar_admission_queue_depth", "Requests or calls waiting for admission.", ["stage"])
+ADMISSION_IN_FLIGHT = Gauge("quasar_admission_in_flight", "Requests or calls admitted and running.", ["stage"])
+ADMISSION_WAIT_SECONDS = Histogram("quasar_admission_wait_seconds", "Time spent waiting for admission (queue and rate budget).", ["stage"], buckets=LATENCY_BUCKETS)
+ADMISSION_REJECTED = Counter("quasar_admission_rejected_total", "Requests rejected with 429.", ["stage", "reason"])
+UPSTREAM_RETRIES = Counter("quasar_upstream_retries_total", "Upstream calls retried after a rate limit or transient error.", ["stage", "status"])
+
+
+def record_cache(cache: str, hits: int = 0, misses: int = 0):
+    if hits:
+        CACHE_REQUESTS.labels(cache, "hit").inc(hits)
+    if misses:
+        CACHE_REQUESTS.labels(cache, "miss").inc(misses)
+
+
+def record_db_query(operation: str, seconds: float, rows: int):
+    DB_SECONDS.labels(operation).observe(seconds)
+    DB_ROWS.labels(operation).observe(rows)
+    log_event(logger, "db_query", operation=operation, duration_ms=round(seconds * 1000, 2), rows=rows)
+
+
+def trace_node(name: str, node: Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]]):
+    """Wraps an async graph node to record its wall time and failures."""
+
+    async def traced(state: Dict[str, Any]) -> Dict[str, Any]:
+        started = time.perf_counter()
+        try:
+            return await node(state)
+        except Exception:
+            NODE_ERRORS.labels(name).inc()
+            raise
+        finally:
+            seconds = time.perf_counter() - started
+            NODE_SECONDS.labels(name).observe(seconds)
+            log_event(logger, "node", node=name, duration_ms=round(seconds * 1000, 2))
+
+    traced.__name__ = getattr(node, "__name__", name)
+    return traced
+
+
+class LLMMetricsCallback(BaseCallbackHandler):
+    """Records the time and the prompt/completion tokens of every chat model call."""
+
+    # Only updates counters: cheap enough to run on the event loop.
+    run_inline = True
+
+    def __init__(self):
+        self._started: Dict[UUID, float] = {}
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages: List[List[Any]], *, run_id: UUID, **kwargs: Any):
+        self._started[run_id] = time.perf_counter()
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any):
+        started = self._started.pop(run_id, None)
+        seconds = time.perf_counter() - started if started is not None else None
+        model, prompt_tokens, completion_tokens = self._usage(response)
+        if seconds is not None:
+            LLM_SECONDS.labels(model).observe(seconds)
+        LLM_TOKENS.labels(model, "prompt").inc(prompt_tokens)
+        LLM_TOKENS.labels(model, "completion").inc(completion_tokens)
+        log_event(
+            logger, "llm_call", model=model, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+            duration_ms=round(seconds * 1000, 2) if seconds is not None else None,
+        )
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any):
+        self._started.pop(run_id, None)
+
+    @staticmethod
+    def _usage(response: LLMResult):
+        llm_output = response.llm_output or {}
+        model = llm_output.get("model_name")
+        usage = llm_output.get("token_usage") or {}
+        prompt_tokens, completion_tokens = usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
+        # Streamed calls report usage on the aggregated message instead.
+        for generations in response.generations:
+            for generation in generations:
+                message = getattr(generation, "message", None)
+                if message is None:
+                    continue
+                model = model or message.response_metadata.get("model_name")
+                if not usage and message.usage_metadata:
+                    prompt_tokens += message.usage_metadata.get("input_tokens", 0)
+                    completion_tokens += message.usage_metadata.get("output_tokens", 0)
+        return model or "unknown", prompt_tokens, completion_tokens
+
+
+class TracedEmbeddings(Embeddings):
+    """Times every embedding API call. Other attributes (`model`, `dimensions`) come from the wrapped instance."""
+
+    def __init__(self, underlying: Embeddings):
+        self.underlying = underlying
+
+    def __getattr__(self, name: str):
+        if name == "underlying":
+            raise AttributeError(name)
+        return getattr(self.underlying, name)
+
+    def _record(self, texts: int, seconds: float):
+        model = str(getattr(self.underlying, "model", "unknown"))
+        EMBEDDING_SECONDS.labels(model).observe(seconds)
+        EMBEDDING_TEXTS.labels(model).inc(texts)
+        log_event(logger, "embedding_call", model=model, texts=texts, duration_ms=round(seconds * 1000, 2))
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        started = time.perf_counter()
+        vectors = self.underlying.embed_documents(texts)
+        self._record(len(texts), time.perf_counter() - started)
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        started = time.perf_counter()
+        vectors = await self.underlying.aembed_documents(texts)
+        self._record(len(texts), time.perf_counter() - started)
+        return vectors
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.aembed_documents([text]))[0]
@@ -0,0 +1,57 @@
+# app/core/tracing.py
+#
+# Per-request trace IDs and structured logs (one JSON object per line). The trace ID is held in a
+# context variable, so it follows a request into graph nodes, `asyncio.to_thread` calls and LLM
+# callbacks without being passed around explicitly.
+
+import contextvars
+import json
+import logging
+import sys
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Optional
+
+trace_id_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("trace_id", default=None)
+
+
+def new_trace_id() -> str:
+    return uuid.uuid4().hex
+
+
+def get_trace_id() -> Optional[str]:
+    return trace_id_var.get()
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "event": record.getMessage(),
+            "trace_id": get_trace_id(),
+            **getattr(record, "fields", {}),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(level: str = "INFO"):
+    """Sends every `quasar.*` logger to stdout as JSON lines."""
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(JsonFormatter())
+    logger = logging.getLogger("quasar")
+    logger.handlers = [handler]
+    logger.setLevel(level)
+    logger.propagate = False
+
+
+def get_logger(name: str) -> logging.Logger:
+    return logging.getLogger(f"quasar.{name}")
+
+
+def log_event(logger: logging.Logger, event: str, level: int = logging.INFO, **fields: Any):
+    """Logs `event` with `fields` as top-level JSON keys (plus the current trace ID)."""
+    logger.log(level, event, extra={"fields": fields})
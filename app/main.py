@@ -1,16 +1,58 @@
 # app/main.py (CORS Middleware)
 
-from fastapi import FastAPI
+import time
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 from typing import Dict
 
 # Import the chat router we created
+from app import IMPORT_STARTED
 from app.api.v1 import chat
+from app.agent.graph import get_agent, has_agent, set_agent
+from app.core.admission import Overloaded
+from app.core.config import settings
+from app.core.metrics import REQUEST_SECONDS, STARTUP_SECONDS
+from app.core.tracing import configure_logging, get_logger, log_event, new_trace_id, trace_id_var
+
+configure_logging(settings.LOG_LEVEL)
+logger = get_logger("http")
+IMPORT_SECONDS = time.perf_counter() - IMPORT_STARTED
+
+
+# --- Startup ---
+# The agent is built before the first request is accepted, rather than at import time or on the first
+# request. An agent installed with `set_agent` beforehand (e.g. from stand-ins in tests) is used as is.
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    owns_agent = not has_agent()
+    started = time.perf_counter()
+    agent = get_agent()
+    build_seconds = time.perf_counter() - started
+    warm_up = await agent.warm_up() if settings.AGENT_WARMUP else {}
+
+    phases = {"import": IMPORT_SECONDS, "build": build_seconds, "warm_up": sum(warm_up.values())}
+    for phase, seconds in phases.items():
+        STARTUP_SECONDS.labels(phase).set(seconds)
+    log_event(
+        logger, "startup", cold_start_ms=round(sum(phases.values()) * 1000, 2),
+        **{f"{phase}_ms": round(seconds * 1000, 2) for phase, seconds in phases.items()},
+        warm_up_steps_ms={step: round(seconds * 1000, 2) for step, seconds in warm_up.items()},
+    )
+    yield
+    chat.close_cache_version_engine()
+    if owns_agent:
+        set_agent(None)
+        await agent.aclose()
+
 
 app = FastAPI(
     title="Quasar",
     description="An Agentic, Adaptive RAG Platform for Enterprise Knowledge.",
-    version="0.1.0"
+    version="0.1.0",
+    lifespan=lifespan,
 )
 
 # --- Add CORS Middleware ---
@@ -32,6 +74,47 @@ app.add_middleware(
 # --- End of CORS Middleware section ---
 
 
+# --- Tracing ---
+# Every request gets a trace ID (the caller's X-Request-ID, or a new one). It is attached to every
+# structured log line written while serving the request and returned in the X-Request-ID header.
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    trace_id = request.headers.get("X-Request-ID") or new_trace_id()
+    token = trace_id_var.set(trace_id)
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        response.headers["X-Request-ID"] = trace_id
+        return response
+    finally:
+        seconds = time.perf_counter() - started
+        # Route templates keep the label cardinality bounded
+        route = request.scope.get("route")
+        path = getattr(route, "path", "unmatched")
+        REQUEST_SECONDS.labels(request.method, path, str(status)).observe(seconds)
+        log_event(logger, "request", method=request.method, path=request.url.path, status=status, duration_ms=round(seconds * 1000, 2))
+        trace_id_var.reset(token)
+
+
+# --- Admission Control ---
+# A full request queue is answered right away, telling the client when to come back.
+@app.exception_handler(Overloaded)
+async def overloaded(request: Request, exc: Overloaded) -> JSONResponse:
+    return JSONResponse(
+        status_code=429,
+        content={"detail": f"The server is busy (request queue {exc.reason}), please retry later."},
+        headers={"Retry-After": str(int(exc.retry_after))},
+    )
+
+
+@app.get("/metrics", tags=["Health Check"], include_in_schema=False)
+async def metrics() -> Response:
+    """Prometheus metrics of this worker process."""
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
 @app.get("/", tags=["Health Check"])
 async def read_root() -> Dict[str, str]:
     """A simple health check endpoint."""
@@ -0,0 +1,258 @@
+# app/services/embedding_cache.py
+
+import asyncio
+import fcntl
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from app.core.metrics import record_cache
+
+
+class EmbeddingCache:
+    """
+    Persistent, content-addressed cache of embeddings for one (model, dimensions) pair.
+
+    Stored on disk as two append-only files:
+      - `keys.bin`:    one 32-byte sha256 digest of the text per row
+      - `vectors.f32`: the matching float32 vectors, row-major
+    The vectors are memory-mapped and the keys are held in one sorted numpy array, so a lookup is a
+    vectorized binary search with no per-row Python objects. Writers serialize on a file lock, which
+    makes the cache safe to share between the API workers and ingestion processes.
+    """
+
+    KEY_BYTES = 32
+
+    def __init__(self, cache_dir: str, model: str, dimensions: Optional[int] = None):
+        self.model = model
+        self.dimensions = dimensions
+        name = re.sub(r"[^A-Za-z0-9_.-]", "_", f"{model}-{dimensions or 'native'}")
+        self.path = os.path.join(cache_dir, name)
+        os.makedirs(self.path, exist_ok=True)
+        self._keys_path = os.path.join(self.path, "keys.bin")
+        self._vectors_path = os.path.join(self.path, "vectors.f32")
+        self._meta_path = os.path.join(self.path, "meta.json")
+        self._lock_path = os.path.join(self.path, "lock")
+
+        self._thread_lock = threading.Lock()
+        self._rows = 0
+        self._dim: Optional[int] = None
+        self._sorted_keys = np.empty(0, dtype=f"S{self.KEY_BYTES}")
+        self._order = np.empty(0, dtype=np.int64)
+        self._vectors: Optional[np.ndarray] = None
+
+    def __len__(self) -> int:
+        with self._thread_lock:
+            self._refresh()
+            return self._rows
+
+    @staticmethod
+    def digests(texts: Sequence[str]) -> np.ndarray:
+        return np.array([hashlib.sha256(text.encode("utf-8")).digest() for text in texts], dtype=f"S{EmbeddingCache.KEY_BYTES}")
+
+    def lookup(self, texts: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Looks up a batch of texts.
+        Returns a boolean `found` mask and a (found.sum(), dim) float32 matrix of the cached vectors, in input order.
+        """
+        digests = self.digests(texts)
+        with self._thread_lock:
+            self._refresh()
+            return self._lookup_digests(digests)
+
+    def put(self, texts: Sequence[str], vectors: Sequence[Sequence[float]]):
+        """Appends the vectors of texts that are not cached yet."""
+        if not texts:
+            return
+        matrix = np.asarray(vectors, dtype=np.float32)
+        digests = self.digests(texts)
+
+        with self._thread_lock, self._file_lock():
+            self._refresh()
+            if self._dim is None:
+                self._dim = matrix.shape[1]
+                with open(self._meta_path, "w") as f:
+                    json.dump({"model": self.model, "dimensions": self.dimensions, "dim": self._dim}, f)
+            elif matrix.shape[1] != self._dim:
+                raise ValueError(f"Embedding cache at {self.path} holds {self._dim}-d vectors, got {matrix.shape[1]}-d.")
+
+            found, _ = self._lookup_digests(digests)
+            _, first = np.unique(digests, return_index=True)
+            new_rows = np.zeros(len(digests), dtype=bool)
+            new_rows[first] = True
+            new_rows &= ~found
+            if not new_rows.any():
+                return
+
+            # Vectors first, keys second: a crash in between leaves unreferenced vector bytes,
+            # which the truncate below discards on the next write.
+            with open(self._vectors_path, "ab") as f:
+                f.truncate(self._rows * self._dim * 4)
+                f.write(matrix[new_rows].tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            with open(self._keys_path, "ab") as f:
+                f.truncate(self._rows * self.KEY_BYTES)
+                f.write(digests[new_rows].tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+            self._refresh()
+
+    # --- Internals ---
+    @contextmanager
+    def _file_lock(self):
+        with open(self._lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _refresh(self):
+        """Re-maps the files if another process (or this one) appended rows since the last refresh."""
+        rows = os.path.getsize(self._keys_path) // self.KEY_BYTES if os.path.exists(self._keys_path) else 0
+        if rows == self._rows:
+            return
+        if self._dim is None:
+            with open(self._meta_path) as f:
+                self._dim = json.load(f)["dim"]
+
+        if rows > self._rows:
+            # Only the appended keys are read and merged into the sorted index
+            keys = np.fromfile(self._keys_path, dtype=f"S{self.KEY_BYTES}", count=rows - self._rows, offset=self._rows * self.KEY_BYTES)
+            order = np.argsort(keys, kind="stable")
+            positions = np.searchsorted(self._sorted_keys, keys[order], side="right")
+            self._sorted_keys = np.insert(self._sorted_keys, positions, keys[order])
+            self._order = np.insert(self._order, positions, order + self._rows)
+        else:
+            keys = np.fromfile(self._keys_path, dtype=f"S{self.KEY_BYTES}", count=rows)
+            self._order = np.argsort(keys, kind="stable")
+            self._sorted_keys = keys[self._order]
+        self._vectors = np.memmap(self._vectors_path, dtype=np.float32, mode="r", shape=(rows, self._dim))
+        self._rows = rows
+
+    def _lookup_digests(self, digests: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        if self._rows == 0:
+            return np.zeros(len(digests), dtype=bool), np.empty((0, self._dim or 0), dtype=np.float32)
+        positions = np.minimum(np.searchsorted(self._sorted_keys, digests), self._rows - 1)
+        found = self._sorted_keys[positions] == digests
+        rows = self._order[positions[found]]
+        return found, np.asarray(self._vectors[rows])
+
+
+class QueryCache:
+    """In-memory LRU of query embeddings: user questions are unbounded, so they never reach the disk cache."""
+
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get_many(self, texts: Sequence[str]) -> Dict[str, List[float]]:
+        with self._lock:
+            found = {}
+            for text in texts:
+                if text in self._entries:
+                    self._entries.move_to_end(text)
+                    found[text] = self._entries[text]
+            return found
+
+    def put_many(self, vectors: Dict[str, List[float]]):
+        with self._lock:
+            for text, vector in vectors.items():
+                self._entries[text] = vector
+                self._entries.move_to_end(text)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps an embeddings model so that only texts missing from the cache are sent to the API. Documents go
+    through the persistent `EmbeddingCache`; queries through a bounded in-memory `QueryCache`, so a question
+    asked again is not re-embedded but questions do not accumulate on disk.
+    """
+
+    def __init__(self, underlying: Embeddings, cache: EmbeddingCache, query_cache_size: int = 10000):
+        self.underlying = underlying
+        self.cache = cache
+        self.queries = QueryCache(query_cache_size)
+
+    @classmethod
+    def for_openai(cls, embeddings, cache_dir: str, query_cache_size: int = 10000) -> "CachedEmbeddings":
+        """Builds the cache for an `OpenAIEmbeddings` instance, keyed on its model and dimensions."""
+        return cls(embeddings, EmbeddingCache(cache_dir, embeddings.model, embeddings.dimensions), query_cache_size)
+
+    @staticmethod
+    def _missing(texts: List[str], found: np.ndarray) -> List[str]:
+        hits = int(found.sum())
+        record_cache("embedding", hits=hits, misses=len(texts) - hits)
+        # Unique texts only: a chunk repeated in the batch is embedded once.
+        return list(dict.fromkeys(text for text, hit in zip(texts, found) if not hit))
+
+    @staticmethod
+    def _merge(texts: List[str], found: np.ndarray, cached: np.ndarray, fresh: Dict[str, List[float]]) -> List[List[float]]:
+        cached_rows = iter(cached.tolist())
+        return [next(cached_rows) if hit else fresh[text] for text, hit in zip(texts, found)]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        found, cached = self.cache.lookup(texts)
+        missing = self._missing(texts, found)
+        fresh: Dict[str, List[float]] = {}
+        if missing:
+            vectors = self.underlying.embed_documents(missing)
+            self.cache.put(missing, vectors)
+            fresh = dict(zip(missing, vectors))
+        return self._merge(texts, found, cached, fresh)
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        cached = self.queries.get_many(texts)
+        missing = self._missing(texts, np.array([text in cached for text in texts], dtype=bool))
+        if missing:
+            fresh = dict(zip(missing, self.underlying.embed_documents(missing)))
+            self.queries.put_many(fresh)
+            cached.update(fresh)
+        return [cached[text] for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_queries([text])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        found, cached = await asyncio.to_thread(self.cache.lookup, texts)
+        missing = self._missing(texts, found)
+        fresh: Dict[str, List[float]] = {}
+        if missing:
+            vectors = await self.underlying.aembed_documents(missing)
+            await asyncio.to_thread(self.cache.put, missing, vectors)
+            fresh = dict(zip(missing, vectors))
+        return self._merge(texts, found, cached, fresh)
+
+    async def aembed_queries(self, texts: List[str]) -> List[List[float]]:
+        cached = self.queries.get_many(texts)
+        missing = self._missing(texts, np.array([text in cached for text in texts], dtype=bool))
+        if missing:
+            fresh = dict(zip(missing, await self.underlying.aembed_documents(missing)))
+            self.queries.put_many(fresh)
+            cached.update(fresh)
+        return [cached[text] for text in texts]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.aembed_queries([text]))[0]
+
+
+async def aembed_queries(embeddings: Embeddings, texts: List[str]) -> List[List[float]]:
+    """Embeds a batch of queries in one call, through the query cache when `embeddings` has one."""
+    if isinstance(embeddings, CachedEmbeddings):
+        return await embeddings.aembed_queries(texts)
+    return await embeddings.aembed_documents(texts)
@@ -1 +1,629 @@
-# Hybrid search and retrieval logic here
\ No newline at end of file
+# app/services/retrieval.py
+
+import asyncio
+import contextlib
+import hashlib
+import json
+import logging
+import re
+import statistics
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import sqlalchemy
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from app.core.metrics import record_db_query
+from app.core.tracing import get_logger, log_event
+from app.services.embedding_cache import aembed_queries
+
+# Largest number of dimensions pgvector's HNSW and IVFFlat indexes support, per vector type
+MAX_INDEXED_DIMENSIONS = {"vector": 2000, "halfvec": 4000}
+
+
+def document_key(doc: Document) -> Tuple[str, str]:
+    """Identity of a retrieved chunk: the same text from two different files is two chunks."""
+    return (str(doc.metadata.get("source", "")), doc.page_content)
+
+
+def reciprocal_rank_fusion(ranked_lists: Sequence[Sequence[Document]], k: int = 60) -> List[Tuple[Document, float]]:
+    """
+    Fuses several ranked result lists into a single ranking.
+
+    Each document scores sum(1 / (k + rank)) over the lists it appears in, so chunks that
+    several query variants agree on rise to the top. Returns (document, score) pairs, best first.
+    """
+    scores: Dict[Tuple[str, str], float] = {}
+    docs: Dict[Tuple[str, str], Document] = {}
+    for ranked in ranked_lists:
+        for rank, doc in enumerate(ranked, start=1):
+            key = document_key(doc)
+            docs.setdefault(key, doc)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+
+    fused = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+    return [(docs[key], score) for key, score in fused]
+
+
+# --- Vector Search with ANN Index Management ---
+MetadataFilter = Dict[str, List[str]]
+# A SQL statement with named (`:name`) parameters, and the `SET LOCAL` statements to run before it
+Statement = Tuple[str, Dict[str, Any], List[str]]
+# Parameters holding query vectors, bound in each driver's vector format
+VECTOR_PARAMS = ("query", "compact_query")
+# Full-text column added by `ensure_text_search`, which databases ingested before hybrid search lack
+TEXT_SEARCH_COLUMN_EXISTS = (
+    "SELECT EXISTS (SELECT 1 FROM pg_attribute WHERE attrelid = 'langchain_pg_embedding'::regclass "
+    "AND attname = 'document_tsv' AND NOT attisdropped)"
+)
+TEXT_SEARCH_RECHECK_SECONDS = 60.0
+
+logger = get_logger("retrieval")
+
+
+def vector_literal(vector: Sequence[float]) -> str:
+    """pgvector's text input format."""
+    return json.dumps([float(x) for x in vector])
+
+class PgVectorSearch:
+    """
+    Similarity search over the langchain PGVector tables, backed by an ANN index that this class manages.
+
+    Storage and index can be made compact independently:
+      - `storage_type="halfvec"` stores the full embeddings at half precision (half the table size).
+      - `index_dimensions` indexes only the first N dimensions (Matryoshka truncation, valid for
+        text-embedding-3-*), and `index_precision="halfvec"` indexes them at half precision.
+    When the index is lossy, `search` takes `k * rescore_factor` candidates from the index and re-ranks
+    them by the full stored vectors, which keeps recall close to that of a full-precision index.
+
+    The index is a partial expression index restricted to one collection, so the distance expression
+    in `search` matches it exactly. Per-query knobs: `k`, `ef_search` (HNSW) and `probes` (IVFFlat).
+    Metadata filters are applied in the same statement; with pgvector >= 0.8 iterative index scans keep
+    filtered queries on the index and still return k rows.
+    """
+
+    def __init__(
+        self,
+        engine: sqlalchemy.engine.Engine,
+        collection_name: str,
+        dimensions: int,
+        index_type: str = "hnsw",
+        hnsw_m: int = 16,
+        hnsw_ef_construction: int = 64,
+        ivfflat_lists: int = 100,
+        ef_search: int = 40,
+        probes: int = 10,
+        iterative_scan: Optional[str] = "relaxed_order",
+        storage_type: str = "vector",
+        index_dimensions: Optional[int] = None,
+        index_precision: str = "vector",
+        rescore_factor: int = 4,
+        text_search_config: str = "english",
+    ):
+        if index_type not in ("hnsw", "ivfflat", "none"):
+            raise ValueError(f"Unknown vector index type '{index_type}'")
+        if storage_type not in MAX_INDEXED_DIMENSIONS or index_precision not in MAX_INDEXED_DIMENSIONS:
+            raise ValueError(f"Vector types must be one of {sorted(MAX_INDEXED_DIMENSIONS)}")
+        self.engine = engine
+        self.collection_name = collection_name
+        self.dimensions = dimensions
+        self.index_type = index_type
+        self.hnsw_m = hnsw_m
+        self.hnsw_ef_construction = hnsw_ef_construction
+        self.ivfflat_lists = ivfflat_lists
+        self.ef_search = ef_search
+        self.probes = probes
+        self.iterative_scan = iterative_scan
+        self.storage_type = storage_type
+        self.index_dimensions = min(index_dimensions or dimensions, dimensions)
+        self.index_precision = index_precision
+        self.rescore_factor = rescore_factor
+        self.text_search_config = text_search_config
+        self._collection_id: Optional[str] = None
+        # Whether `document_tsv` exists; a missing column is looked for again every TEXT_SEARCH_RECHECK_SECONDS
+        self._text_search: Optional[bool] = None
+        self._text_search_checked_at = 0.0
+
+    @classmethod
+    def from_settings(cls, engine: sqlalchemy.engine.Engine, collection_name: str, settings, **kwargs) -> "PgVectorSearch":
+        return cls(
+            engine,
+            collection_name,
+            dimensions=settings.EMBEDDING_DIMENSIONS,
+            index_type=settings.VECTOR_INDEX_TYPE,
+            hnsw_m=settings.HNSW_M,
+            hnsw_ef_construction=settings.HNSW_EF_CONSTRUCTION,
+            ivfflat_lists=settings.IVFFLAT_LISTS,
+            ef_search=settings.HNSW_EF_SEARCH,
+            probes=settings.IVFFLAT_PROBES,
+            iterative_scan=settings.VECTOR_ITERATIVE_SCAN,
+            storage_type=settings.VECTOR_STORAGE_TYPE,
+            index_dimensions=settings.VECTOR_INDEX_DIMENSIONS,
+            index_precision=settings.VECTOR_INDEX_PRECISION,
+            rescore_factor=settings.VECTOR_RESCORE_FACTOR,
+            text_search_config=settings.TEXT_SEARCH_CONFIG,
+            **kwargs,
+        )
+
+    @property
+    def collection_id(self) -> str:
+        if self._collection_id is None:
+            with self.engine.connect() as connection:
+                row = connection.execute(
+                    sqlalchemy.text("SELECT uuid FROM langchain_pg_collection WHERE name = :name"),
+                    {"name": self.collection_name},
+                ).first()
+            if row is None:
+                raise ValueError(f"Collection '{self.collection_name}' not found")
+            self._collection_id = str(row[0])
+        return self._collection_id
+
+    @property
+    def index_prefix(self) -> str:
+        # Derived from the collection name, not its id: `--rebuild` recreates the collection under a new id,
+        # and the indexes of the old one must still be found (and dropped).
+        return f"ix_quasar_{hashlib.sha1(self.collection_name.encode()).hexdigest()[:8]}_"
+
+    @property
+    def index_name(self) -> str:
+        # The expression is part of the name, so changing the compact settings builds a new index.
+        signature = f"{self.collection_id}:{self._index_expression()}"
+        return f"{self.index_prefix}{self.index_type}_{hashlib.sha1(signature.encode()).hexdigest()[:10]}"
+
+    @property
+    def rescores(self) -> bool:
+        """Whether the index is lossy compared to the stored vectors, so candidates need re-ranking."""
+        return self.index_dimensions < self.dimensions or (self.index_precision == "halfvec" and self.storage_type == "vector")
+
+    def _full_type(self) -> str:
+        return f"{self.storage_type}({self.dimensions})"
+
+    def _index_type(self) -> str:
+        return f"{self.index_precision}({self.index_dimensions})"
+
+    def _index_expression(self) -> str:
+        if self.index_dimensions < self.dimensions:
+            return f"(subvector(embedding, 1, {self.index_dimensions})::{self._index_type()})"
+        return f"(embedding::{self._index_type()})"
+
+    # --- Connections ---
+    def warm_up(self, connections: int = 1):
+        """Opens `connections` pooled connections at once (so they stay in the pool) and resolves the collection id."""
+        with contextlib.ExitStack() as stack:
+            for _ in range(connections):
+                stack.enter_context(self.engine.connect()).execute(sqlalchemy.text("SELECT 1"))
+        # Looked up once, then cached
+        self.collection_id
+
+    async def awarm_up(self, connections: int = 1):
+        await asyncio.to_thread(self.warm_up, connections)
+
+    async def aclose(self):
+        self.engine.dispose()
+
+    # --- Storage and index management ---
+    def ensure_storage(self):
+        """
+        Converts the embedding column to the configured storage type (e.g. halfvec(3072)) if needed.
+        This rewrites the table and drops its ANN indexes, so run it from ingestion, not while serving.
+        """
+        with self.engine.connect() as connection:
+            current = connection.execute(sqlalchemy.text(
+                "SELECT format_type(atttypid, atttypmod) FROM pg_attribute "
+                "WHERE attrelid = 'langchain_pg_embedding'::regclass AND attname = 'embedding'"
+            )).scalar()
+        wanted = self._full_type()
+        if current == wanted or (self.storage_type == "vector" and current == "vector"):
+            return
+        print(f"Converting embedding column from {current} to {wanted}...")
+        self._drop_indexes()
+        with self.engine.begin() as connection:
+            connection.execute(sqlalchemy.text(
+                f"ALTER TABLE langchain_pg_embedding ALTER COLUMN embedding TYPE {wanted} USING embedding::{wanted}"
+            ))
+
+    def ensure_text_search(self):
+        """
+        Adds the full-text column used by `hybrid_search` and its GIN index.
+        The column is generated from `document`, so Postgres fills it on every insert.
+        """
+        if not re.fullmatch(r"[A-Za-z_]+", self.text_search_config):
+            raise ValueError(f"Invalid text search configuration '{self.text_search_config}'")
+        with self.engine.begin() as connection:
+            connection.execute(sqlalchemy.text(
+                "ALTER TABLE langchain_pg_embedding ADD COLUMN IF NOT EXISTS document_tsv tsvector "
+                f"GENERATED ALWAYS AS (to_tsvector('{self.text_search_config}', coalesce(document, ''))) STORED"
+            ))
+        with self.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+            connection.execute(sqlalchemy.text(
+                "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_langchain_pg_embedding_document_tsv "
+                "ON langchain_pg_embedding USING gin (document_tsv)"
+            ))
+        self._text_search = True
+
+    def has_text_search(self) -> bool:
+        """Whether the full-text column exists, i.e. whether the collection was ingested with `ensure_text_search`."""
+        if self._text_search_unknown():
+            with self.engine.connect() as connection:
+                self._set_text_search(bool(connection.execute(sqlalchemy.text(TEXT_SEARCH_COLUMN_EXISTS)).scalar()))
+        return bool(self._text_search)
+
+    def _text_search_unknown(self) -> bool:
+        return not self._text_search and time.monotonic() - self._text_search_checked_at >= TEXT_SEARCH_RECHECK_SECONDS
+
+    def _set_text_search(self, exists: bool):
+        if not exists and self._text_search is None:
+            log_event(logger, "text_search_missing", level=logging.WARNING,
+                      message="document_tsv not found, hybrid search falls back to vector search until ingestion adds it")
+        self._text_search = exists
+        self._text_search_checked_at = time.monotonic()
+
+    def index_definition(self) -> str:
+        limit = MAX_INDEXED_DIMENSIONS[self.index_precision]
+        if self.index_dimensions > limit:
+            raise ValueError(
+                f"pgvector cannot build an {self.index_type} index on {self.index_dimensions}-dimensional "
+                f"{self.index_precision} (limit {limit}). Set VECTOR_INDEX_DIMENSIONS or VECTOR_INDEX_PRECISION=halfvec."
+            )
+        opclass = f"{self.index_precision}_cosine_ops"
+        if self.index_type == "hnsw":
+            method = f"hnsw ({self._index_expression()} {opclass}) WITH (m = {int(self.hnsw_m)}, ef_construction = {int(self.hnsw_ef_construction)})"
+        else:
+            method = f"ivfflat ({self._index_expression()} {opclass}) WITH (lists = {int(self.ivfflat_lists)})"
+        return (
+            f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {self.index_name} ON langchain_pg_embedding "
+            f"USING {method} WHERE collection_id = '{self.collection_id}'"
+        )
+
+    def ensure_index(self):
+        """
+        Builds the ANN index if it does not exist yet and drops indexes left over from other settings.
+        Built concurrently, so searches keep working.
+        """
+        if self.index_type == "none":
+            return
+        statement = self.index_definition()
+        self._drop_indexes(keep=self.index_name)
+        print(f"Ensuring vector index {self.index_name} ({self.index_type} on {self._index_expression()})...")
+        with self.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+            connection.execute(sqlalchemy.text(statement))
+
+    def rebuild_index(self):
+        """Recreates the index, e.g. after IVFFlat lists were re-tuned for a much larger collection."""
+        if self.index_type == "none":
+            return
+        self._drop_indexes()
+        self.ensure_index()
+
+    def size_report(self) -> Dict[str, int]:
+        """Bytes used by the chunk table (with TOAST) and by each of its indexes."""
+        with self.engine.connect() as connection:
+            table = connection.execute(sqlalchemy.text("SELECT pg_table_size('langchain_pg_embedding')")).scalar()
+            indexes = connection.execute(sqlalchemy.text(
+                "SELECT indexrelname, pg_relation_size(indexrelid) FROM pg_stat_user_indexes "
+                "WHERE relname = 'langchain_pg_embedding'"
+            )).fetchall()
+        return {"table": int(table), **{name: int(size) for name, size in indexes}}
+
+    def _drop_indexes(self, keep: Optional[str] = None):
+        """
+        Drops this collection's ANN indexes (except `keep`), including those built for an earlier id of the
+        collection. Indexes named before the collection prefix existed are matched on the current id.
+        """
+        with self.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+            names = connection.execute(
+                sqlalchemy.text(
+                    "SELECT indexname FROM pg_indexes WHERE tablename = 'langchain_pg_embedding' "
+                    "AND (indexname LIKE :prefix OR (indexname ~ '^ix_quasar_(hnsw|ivfflat)_' AND indexdef LIKE :collection))"
+                ),
+                {"prefix": self.index_prefix.replace("_", "\\_") + "%", "collection": f"%{self.collection_id}%"},
+            ).scalars().all()
+            for name in names:
+                if name != keep:
+                    print(f"Dropping vector index {name}...")
+                    connection.execute(sqlalchemy.text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+
+    # --- Search ---
+    def search(
+        self,
+        embedding: List[float],
+        k: int = 4,
+        *,
+        ef_search: Optional[int] = None,
+        probes: Optional[int] = None,
+        filter: Optional[MetadataFilter] = None,
+        exact: bool = False,
+    ) -> List[Tuple[Document, float]]:
+        """
+        Returns the k nearest chunks as (document, cosine similarity) pairs, best first.
+        `filter` maps a metadata key to the accepted values, e.g. {"source": ["documents/a.pdf"]}.
+        `exact` scans the full-precision vectors without the index, which gives the ground truth for recall.
+        The similarity is also added to the document metadata as `similarity`, for the relevance grader.
+        """
+        started = time.perf_counter()
+        rows = self._fetch_rows(lambda: self._search_statement(embedding, k, filter, ef_search, probes, exact))
+        record_db_query("exact_search" if exact else "vector_search", time.perf_counter() - started, len(rows))
+        return self._search_results(rows)
+
+    async def asearch(self, embedding: List[float], k: int = 4, **kwargs) -> List[Tuple[Document, float]]:
+        return await asyncio.to_thread(self.search, embedding, k, **kwargs)
+
+    def _search_statement(
+        self,
+        embedding: List[float],
+        k: int,
+        filter: Optional[MetadataFilter],
+        ef_search: Optional[int],
+        probes: Optional[int],
+        exact: bool,
+    ) -> Statement:
+        params: Dict[str, Any] = {
+            "query": embedding,
+            "compact_query": embedding[:self.index_dimensions],
+            "collection_id": self.collection_id,
+            "k": k,
+        }
+        where_clause = self._where_clause(filter, params)
+
+        full_distance = f"embedding <=> {self._full_query()}"
+        index_distance = f"{self._index_expression()} <=> {self._compact_query()}"
+        limit = k
+        if exact:
+            statement = (
+                f"SELECT uuid, document, cmetadata, {full_distance} AS distance "
+                f"FROM langchain_pg_embedding WHERE {where_clause} ORDER BY distance LIMIT :k"
+            )
+        elif self.rescores:
+            # Candidates from the compact index, re-ranked by the full-precision vectors
+            limit = params["candidates"] = k * self.rescore_factor
+            statement = (
+                "WITH candidates AS ("
+                f"SELECT uuid, document, cmetadata, embedding FROM langchain_pg_embedding WHERE {where_clause} "
+                f"ORDER BY {index_distance} LIMIT :candidates) "
+                f"SELECT uuid, document, cmetadata, {full_distance} AS distance FROM candidates ORDER BY distance LIMIT :k"
+            )
+        else:
+            statement = (
+                f"SELECT uuid, document, cmetadata, {index_distance} AS distance "
+                f"FROM langchain_pg_embedding WHERE {where_clause} ORDER BY distance LIMIT :k"
+            )
+        return statement, params, self._session_settings(ef_search, probes, limit, filtered=bool(filter), exact=exact)
+
+    @staticmethod
+    def _search_results(rows: List[Dict[str, Any]]) -> List[Tuple[Document, float]]:
+        results = []
+        for row in rows:
+            similarity = 1.0 - float(row["distance"])
+            metadata = {**(row["cmetadata"] or {}), "similarity": similarity}
+            results.append((Document(id=str(row["uuid"]), page_content=row["document"], metadata=metadata), similarity))
+        return results
+
+    def hybrid_search(
+        self,
+        query_text: str,
+        embedding: List[float],
+        k: int = 4,
+        *,
+        semantic_weight: float = 0.7,
+        lexical_weight: float = 0.3,
+        candidates: int = 20,
+        ef_search: Optional[int] = None,
+        probes: Optional[int] = None,
+        filter: Optional[MetadataFilter] = None,
+    ) -> List[Tuple[Document, float]]:
+        """
+        Semantic + keyword search in one statement.
+
+        The ANN index supplies the `candidates` nearest chunks and the full-text GIN index the `candidates`
+        best `ts_rank_cd` matches. Each chunk in the union is scored
+        `semantic_weight * cosine similarity (full vectors) + lexical_weight * rank / (rank + 1)`.
+        Exact identifiers and acronyms are found even when their embedding is not close to the question.
+        Returns (document, fused score) pairs, best first. The two component scores are added to the
+        document metadata as `similarity` and `lexical_score`. On a database ingested before the full-text
+        column existed, this is a plain vector search.
+        """
+        if not self.has_text_search():
+            return self.search(embedding, k, ef_search=ef_search, probes=probes, filter=filter)
+        args = (query_text, embedding, k, semantic_weight, lexical_weight, candidates, ef_search, probes, filter)
+        started = time.perf_counter()
+        rows = self._fetch_rows(lambda: self._hybrid_statement(*args))
+        record_db_query("hybrid_search", time.perf_counter() - started, len(rows))
+        return self._hybrid_results(rows)
+
+    async def ahybrid_search(self, query_text: str, embedding: List[float], k: int = 4, **kwargs) -> List[Tuple[Document, float]]:
+        return await asyncio.to_thread(self.hybrid_search, query_text, embedding, k, **kwargs)
+
+    def _hybrid_statement(self, query_text, embedding, k, semantic_weight, lexical_weight, candidates, ef_search, probes, filter) -> Statement:
+        params: Dict[str, Any] = {
+            "query": embedding,
+            "compact_query": embedding[:self.index_dimensions],
+            "query_text": query_text,
+            "ts_config": self.text_search_config,
+            "collection_id": self.collection_id,
+            "candidates": max(candidates, k),
+            "semantic_weight": semantic_weight,
+            "lexical_weight": lexical_weight,
+            "k": k,
+        }
+        where_clause = self._where_clause(filter, params)
+        index_distance = f"{self._index_expression()} <=> {self._compact_query()}"
+        statement = f"""
+            WITH semantic AS (
+                SELECT uuid FROM langchain_pg_embedding WHERE {where_clause}
+                ORDER BY {index_distance} LIMIT :candidates
+            ),
+            lexical AS (
+                SELECT uuid, ts_rank_cd(document_tsv, query, 32) AS lexical_score
+                FROM langchain_pg_embedding, websearch_to_tsquery(CAST(CAST(:ts_config AS text) AS regconfig), :query_text) AS query
+                WHERE {where_clause} AND document_tsv @@ query
+                ORDER BY lexical_score DESC LIMIT :candidates
+            ),
+            scored AS (
+                SELECT e.uuid, e.document, e.cmetadata,
+                       1 - (e.embedding <=> {self._full_query()}) AS similarity,
+                       coalesce(l.lexical_score, 0) AS lexical_score
+                FROM (SELECT uuid FROM semantic UNION SELECT uuid FROM lexical) AS c
+                JOIN langchain_pg_embedding e ON e.uuid = c.uuid
+                LEFT JOIN lexical l ON l.uuid = c.uuid
+            )
+            SELECT uuid, document, cmetadata, similarity, lexical_score,
+                   :semantic_weight * similarity + :lexical_weight * lexical_score AS score
+            FROM scored ORDER BY score DESC LIMIT :k
+        """
+        return statement, params, self._session_settings(ef_search, probes, params["candidates"], filtered=bool(filter), exact=False)
+
+    @staticmethod
+    def _hybrid_results(rows: List[Dict[str, Any]]) -> List[Tuple[Document, float]]:
+        results = []
+        for row in rows:
+            metadata = {**(row["cmetadata"] or {}), "similarity": float(row["similarity"]), "lexical_score": float(row["lexical_score"])}
+            results.append((Document(id=str(row["uuid"]), page_content=row["document"], metadata=metadata), float(row["score"])))
+        return results
+
+    # --- Statement execution ---
+    def _full_query(self) -> str:
+        # Query vectors are bound as `vector` and cast in SQL, so drivers with a binary codec for `vector` only work for halfvec too.
+        return f"CAST(:query AS vector)::{self._full_type()}"
+
+    def _compact_query(self) -> str:
+        return f"CAST(:compact_query AS vector)::{self._index_type()}"
+
+    def _fetch_rows(self, build: Callable[[], Statement]) -> List[Dict[str, Any]]:
+        rows = self._execute(*build())
+        if not rows and self._collection_id is not None:
+            # `--rebuild` recreates the collection under a new id: look it up again, and query again if it moved.
+            cached_id, self._collection_id = self._collection_id, None
+            if self.collection_id != cached_id:
+                rows = self._execute(*build())
+        return rows
+
+    def _execute(self, statement: str, params: Dict[str, Any], session_settings: List[str]) -> List[Dict[str, Any]]:
+        params = {name: vector_literal(value) if name in VECTOR_PARAMS else value for name, value in params.items()}
+        with self.engine.begin() as connection:
+            for setting in session_settings:
+                connection.execute(sqlalchemy.text(setting))
+            return [dict(row._mapping) for row in connection.execute(sqlalchemy.text(statement), params)]
+
+    def _where_clause(self, filter: Optional[MetadataFilter], params: Dict[str, Any]) -> str:
+        where = ["collection_id = :collection_id"]
+        for i, (key, values) in enumerate((filter or {}).items()):
+            where.append(f"cmetadata->>:filter_key_{i} = ANY(:filter_values_{i})")
+            params[f"filter_key_{i}"] = key
+            params[f"filter_values_{i}"] = list(values)
+        return " AND ".join(where)
+
+    def _session_settings(self, ef_search: Optional[int], probes: Optional[int], limit: int, filtered: bool, exact: bool) -> List[str]:
+        if exact:
+            return ["SET LOCAL enable_indexscan = off"]
+        settings = [
+            # An HNSW scan returns at most ef_search rows, so it must cover the rescoring candidates.
+            f"SET LOCAL hnsw.ef_search = {max(int(ef_search or self.ef_search), limit)}",
+            f"SET LOCAL ivfflat.probes = {int(probes or self.probes)}",
+        ]
+        if filtered and self.iterative_scan:
+            settings += [
+                f"SET LOCAL hnsw.iterative_scan = {self.iterative_scan}",
+                f"SET LOCAL ivfflat.iterative_scan = {'relaxed_order' if self.iterative_scan != 'off' else 'off'}",
+            ]
+        return settings
+
+    # --- Recall / latency report ---
+    def sample_query_vectors(self, n: int) -> List[List[float]]:
+        """Random stored chunk embeddings, used as queries so the report costs no embedding calls."""
+        with self.engine.connect() as connection:
+            rows = connection.execute(
+                sqlalchemy.text(
+                    "SELECT embedding::text FROM langchain_pg_embedding WHERE collection_id = :collection_id "
+                    "ORDER BY random() LIMIT :n"
+                ),
+                {"collection_id": self.collection_id, "n": n},
+            )
+            return [json.loads(row[0]) for row in rows]
+
+    def recall_report(
+        self,
+        query_vectors: List[List[float]],
+        k: int = 4,
+        ef_search_values: Sequence[int] = (10, 20, 40, 80, 160),
+        probes_values: Sequence[int] = (1, 5, 10, 20, 50),
+        rescore_factor_values: Sequence[int] = (1, 2, 4, 8),
+        filter: Optional[MetadataFilter] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        Compares the ANN index against exact search for each search setting.
+        Returns one row per setting with recall@k and mean/p95 latency in milliseconds; the first row is exact search.
+        """
+        def run(**kwargs) -> Tuple[List[set], List[float]]:
+            ids, latencies = [], []
+            for vector in query_vectors:
+                started = time.perf_counter()
+                results = self.search(vector, k, filter=filter, **kwargs)
+                latencies.append((time.perf_counter() - started) * 1000)
+                ids.append({doc.id for doc, _ in results})
+            return ids, latencies
+
+        def summarize(name: str, value: Any, ids: List[set], latencies: List[float], truth: List[set]) -> Dict[str, Any]:
+            recall = statistics.mean(len(got & want) / max(len(want), 1) for got, want in zip(ids, truth))
+            ordered = sorted(latencies)
+            return {
+                "setting": name,
+                "value": value,
+                f"recall@{k}": round(recall, 4),
+                "mean_ms": round(statistics.mean(latencies), 2),
+                "p95_ms": round(ordered[max(0, int(len(ordered) * 0.95) - 1)], 2),
+            }
+
+        truth, exact_latencies = run(exact=True)
+        report = [summarize("exact", None, truth, exact_latencies, truth)]
+        if self.index_type == "hnsw":
+            for value in ef_search_values:
+                report.append(summarize("ef_search", value, *run(ef_search=value), truth))
+        elif self.index_type == "ivfflat":
+            for value in probes_values:
+                report.append(summarize("probes", value, *run(probes=value), truth))
+        if self.index_type != "none" and self.rescores:
+            configured = self.rescore_factor
+            try:
+                for value in rescore_factor_values:
+                    self.rescore_factor = value
+                    report.append(summarize("rescore_factor", value, *run(), truth))
+            finally:
+                self.rescore_factor = configured
+        return report
+
+
+async def multi_query_search(
+    vector_search: PgVectorSearch,
+    embeddings: Embeddings,
+    queries: List[str],
+    k: int = 4,
+    rrf_k: int = 60,
+    filter: Optional[MetadataFilter] = None,
+    hybrid: Optional[Dict[str, Any]] = None,
+    query_vectors: Optional[Dict[str, List[float]]] = None,
+) -> List[Tuple[Document, float]]:
+    """
+    Retrieves documents for several query variants at once.
+
+    All variants are embedded in a single batched embedding request, the searches run
+    concurrently, and the per-query rankings are merged with reciprocal rank fusion.
+    `hybrid` holds the `hybrid_search` keyword arguments (weights, candidates); without it
+    the searches are purely semantic. `query_vectors` holds embeddings that are already known
+    (e.g. the question's, computed by the router); only the other queries are embedded, and
+    their embeddings are added to it.
+    """
+    vectors = query_vectors if query_vectors is not None else {}
+    missing = [query for query in queries if query not in vectors]
+    if missing:
+        vectors.update(zip(missing, await aembed_queries(embeddings, missing)))
+    ordered_vectors = [vectors[query] for query in queries]
+    if hybrid is not None:
+        searches = [
+            vector_search.ahybrid_search(query, vector, k=k, filter=filter, **hybrid)
+            for query, vector in zip(queries, ordered_vectors)
+        ]
+    else:
+        searches = [vector_search.asearch(vector, k=k, filter=filter) for vector in ordered_vectors]
+    results = await asyncio.gather(*searches)
+    return reciprocal_rank_fusion([[doc for doc, _ in ranked] for ranked in results], k=rrf_k)
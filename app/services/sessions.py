@@ -0,0 +1,87 @@
+# app/services/sessions.py
+#
+# Checkpointers for chat sessions. The session graph (see RagAgent) persists its state per session, i.e.
+# per LangGraph thread: the trimmed history, the last turn's context and its compact question embedding.
+# One checkpoint is written per turn. `PostgresSessionStore` keeps them in the application database
+# (langgraph-checkpoint-postgres over a psycopg 3 pool); `MemorySessionStore` keeps them in the process,
+# for development, tests and benchmarks.
+
+import asyncio
+from typing import Optional, Union
+
+import sqlalchemy
+from langgraph.checkpoint.base import BaseCheckpointSaver
+
+
+class MemorySessionStore:
+    """Sessions in process memory: lost on restart and not shared between workers."""
+
+    def __init__(self):
+        from langgraph.checkpoint.memory import InMemorySaver
+
+        self.checkpointer: BaseCheckpointSaver = InMemorySaver()
+
+    async def open(self):
+        return self.checkpointer
+
+    async def delete(self, session_id: str):
+        await self.checkpointer.adelete_thread(session_id)
+
+    async def aclose(self):
+        pass
+
+
+class PostgresSessionStore:
+    """
+    Sessions in Postgres. The checkpointer can be compiled into a graph right away; its pool is opened
+    (and the checkpoint tables created) on first use, on the event loop that serves the requests.
+    """
+
+    def __init__(self, database_url: str, pool_size: int = 10):
+        from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
+        from psycopg.rows import dict_row
+        from psycopg_pool import AsyncConnectionPool
+
+        # psycopg takes a plain libpq URL, without SQLAlchemy's "+driver" suffix
+        conninfo = sqlalchemy.engine.make_url(database_url).set(drivername="postgresql").render_as_string(hide_password=False)
+        self.pool = AsyncConnectionPool(
+            conninfo, max_size=pool_size, open=False,
+            kwargs={"autocommit": True, "prepare_threshold": 0, "row_factory": dict_row},
+        )
+        self.checkpointer: BaseCheckpointSaver = AsyncPostgresSaver(self.pool)
+        self._opened = False
+        self._open_lock: Optional[asyncio.Lock] = None
+
+    async def open(self):
+        """Opens the pool and creates the checkpoint tables, once; concurrent first callers wait for it."""
+        if not self._opened:
+            self._open_lock = self._open_lock or asyncio.Lock()
+            async with self._open_lock:
+                if not self._opened:
+                    await self.pool.open()
+                    await self.checkpointer.setup()
+                    self._opened = True
+        return self.checkpointer
+
+    async def delete(self, session_id: str):
+        await self.open()
+        await self.checkpointer.adelete_thread(session_id)
+
+    async def aclose(self):
+        if self._opened:
+            await self.pool.close()
+            self._opened = False
+
+
+SessionStore = Union[MemorySessionStore, PostgresSessionStore]
+
+
+def session_store_from_settings(settings) -> Optional[SessionStore]:
+    """The store selected by SESSION_STORE ("postgres", "memory" or "none" for no sessions)."""
+    if settings.SESSION_STORE == "postgres":
+        return PostgresSessionStore(settings.DATABASE_URL, settings.SESSION_POOL_SIZE)
+    if settings.SESSION_STORE == "memory":
+        return MemorySessionStore()
+    if settings.SESSION_STORE == "none":
+        return None
+    raise ValueError(f"Unknown SESSION_STORE '{settings.SESSION_STORE}'")
@@ -1 +1,420 @@
-# Logic for interacting with the vector DB here
\ No newline at end of file
+# app/services/storage.py
+
+import asyncio
+import json
+import re
+import struct
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import sqlalchemy
+from langchain_core.documents import Document
+
+from app.core.metrics import record_db_query
+from app.core.tracing import get_logger, log_event
+from app.services.retrieval import TEXT_SEARCH_COLUMN_EXISTS, VECTOR_PARAMS, PgVectorSearch, Statement
+
+logger = get_logger("storage")
+
+
+# --- Collection Versioning ---
+def fetch_collection_version(engine: sqlalchemy.engine.Engine, collection_name: str) -> str:
+    """
+    Returns a fingerprint of the collection that changes whenever it is re-ingested.
+
+    Re-ingestion drops and recreates the collection row, so its uuid (plus its metadata)
+    identifies the current contents. Returns an empty string if the collection does not exist.
+    """
+    statement = sqlalchemy.text(
+        "SELECT uuid::text, coalesce(cmetadata::text, '') FROM langchain_pg_collection WHERE name = :name"
+    )
+    with engine.connect() as connection:
+        row = connection.execute(statement, {"name": collection_name}).first()
+    return f"{row[0]}:{row[1]}" if row else ""
+
+
+# --- Answer Cache ---
+def normalize_question(question: str) -> str:
+    """Case, punctuation and whitespace-insensitive form of a question, used as the exact-tier key."""
+    question = re.sub(r"[^\w\s]", " ", question.lower())
+    return re.sub(r"\s+", " ", question).strip()
+
+
+@dataclass
+class CacheEntry:
+    value: Any
+    embedding: Optional[np.ndarray]
+    size: int
+    created_at: float
+
+
+class AnswerCache:
+    """
+    Two-tier in-memory cache of final answers.
+
+    The exact tier matches normalized question text. The semantic tier returns the answer of a
+    cached question whose embedding has cosine similarity >= `similarity_threshold` with the new one.
+    Entries expire after `ttl_seconds`; the least recently used entries are evicted once either
+    `max_entries` or `max_bytes` is exceeded. The whole cache is dropped when the collection version changes.
+
+    Not thread-safe: it is meant to be used from the event loop only.
+    """
+
+    def __init__(self, ttl_seconds: float, max_entries: int, max_bytes: int, similarity_threshold: float):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.similarity_threshold = similarity_threshold
+        self.version: Optional[str] = None
+
+        self._entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self._bytes = 0
+        # Stacked, L2-normalized embeddings of the semantic tier, rebuilt lazily after changes.
+        self._matrix: Optional[np.ndarray] = None
+        self._matrix_keys: List[str] = []
+
+        self.counters: Dict[str, int] = {
+            "exact_hits": 0,
+            "semantic_hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "invalidations": 0,
+        }
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    # --- Lookups ---
+    def get_exact(self, question: str) -> Optional[Any]:
+        """Returns the cached value for this exact (normalized) question, if any."""
+        key = normalize_question(question)
+        entry = self._live_entry(key)
+        if entry is None:
+            return None
+        self._entries.move_to_end(key)
+        self.counters["exact_hits"] += 1
+        return entry.value
+
+    def get_semantic(self, embedding: List[float]) -> Optional[Any]:
+        """
+        Returns the cached value of the most similar question if it clears the similarity threshold.
+        Counts a miss otherwise, so call it only after `get_exact` missed.
+        """
+        query = self._normalize_vector(embedding)
+        if query is not None:
+            matrix, keys = self._semantic_index()
+            if keys:
+                similarities = matrix @ query
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.similarity_threshold:
+                    key = keys[best]
+                    entry = self._live_entry(key)
+                    if entry is not None:
+                        self._entries.move_to_end(key)
+                        self.counters["semantic_hits"] += 1
+                        return entry.value
+
+        self.counters["misses"] += 1
+        return None
+
+    # --- Updates ---
+    def put(self, question: str, value: Any, embedding: Optional[List[float]] = None, size: int = 0):
+        """Caches `value` for `question`. `size` is the caller's estimate of the value's size in bytes."""
+        key = normalize_question(question)
+        vector = self._normalize_vector(embedding) if embedding is not None else None
+        size += len(key) + (vector.nbytes if vector is not None else 0)
+
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = CacheEntry(value=value, embedding=vector, size=size, created_at=time.monotonic())
+        self._bytes += size
+        self._matrix = None
+
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.counters["evictions"] += 1
+
+    def invalidate(self):
+        """Drops every cached answer."""
+        self._entries.clear()
+        self._bytes = 0
+        self._matrix = None
+        self._matrix_keys = []
+        self.counters["invalidations"] += 1
+
+    def ensure_version(self, version: str):
+        """Invalidates the cache if the collection changed since the cached answers were produced."""
+        if self.version is not None and version != self.version:
+            log_event(logger, "answer_cache_invalidated", old=self.version, new=version)
+            self.invalidate()
+        self.version = version
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.counters["exact_hits"] + self.counters["semantic_hits"] + self.counters["misses"]
+        hits = self.counters["exact_hits"] + self.counters["semantic_hits"]
+        return {
+            **self.counters,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "similarity_threshold": self.similarity_threshold,
+        }
+
+    # --- Internals ---
+    def _live_entry(self, key: str) -> Optional[CacheEntry]:
+        entry = self._entries.get(key)
+        if entry is not None and time.monotonic() - entry.created_at > self.ttl_seconds:
+            self._remove(key)
+            self.counters["expirations"] += 1
+            return None
+        return entry
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+        self._matrix = None
+
+    def _semantic_index(self):
+        if self._matrix is None:
+            self._matrix_keys = [key for key, entry in self._entries.items() if entry.embedding is not None]
+            self._matrix = (
+                np.stack([self._entries[key].embedding for key in self._matrix_keys])
+                if self._matrix_keys
+                else np.empty((0, 0), dtype=np.float32)
+            )
+        return self._matrix, self._matrix_keys
+
+    @staticmethod
+    def _normalize_vector(embedding: List[float]) -> Optional[np.ndarray]:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else None
+
+
+# --- Async pgvector store ---
+# Columns written by `PgVectorStore`'s COPY; `document_tsv` is generated by Postgres.
+COPY_COLUMNS = ["uuid", "collection_id", "embedding", "document", "cmetadata", "custom_id"]
+# Big-endian element types of pgvector's binary formats (after an int16 dimension count and an unused int16)
+BINARY_VECTOR_TYPES = {"vector": ">f4", "halfvec": ">f2"}
+_NAMED_PARAM = re.compile(r"(?<![:\w]):(\w+)")
+
+
+def to_positional(statement: str, params: Dict[str, Any]) -> Tuple[str, List[Any]]:
+    """Rewrites `:name` parameters as asyncpg's `$n`; a name used several times keeps one number."""
+    numbers: Dict[str, int] = {}
+
+    def number(match: re.Match) -> str:
+        return f"${numbers.setdefault(match.group(1), len(numbers) + 1)}"
+
+    statement = _NAMED_PARAM.sub(number, statement)
+    return statement, [params[name] for name in numbers]
+
+
+def encode_binary_vector(value: Sequence[float], dtype: str) -> bytes:
+    array = np.asarray(value, dtype=dtype)
+    return struct.pack(">HH", array.shape[0], 0) + array.tobytes()
+
+
+def decode_binary_vector(data: bytes, dtype: str) -> np.ndarray:
+    dimensions, _ = struct.unpack_from(">HH", data)
+    return np.frombuffer(data, dtype=dtype, count=dimensions, offset=4).astype(np.float32)
+
+
+class PgVectorStore(PgVectorSearch):
+    """
+    PgVectorSearch whose async searches and writes run on a shared asyncpg pool instead of threads
+    and psycopg2. Vectors travel in pgvector's binary format (4 or 2 bytes per dimension, instead of
+    ~20 characters of JSON), and chunks are written with binary COPY in a single transaction.
+    The sync methods (index management, reports) keep using the SQLAlchemy engine.
+
+    The pool is opened on first use (or by `awarm_up`) and bound to that event loop.
+    """
+
+    def __init__(
+        self,
+        engine: sqlalchemy.engine.Engine,
+        collection_name: str,
+        dimensions: int,
+        *,
+        dsn: Optional[str] = None,
+        pool_min_size: int = 4,
+        pool_max_size: int = 20,
+        **kwargs,
+    ):
+        super().__init__(engine, collection_name, dimensions, **kwargs)
+        # asyncpg takes a plain libpq URL, without SQLAlchemy's "+driver" suffix
+        self.dsn = dsn or engine.url.set(drivername="postgresql").render_as_string(hide_password=False)
+        self.pool_min_size = pool_min_size
+        self.pool_max_size = pool_max_size
+        self._pool = None
+        self._pool_lock = asyncio.Lock()
+
+    @classmethod
+    def from_settings(cls, engine: sqlalchemy.engine.Engine, collection_name: str, settings, **kwargs) -> "PgVectorStore":
+        return super().from_settings(
+            engine, collection_name, settings,
+            pool_min_size=settings.DB_ASYNC_POOL_MIN_SIZE, pool_max_size=settings.DB_ASYNC_POOL_MAX_SIZE, **kwargs,
+        )
+
+    # --- Pool ---
+    async def open(self):
+        """Returns the pool, creating it on first use; concurrent first callers share one pool."""
+        if self._pool is None:
+            async with self._pool_lock:
+                if self._pool is None:
+                    import asyncpg
+
+                    self._pool = await asyncpg.create_pool(
+                        self.dsn, min_size=self.pool_min_size, max_size=self.pool_max_size, init=self._init_connection
+                    )
+        return self._pool
+
+    @staticmethod
+    async def _init_connection(connection):
+        """Registers binary codecs for `vector` and, with pgvector >= 0.7, `halfvec`."""
+        for type_name, dtype in BINARY_VECTOR_TYPES.items():
+            schema = await connection.fetchval(
+                "SELECT typnamespace::regnamespace::text FROM pg_type WHERE oid = to_regtype($1)", type_name
+            )
+            if schema is not None:
+                await connection.set_type_codec(
+                    type_name,
+                    schema=schema,
+                    encoder=lambda value, dtype=dtype: encode_binary_vector(value, dtype),
+                    decoder=lambda data, dtype=dtype: decode_binary_vector(data, dtype),
+                    format="binary",
+                )
+
+    async def awarm_up(self, connections: int = 1):
+        """Opens the pool (which connects `pool_min_size` connections up front) and resolves the collection id."""
+        await self.open()
+        await self._acollection_id()
+
+    async def aclose_pool(self):
+        """Closes the pool only, leaving the engine to whoever owns it."""
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+
+    async def aclose(self):
+        await self.aclose_pool()
+        await super().aclose()
+
+    async def _acollection_id(self) -> str:
+        if self._collection_id is None:
+            pool = await self.open()
+            collection_id = await pool.fetchval("SELECT uuid FROM langchain_pg_collection WHERE name = $1", self.collection_name)
+            if collection_id is None:
+                raise ValueError(f"Collection '{self.collection_name}' not found")
+            self._collection_id = str(collection_id)
+        return self._collection_id
+
+    # --- Search ---
+    async def asearch(
+        self,
+        embedding: List[float],
+        k: int = 4,
+        *,
+        ef_search: Optional[int] = None,
+        probes: Optional[int] = None,
+        filter: Optional[Dict[str, List[str]]] = None,
+        exact: bool = False,
+    ) -> List[Tuple[Document, float]]:
+        started = time.perf_counter()
+        rows = await self._afetch_rows(lambda: self._search_statement(embedding, k, filter, ef_search, probes, exact))
+        record_db_query("exact_search" if exact else "vector_search", time.perf_counter() - started, len(rows))
+        return self._search_results(rows)
+
+    async def ahybrid_search(
+        self,
+        query_text: str,
+        embedding: List[float],
+        k: int = 4,
+        *,
+        semantic_weight: float = 0.7,
+        lexical_weight: float = 0.3,
+        candidates: int = 20,
+        ef_search: Optional[int] = None,
+        probes: Optional[int] = None,
+        filter: Optional[Dict[str, List[str]]] = None,
+    ) -> List[Tuple[Document, float]]:
+        if not await self.ahas_text_search():
+            return await self.asearch(embedding, k, ef_search=ef_search, probes=probes, filter=filter)
+        args = (query_text, embedding, k, semantic_weight, lexical_weight, candidates, ef_search, probes, filter)
+        started = time.perf_counter()
+        rows = await self._afetch_rows(lambda: self._hybrid_statement(*args))
+        record_db_query("hybrid_search", time.perf_counter() - started, len(rows))
+        return self._hybrid_results(rows)
+
+    async def ahas_text_search(self) -> bool:
+        if self._text_search_unknown():
+            pool = await self.open()
+            self._set_text_search(bool(await pool.fetchval(TEXT_SEARCH_COLUMN_EXISTS)))
+        return bool(self._text_search)
+
+    async def _afetch_rows(self, build: Callable[[], Statement]) -> List[Dict[str, Any]]:
+        cached_id = await self._acollection_id()
+        rows = await self._aexecute(*build())
+        if not rows:
+            # The collection may have been recreated under a new id, as in `PgVectorSearch._fetch_rows`.
+            self._collection_id = None
+            if await self._acollection_id() != cached_id:
+                rows = await self._aexecute(*build())
+        return rows
+
+    async def _aexecute(self, statement: str, params: Dict[str, Any], session_settings: List[str]) -> List[Dict[str, Any]]:
+        params = dict(params, collection_id=uuid.UUID(params["collection_id"]))
+        for name in VECTOR_PARAMS:
+            if name in params:
+                params[name] = np.asarray(params[name], dtype=np.float32)
+        statement, args = to_positional(statement, params)
+        pool = await self.open()
+        async with pool.acquire() as connection, connection.transaction():
+            if session_settings:
+                # One round trip for all SET LOCALs
+                await connection.execute("; ".join(session_settings))
+            records = await connection.fetch(statement, *args)
+        rows = [dict(record) for record in records]
+        for row in rows:
+            # asyncpg returns json columns as text
+            if isinstance(row.get("cmetadata"), str):
+                row["cmetadata"] = json.loads(row["cmetadata"])
+        return rows
+
+    # --- Bulk writes ---
+    async def areplace_chunks(
+        self, chunks: List[Document], vectors: List[List[float]], sources: Iterable[str] = ()
+    ) -> int:
+        """
+        Atomically swaps the stored chunks of every document that `chunks` belong to (grouped by their
+        `source` metadata) for the new ones: one DELETE and one binary COPY in a single transaction.
+        Documents listed in `sources` are replaced too, so one without chunks is cleared.
+        Returns the number of chunks written.
+        """
+        collection_id = uuid.UUID(await self._acollection_id())
+        records = []
+        sources = set(sources)
+        for chunk, vector in zip(chunks, vectors):
+            source = str(chunk.metadata.get("source", ""))
+            sources.add(source)
+            metadata = json.dumps({**chunk.metadata, "source": source}, default=str)
+            records.append((uuid.uuid4(), collection_id, vector, chunk.page_content, metadata, str(uuid.uuid4())))
+
+        pool = await self.open()
+        started = time.perf_counter()
+        async with pool.acquire() as connection, connection.transaction():
+            await connection.execute(
+                "DELETE FROM langchain_pg_embedding WHERE collection_id = $1 AND cmetadata->>'source' = ANY($2)",
+                collection_id, sorted(sources),
+            )
+            if records:
+                await connection.copy_records_to_table("langchain_pg_embedding", records=records, columns=COPY_COLUMNS)
+        record_db_query("copy_chunks", time.perf_counter() - started, len(records))
+        return len(records)
+
@@ -1 +1,193 @@
-# Text chunking strategies
\ No newline at end of file
+# data_ingestion/chunking.py
+#
+# Text chunking strategies. Chunkers are plain, picklable objects: they are passed to the ingestion process
+# pool, and their tokenizer is loaded in each worker on first use.
+#
+#   - `StructuredChunker` packs Unstructured elements, in document order, into chunks of at most `max_tokens`
+#     embedding tokens. A chunk never spans two pages, and a Title starts a new chunk once the current one holds
+#     `min_tokens`, so short sections stay together instead of being embedded on their own. Only an element
+#     longer than `max_tokens` (a long paragraph or table) is split, on sentence or word boundaries, with
+#     `overlap_tokens` of overlap; nothing else is embedded twice. Page headers, footers and breaks are dropped.
+#   - `RecursiveChunker` is the previous strategy: 1000-character chunks with 200 characters of overlap, over
+#     the whole document as a single text.
+#
+# Structured chunks carry `page_number` (when the format has pages), `start_index` (the chunk's character offset
+# in its page's text, i.e. the page's elements joined by blank lines, which is what ContextBuilder merges on),
+# `chunk_index`, `section` (the title the chunk falls under) and `token_count`.
+
+from bisect import bisect_left
+from functools import lru_cache
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+import tiktoken
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter # type: ignore
+
+# text-embedding-3-* models use the cl100k_base tokenizer and take at most 8191 tokens per input
+EMBEDDING_ENCODING = "cl100k_base"
+EMBEDDING_MAX_TOKENS = 8191
+
+# Elements repeated on every page, or carrying no text of their own
+SKIPPED_CATEGORIES = {"Header", "Footer", "PageBreak", "PageNumber"}
+# Metadata kept from the elements, besides what the chunker sets
+DOCUMENT_METADATA = ("source", "filename", "filetype")
+ELEMENT_SEPARATOR = "\n\n"
+
+
+@lru_cache(maxsize=None)
+def get_encoding(name: str = EMBEDDING_ENCODING) -> tiktoken.Encoding:
+    return tiktoken.get_encoding(name)
+
+
+def count_tokens(texts: List[str], encoding_name: str = EMBEDDING_ENCODING) -> int:
+    """Total embedding tokens of `texts`."""
+    return sum(len(tokens) for tokens in get_encoding(encoding_name).encode_ordinary_batch(texts))
+
+
+class RecursiveChunker:
+    """Fixed-size character chunks with overlap, ignoring the document structure."""
+
+    mode = "single"
+
+    def __init__(self, chunk_size: int = 1000, chunk_overlap: int = 200):
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+
+    def chunk(self, documents: Iterable[Document]) -> List[Document]:
+        splitter = RecursiveCharacterTextSplitter(chunk_size=self.chunk_size, chunk_overlap=self.chunk_overlap)
+        return splitter.split_documents(list(documents))
+
+
+class StructuredChunker:
+    """Token-sized chunks of consecutive elements of the same page, split at section titles."""
+
+    mode = "elements"
+
+    def __init__(self, max_tokens: int = 512, min_tokens: int = 128, overlap_tokens: int = 64,
+                 encoding_name: str = EMBEDDING_ENCODING):
+        if not 0 < max_tokens <= EMBEDDING_MAX_TOKENS:
+            raise ValueError(f"max_tokens must be between 1 and {EMBEDDING_MAX_TOKENS}, got {max_tokens}")
+        if not 0 <= overlap_tokens < max_tokens:
+            raise ValueError(f"overlap_tokens must be smaller than max_tokens, got {overlap_tokens}")
+        self.max_tokens = max_tokens
+        self.min_tokens = min(min_tokens, max_tokens)
+        self.overlap_tokens = overlap_tokens
+        self.encoding_name = encoding_name
+
+    @property
+    def encoding(self) -> tiktoken.Encoding:
+        return get_encoding(self.encoding_name)
+
+    def chunk(self, elements: Iterable[Document]) -> Iterator[Document]:
+        """Chunks a stream of elements (UnstructuredLoader in "elements" mode), holding one chunk at a time."""
+        separator_tokens = len(self.encoding.encode_ordinary(ELEMENT_SEPARATOR))
+        document: Dict = {}
+        section: Optional[str] = None
+        page: Optional[int] = None
+        page_offset = 0  # offset of the next element in its page's text
+        parts: List[str] = []
+        start_index = tokens = chunk_index = 0
+
+        def flush() -> Iterator[Document]:
+            nonlocal parts, tokens, chunk_index
+            if parts:
+                yield self._document(ELEMENT_SEPARATOR.join(parts), document, page, start_index, chunk_index, section)
+                chunk_index += 1
+            parts, tokens = [], 0
+
+        for element in elements:
+            text = element.page_content.strip()
+            category = element.metadata.get("category")
+            if not text or category in SKIPPED_CATEGORIES:
+                continue
+            if not document:
+                document = {key: element.metadata[key] for key in DOCUMENT_METADATA if key in element.metadata}
+
+            element_page = element.metadata.get("page_number")
+            if element_page != page:
+                yield from flush()
+                page, page_offset = element_page, 0
+            elif category == "Title" and tokens >= self.min_tokens:
+                yield from flush()
+
+            element_tokens = len(self.encoding.encode_ordinary(text))
+            if element_tokens > self.max_tokens:
+                # An oversized element is split; its first piece fills up the current chunk (e.g. its heading)
+                budget = self.max_tokens - tokens - separator_tokens
+                if parts and budget < self.min_tokens:
+                    yield from flush()
+                for offset, piece in self._split(text, budget if parts else self.max_tokens):
+                    if not parts:
+                        start_index = page_offset + offset
+                    parts.append(piece)
+                    yield from flush()
+            else:
+                if parts and tokens + separator_tokens + element_tokens > self.max_tokens:
+                    yield from flush()
+                if not parts:
+                    start_index = page_offset
+                else:
+                    tokens += separator_tokens
+                parts.append(text)
+                tokens += element_tokens
+            if category == "Title":
+                section = text[:200]
+            page_offset += len(text) + len(ELEMENT_SEPARATOR)
+
+        yield from flush()
+
+    def _split(self, text: str, first_window: int) -> List[Tuple[int, str]]:
+        """
+        (offset, piece) windows over one element: the first of at most `first_window` tokens, the next ones of
+        at most max_tokens, overlapping by overlap_tokens. Windows end on sentence or word boundaries when they can.
+        """
+        tokens = self.encoding.encode_ordinary(text)
+        _, offsets = self.encoding.decode_with_offsets(tokens)
+        offsets.append(len(text))
+        pieces = []
+        first, window = 0, first_window
+        while first < len(tokens):
+            last = min(first + window, len(tokens))
+            start, end = offsets[first], offsets[last]
+            if last < len(tokens):
+                # Cut after the last sentence end, else before the last space, in the second half of the window
+                middle = (start + end) // 2
+                cut = max(text.rfind(". ", middle, end) + 1, text.rfind("\n", middle, end) + 1)
+                if cut <= middle:
+                    cut = text.rfind(" ", middle, end)
+                if cut > middle:
+                    end = cut
+                    last = max(bisect_left(offsets, end), first + 1)
+            piece = text[start:end]
+            stripped = piece.lstrip()
+            pieces.append((start + len(piece) - len(stripped), stripped.rstrip()))
+            if last >= len(tokens):
+                break
+            overlap_start = max(last - self.overlap_tokens, first + 1)
+            # The overlap starts at a word (cl100k_base tokens usually begin with the space before it)
+            while overlap_start < last and not (text[offsets[overlap_start]].isspace() or text[offsets[overlap_start] - 1].isspace()):
+                overlap_start += 1
+            first, window = overlap_start, self.max_tokens
+        return pieces
+
+    def _document(self, text: str, document: Dict, page: Optional[int], start_index: int, chunk_index: int,
+                  section: Optional[str]) -> Document:
+        metadata = dict(document, start_index=start_index, chunk_index=chunk_index,
+                        token_count=len(self.encoding.encode_ordinary(text)))
+        if page is not None:
+            metadata["page_number"] = page
+        if section is not None:
+            metadata["section"] = section
+        return Document(page_content=text, metadata=metadata)
+
+
+Chunker = Union[StructuredChunker, RecursiveChunker]
+
+
+def chunker_from_settings(settings) -> Chunker:
+    """The chunker selected by CHUNKER ("structured" or "recursive")."""
+    if settings.CHUNKER == "structured":
+        return StructuredChunker(settings.CHUNK_MAX_TOKENS, settings.CHUNK_MIN_TOKENS, settings.CHUNK_OVERLAP_TOKENS)
+    if settings.CHUNKER == "recursive":
+        return RecursiveChunker()
+    raise ValueError(f"Unknown CHUNKER '{settings.CHUNKER}'")
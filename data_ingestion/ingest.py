@@ -2,20 +2,31 @@
 
 import os
 import httpx
+import sqlalchemy
 from typing import List
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 from langchain_community.vectorstores.pgvector import PGVector
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_unstructured import UnstructuredLoader
 from langchain_openai import OpenAIEmbeddings
 
+from app.services.embedding_cache import CachedEmbeddings
+from data_ingestion.chunking import chunker_from_settings
+from data_ingestion.loaders import load_document
+from data_ingestion.sync import bulk_replace_chunks
+
 # --- 1. SETTINGS AND CONFIGURATION  ---
 
 class Settings(BaseSettings):
     """Loads and validates application settings from a .env file."""
     OPENAI_API_KEY: str
     DATABASE_URL: str
+    EMBEDDING_CACHE_DIR: str = ".cache/embeddings"
+    EMBEDDING_DIMENSIONS: int = 3072
+    CHUNKER: str = "structured"
+    CHUNK_MAX_TOKENS: int = 512
+    CHUNK_MIN_TOKENS: int = 128
+    CHUNK_OVERLAP_TOKENS: int = 64
+    VECTOR_STORE_DRIVER: str = "asyncpg"
     model_config = SettingsConfigDict(env_file=".env", env_file_encoding="utf-8")
 
 # Create a single, reusable instance of the settings
@@ -29,9 +40,12 @@ insecure_client = httpx.Client(verify=False)
 # Initialize the OpenAI embeddings model with our fix
 embeddings = OpenAIEmbeddings(
     model="text-embedding-3-large", 
+    dimensions=settings.EMBEDDING_DIMENSIONS,
     openai_api_key=settings.OPENAI_API_KEY,
     http_client=insecure_client
 )
+# Only chunks whose text changed since the last run are sent to the embeddings API
+embeddings = CachedEmbeddings.for_openai(embeddings, settings.EMBEDDING_CACHE_DIR)
 
 # Database connection details
 DB_URL = settings.DATABASE_URL
@@ -40,35 +54,27 @@ COLLECTION_NAME = "quasar_doc_collection"
 
 # --- 3. INGESTION PIPELINE FUNCTIONS ---
 
-def load_document(file_path: str) -> List:
-    """Loads a single document using the new UnstructuredLoader."""
-    print(f"Loading document: {file_path}")
-    loader = UnstructuredLoader(file_path, mode="single", strategy="fast")
-    return loader.load()
-
-def chunk_documents(documents: List) -> List:
-    """Splits documents into smaller chunks."""
+def chunk_file(file_path: str) -> List:
+    """Streams the document's elements into token-sized chunks that keep their page and section."""
+    chunker = chunker_from_settings(settings)
     print("Chunking documents...")
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=1000,
-        chunk_overlap=200,
-        length_function=len,
-    )
-    docs = text_splitter.split_documents(documents)
+    docs = list(chunker.chunk(load_document(file_path, chunker.mode)))
     print(f"Successfully chunked into {len(docs)} documents.")
     return docs
 
 def embed_and_store(chunks: List, collection_name: str):
-    """Embeds chunks and stores them in the PGVector database."""
+    """Embeds chunks and atomically replaces the stored chunks of the documents they come from."""
     print(f"Embedding and storing {len(chunks)} chunks into collection '{collection_name}'...")
 
-    PGVector.from_documents(
-        documents=chunks,
-        embedding=embeddings,
-        collection_name=collection_name,
-        connection_string=DB_URL,
-        pre_delete_collection=True,
-    )
+    # Creates the tables and the collection if needed; other documents are left untouched.
+    PGVector(connection_string=DB_URL, embedding_function=embeddings, collection_name=collection_name)
+    vectors = embeddings.embed_documents([chunk.page_content for chunk in chunks])
+    # One COPY per document (binary over asyncpg, CSV over psycopg2), in a transaction with the delete of its previous chunks
+    engine = sqlalchemy.create_engine(DB_URL)
+    try:
+        bulk_replace_chunks(engine, collection_name, settings, chunks, vectors)
+    finally:
+        engine.dispose()
     
     print("Ingestion process complete. Data has been embedded and stored.")
 
@@ -81,8 +87,7 @@ def main():
         print(f"Error: File not found at '{sample_file_path}'")
         return
 
-    loaded_docs = load_document(sample_file_path)
-    chunked_docs = chunk_documents(loaded_docs)
+    chunked_docs = chunk_file(sample_file_path)
     embed_and_store(chunked_docs, COLLECTION_NAME)
 
 
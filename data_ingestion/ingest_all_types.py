@@ -1,16 +1,21 @@
 # data_ingestion/ingest.py (Enhanced Ingestion Pipeline with Multi-Format & Archive Support)
 
+import argparse
 import os
-import zipfile
-from typing import List
+from functools import partial
+from typing import Iterator
 import httpx # type: ignore
+import sqlalchemy
 
 from langchain_community.vectorstores.pgvector import PGVector # type: ignore
-from langchain_text_splitters import RecursiveCharacterTextSplitter # type: ignore
-from langchain_unstructured import UnstructuredLoader # type: ignore
 from langchain_openai import OpenAIEmbeddings # type: ignore
 
 from app.core.config import settings
+from app.services.embedding_cache import CachedEmbeddings
+from app.services.retrieval import PgVectorSearch
+from data_ingestion.chunking import chunker_from_settings
+from data_ingestion.loaders import extract_zip, load_and_chunk
+from data_ingestion.sync import ArchiveManifest, DocumentSyncStore, sync_documents
 
 # --- GLOBAL CONFIG ---
 DOCUMENTS_DIR = "documents"
@@ -23,89 +28,87 @@ insecure_client = httpx.Client(verify=False)  # ⚠️ Use only in development
 # --- EMBEDDINGS SETUP ---
 embeddings = OpenAIEmbeddings(
     model="text-embedding-3-large",
+    dimensions=settings.EMBEDDING_DIMENSIONS,
     openai_api_key=settings.OPENAI_API_KEY,
     http_client=insecure_client,
 )
+# Only chunks whose text changed since the last run are sent to the embeddings API
+if settings.EMBEDDING_CACHE_ENABLED:
+    embeddings = CachedEmbeddings.for_openai(embeddings, settings.EMBEDDING_CACHE_DIR)
 
 # --- DATABASE SETUP ---
 DB_URL = settings.DATABASE_URL
 
 # --- CORE INGESTION FUNCTIONS ---
 
-def extract_zip(file_path: str, extract_to: str = TEMP_EXTRACT_DIR) -> List[str]:
-    os.makedirs(extract_to, exist_ok=True)
-    with zipfile.ZipFile(file_path, 'r') as zip_ref:
-        zip_ref.extractall(extract_to)
-        return [os.path.join(extract_to, f) for f in zip_ref.namelist() if os.path.isfile(os.path.join(extract_to, f))]
-
-def load_document(file_path: str) -> List:
-    print(f"Loading document: {file_path}")
-    loader = UnstructuredLoader(file_path, mode="single", strategy="fast")
-    return loader.load()
-
-def chunk_documents(documents: List) -> List:
-    print("Chunking documents...")
-    splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-    chunks = splitter.split_documents(documents)
-    print(f"Successfully chunked into {len(chunks)} documents.")
-    return chunks
-
-def embed_and_store(chunks: List, collection_name: str):
-    print(f"Embedding and storing {len(chunks)} chunks into collection '{collection_name}'...")
-    PGVector.from_documents(
-        documents=chunks,
-        embedding=embeddings,
-        collection_name=collection_name,
-        connection_string=DB_URL,
-        pre_delete_collection=True,
-    )
-    print("Ingestion complete. Documents embedded and stored.")
+def discover_files(root: str = DOCUMENTS_DIR) -> Iterator[str]:
+    """Yields every file under `root`, expanding new or changed ZIP archives into TEMP_EXTRACT_DIR."""
+    archives = ArchiveManifest(TEMP_EXTRACT_DIR)
+    for dirpath, dirnames, filenames in os.walk(root):
+        # Extracted archive contents are yielded when their archive is expanded
+        dirnames[:] = [d for d in dirnames if os.path.join(dirpath, d) != TEMP_EXTRACT_DIR]
+        for filename in sorted(filenames):
+            file_path = os.path.join(dirpath, filename)
+            if filename.endswith(".zip"):
+                try:
+                    yield from archives.expand(file_path, extract_zip)
+                except Exception as e:
+                    print(f"Failed to extract archive: {file_path}\nError: {e}")
+            else:
+                yield file_path
 
 # --- MAIN PIPELINE ENTRY ---
 
-def main():
+def main(rebuild: bool = False):
     print(f"--- Starting Quasar Data Ingestion Pipeline for directory: {DOCUMENTS_DIR} ---")
 
     if not os.path.exists(DOCUMENTS_DIR):
         print(f"Directory '{DOCUMENTS_DIR}' does not exist.")
         return
 
-    all_chunks = []
-
-    for filename in os.listdir(DOCUMENTS_DIR):
-        file_path = os.path.join(DOCUMENTS_DIR, filename)
-
-        if os.path.isfile(file_path):
-            try:
-                # If it's a zip file, extract and parse contents
-                if filename.endswith(".zip"):
-                    extracted_files = extract_zip(file_path)
-                    for subfile in extracted_files:
-                        try:
-                            docs = load_document(subfile)
-                            chunks = chunk_documents(docs)
-                            all_chunks.extend(chunks)
-                        except Exception as inner_e:
-                            print(f"Failed to process extracted file: {subfile}\nError: {inner_e}")
-                else:
-                    docs = load_document(file_path)
-                    chunks = chunk_documents(docs)
-                    all_chunks.extend(chunks)
-
-                print(f"Processed: {filename}")
-
-            except Exception as e:
-                print(f"Failed to process file: {filename}\nError: {e}")
-
-        print("-" * 40)
-
-    if all_chunks:
-        embed_and_store(all_chunks, COLLECTION_NAME)
-    else:
-        print("No valid documents found to process.")
+    # Creates the tables and the collection if needed; a rebuild drops the collection first.
+    PGVector(
+        connection_string=DB_URL,
+        embedding_function=embeddings,
+        collection_name=COLLECTION_NAME,
+        pre_delete_collection=rebuild,
+    )
+    engine = sqlalchemy.create_engine(DB_URL)
+    vector_search = PgVectorSearch.from_settings(engine, COLLECTION_NAME, settings)
+    vector_search.ensure_storage()
+    vector_search.ensure_text_search()
+    # Chunks are written over asyncpg or psycopg2, following VECTOR_STORE_DRIVER
+    store = DocumentSyncStore.from_settings(engine, COLLECTION_NAME, settings)
+    if rebuild:
+        store.ensure_schema()
+        store.clear_manifest()
+
+    try:
+        stats = sync_documents(
+            discover_files(DOCUMENTS_DIR),
+            embeddings,
+            store,
+            load_workers=settings.INGEST_LOAD_WORKERS,
+            embed_workers=settings.INGEST_EMBED_WORKERS,
+            embed_batch_size=settings.INGEST_EMBED_BATCH_SIZE,
+            queue_size=settings.INGEST_QUEUE_SIZE,
+            load_fn=partial(load_and_chunk, chunker=chunker_from_settings(settings)),
+        )
+    finally:
+        store.close()
+
+    if not stats.files:
+        print("No new or changed documents to process.")
+
+    # HNSW indexes are maintained on insert; this only builds the index the first time.
+    try:
+        vector_search.ensure_index()
+    except ValueError as e:
+        print(f"Skipping vector index, searches will use exact scans: {e}")
 
     print("--- Ingestion Pipeline Finished ---")
 
 if __name__ == "__main__":
-    main()
-# This script is designed to ingest various document types, including PDFs and ZIP archives,
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Incrementally sync the documents directory into the vector store.")
+    parser.add_argument("--rebuild", action="store_true", help="Drop the collection and re-ingest every document.")
+    main(rebuild=parser.parse_args().rebuild)
@@ -1 +1,36 @@
-# Document loading logic
\ No newline at end of file
+# data_ingestion/loaders.py
+#
+# Document loading logic. These functions run inside the ingestion process pool,
+# so they only depend on the parsing libraries, not on the app settings or clients.
+
+import os
+import zipfile
+from typing import Iterator, List, Optional, Tuple
+
+from langchain_core.documents import Document
+from langchain_unstructured import UnstructuredLoader # type: ignore
+
+from data_ingestion.chunking import EMBEDDING_ENCODING, Chunker, StructuredChunker, count_tokens
+
+
+def extract_zip(file_path: str, extract_to: str) -> List[str]:
+    os.makedirs(extract_to, exist_ok=True)
+    with zipfile.ZipFile(file_path, 'r') as zip_ref:
+        zip_ref.extractall(extract_to)
+        return [os.path.join(extract_to, f) for f in zip_ref.namelist() if os.path.isfile(os.path.join(extract_to, f))]
+
+def load_document(file_path: str, mode: str = "elements") -> Iterator[Document]:
+    """Streams the document's elements ("elements" mode) or yields its whole text as one document ("single")."""
+    print(f"Loading document: {file_path}")
+    loader = UnstructuredLoader(file_path, mode=mode, strategy="fast")
+    return loader.lazy_load()
+
+def load_and_chunk(file_path: str, chunker: Optional[Chunker] = None) -> Tuple[str, List[Document], int]:
+    """
+    Parses and chunks one file (CPU-bound; runs in a worker process), with a default StructuredChunker.
+    Returns the file path, its chunks and the number of embedding tokens they contain.
+    """
+    chunker = chunker or StructuredChunker()
+    chunks = list(chunker.chunk(load_document(file_path, chunker.mode)))
+    token_count = count_tokens([chunk.page_content for chunk in chunks], EMBEDDING_ENCODING)
+    return file_path, chunks, token_count
@@ -0,0 +1,156 @@
+# data_ingestion/pipeline.py
+#
+# Staged, bounded-memory ingestion pipeline:
+#
+#   files --(process pool: parse + chunk)--> embed queue --(thread pool: embed)--> store queue --(COPY)
+#
+# Every queue is bounded, so at most a few documents per stage are held in memory at once,
+# whatever the size of the corpus. Parsing is CPU-bound and runs in processes; embedding is
+# I/O-bound and runs in threads; storage is a single writer doing one COPY per document.
+
+import multiprocessing
+import queue
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, List, Optional
+
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from data_ingestion.loaders import load_and_chunk
+
+# Marks the end of a stage's input
+_DONE = object()
+
+
+@dataclass
+class DocumentBatch:
+    """All chunks of one source file, moving through the pipeline together."""
+    source: str
+    chunks: List[Document]
+    token_count: int
+    vectors: Optional[List[List[float]]] = None
+
+
+@dataclass
+class PipelineStats:
+    started_at: float = field(default_factory=time.perf_counter)
+    files: int = 0
+    failed_files: int = 0
+    chunks: int = 0
+    tokens: int = 0
+    stored_chunks: int = 0
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def add(self, **counts: int):
+        with self._lock:
+            for name, value in counts.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def report(self, prefix: str = "Progress") -> str:
+        elapsed = max(time.perf_counter() - self.started_at, 1e-9)
+        line = (
+            f"{prefix}: {self.files} files ({self.failed_files} failed), {self.chunks} chunks, "
+            f"{self.stored_chunks} stored, {self.tokens} tokens in {elapsed:.1f}s | "
+            f"{self.files / elapsed:.2f} files/s, {self.chunks / elapsed:.1f} chunks/s, {self.tokens / elapsed:.0f} tokens/s"
+        )
+        print(line)
+        return line
+
+
+def run_pipeline(
+    file_paths: Iterable[str],
+    embeddings: Embeddings,
+    store_batch: Callable[[DocumentBatch], None],
+    *,
+    load_workers: Optional[int] = None,
+    embed_workers: int = 4,
+    embed_batch_size: int = 256,
+    queue_size: int = 8,
+    report_every: float = 10.0,
+    load_fn: Callable = load_and_chunk,
+) -> PipelineStats:
+    """
+    Parses, embeds and stores `file_paths`, calling `store_batch` once per document from a single writer thread.
+    Failures are reported and counted per file; they never stop the rest of the corpus.
+    """
+    stats = PipelineStats()
+    embed_queue: "queue.Queue" = queue.Queue(maxsize=queue_size)
+    store_queue: "queue.Queue" = queue.Queue(maxsize=queue_size)
+
+    def embed_worker():
+        while (batch := embed_queue.get()) is not _DONE:
+            try:
+                texts = [chunk.page_content for chunk in batch.chunks]
+                batch.vectors = []
+                for start in range(0, len(texts), embed_batch_size):
+                    batch.vectors.extend(embeddings.embed_documents(texts[start:start + embed_batch_size]))
+                store_queue.put(batch)
+            except Exception as e:
+                print(f"Failed to embed: {batch.source}\nError: {e}")
+                stats.add(failed_files=1)
+
+    def store_worker():
+        while (batch := store_queue.get()) is not _DONE:
+            try:
+                store_batch(batch)
+                stats.add(stored_chunks=len(batch.chunks))
+            except Exception as e:
+                print(f"Failed to store: {batch.source}\nError: {e}")
+                stats.add(failed_files=1)
+
+    finished = threading.Event()
+
+    def reporter():
+        while not finished.wait(report_every):
+            stats.report()
+
+    embedders = [threading.Thread(target=embed_worker, name=f"embed-{i}", daemon=True) for i in range(embed_workers)]
+    writer = threading.Thread(target=store_worker, name="store", daemon=True)
+    for thread in embedders + [writer, threading.Thread(target=reporter, name="reporter", daemon=True)]:
+        thread.start()
+
+    # --- Stage 1: parse and chunk in the process pool, keeping a bounded number of files in flight ---
+    # Workers are spawned, not forked: the pool starts them on demand, while the threads above may hold locks
+    # (queues, HTTP clients) that a forked child would inherit locked.
+    with ProcessPoolExecutor(max_workers=load_workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        pending: Dict[Future, str] = {}
+        paths = iter(file_paths)
+        exhausted = False
+        while pending or not exhausted:
+            while not exhausted and len(pending) < queue_size:
+                path = next(paths, None)
+                if path is None:
+                    exhausted = True
+                else:
+                    pending[pool.submit(load_fn, path)] = path
+            if not pending:
+                break
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                path = pending.pop(future)
+                try:
+                    source, chunks, token_count = future.result()
+                except Exception as e:
+                    print(f"Failed to process file: {path}\nError: {e}")
+                    stats.add(files=1, failed_files=1)
+                    continue
+                stats.add(files=1, chunks=len(chunks), tokens=token_count)
+                # Documents without chunks still reach the store so it can clear their old chunks.
+                # Blocks when the embedders fall behind, which throttles parsing (backpressure).
+                embed_queue.put(DocumentBatch(source=source, chunks=chunks, token_count=token_count))
+
+    # --- Drain: stop the embedders, then the writer ---
+    for _ in embedders:
+        embed_queue.put(_DONE)
+    for thread in embedders:
+        thread.join()
+    store_queue.put(_DONE)
+    writer.join()
+    finished.set()
+
+    stats.report("Finished")
+    return stats
@@ -0,0 +1,339 @@
+# data_ingestion/sync.py
+#
+# Incremental document sync. A manifest table records the size, mtime and content hash of every
+# ingested file, so a re-run only re-chunks and re-embeds new or changed files and deletes the chunks
+# of removed ones. Each document is replaced in its own transaction: queries running during a sync
+# see either the old or the new chunks of a document, never an empty collection. Chunks are written
+# with COPY: binary over asyncpg (`PgVectorStore`) or CSV over psycopg2, following VECTOR_STORE_DRIVER.
+
+import asyncio
+import csv
+import hashlib
+import io
+import json
+import os
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterable, List, Optional
+
+import sqlalchemy
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from app.services.retrieval import vector_literal
+from app.services.storage import COPY_COLUMNS, PgVectorStore
+from data_ingestion.pipeline import DocumentBatch, PipelineStats, run_pipeline
+
+MANIFEST_TABLE = "quasar_ingest_manifest"
+ARCHIVE_MANIFEST = ".archives.json"
+
+
+@dataclass
+class FileState:
+    source: str
+    size: int
+    mtime: float
+    content_hash: str = ""
+
+
+def file_hash(path: str, block_size: int = 1 << 20) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while block := f.read(block_size):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ArchiveManifest:
+    """
+    The archives expanded into `extract_to`, keyed by their own size, mtime and content hash (in a JSON file
+    next to their contents). An unchanged archive is not extracted again, so its files keep their mtimes and
+    the sync skips them without reading them.
+    """
+
+    def __init__(self, extract_to: str):
+        self.extract_to = extract_to
+        self.path = os.path.join(extract_to, ARCHIVE_MANIFEST)
+        try:
+            with open(self.path) as f:
+                self.entries: Dict[str, dict] = json.load(f)
+        except (FileNotFoundError, ValueError):
+            self.entries = {}
+
+    def expand(self, archive_path: str, extract: Callable[[str, str], List[str]]) -> List[str]:
+        """The archive's files, extracted with `extract(archive_path, extract_to)` only if it is new or changed."""
+        stat = os.stat(archive_path)
+        known = self.entries.get(archive_path)
+        if known and not all(os.path.isfile(path) for path in known["files"]):
+            known = None
+        if known and known["size"] == stat.st_size and known["mtime"] == stat.st_mtime:
+            return known["files"]
+        content_hash = file_hash(archive_path)
+        if known and known["content_hash"] == content_hash:
+            files = known["files"]
+        else:
+            files = extract(archive_path, self.extract_to)
+            # Files the new version of the archive no longer contains are pruned by the sync
+            for path in set(known["files"] if known else ()) - set(files):
+                os.remove(path)
+        self.entries[archive_path] = {"size": stat.st_size, "mtime": stat.st_mtime, "content_hash": content_hash, "files": files}
+        self._save()
+        return files
+
+    def _save(self):
+        os.makedirs(self.extract_to, exist_ok=True)
+        with open(self.path, "w") as f:
+            json.dump(self.entries, f)
+
+
+class DocumentSyncStore:
+    """
+    Per-document writes to the langchain PGVector tables, plus the ingestion manifest. With a
+    `vector_store`, chunks are written by `PgVectorStore.areplace_chunks` on the store's own event loop;
+    without one, by a CSV COPY on the engine. Call `close` when done.
+    """
+
+    def __init__(self, engine: sqlalchemy.engine.Engine, collection_name: str, vector_store: Optional[PgVectorStore] = None):
+        self.engine = engine
+        self.collection_name = collection_name
+        self.vector_store = vector_store
+        self._collection_id: Optional[str] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @classmethod
+    def from_settings(cls, engine: sqlalchemy.engine.Engine, collection_name: str, settings) -> "DocumentSyncStore":
+        """The store for VECTOR_STORE_DRIVER. Documents are written one at a time, so asyncpg needs one connection."""
+        if settings.VECTOR_STORE_DRIVER == "asyncpg":
+            vector_store = PgVectorStore(engine, collection_name, settings.EMBEDDING_DIMENSIONS, pool_min_size=1, pool_max_size=1)
+            return cls(engine, collection_name, vector_store)
+        if settings.VECTOR_STORE_DRIVER == "psycopg2":
+            return cls(engine, collection_name)
+        raise ValueError(f"Unknown VECTOR_STORE_DRIVER '{settings.VECTOR_STORE_DRIVER}'")
+
+    def close(self):
+        """Closes the asyncpg pool and its event loop; the engine belongs to the caller."""
+        if self._loop is not None:
+            self._loop.run_until_complete(self.vector_store.aclose_pool())
+            self._loop.close()
+            self._loop = None
+
+    def ensure_schema(self):
+        """
+        Creates the manifest table and an index on the chunks' source, which every per-document
+        delete filters on. The collection itself is created by PGVector.
+        """
+        with self.engine.begin() as connection:
+            connection.execute(sqlalchemy.text(
+                "CREATE INDEX IF NOT EXISTS ix_langchain_pg_embedding_source "
+                "ON langchain_pg_embedding (collection_id, (cmetadata->>'source'))"
+            ))
+            connection.execute(sqlalchemy.text(f"""
+                CREATE TABLE IF NOT EXISTS {MANIFEST_TABLE} (
+                    collection_name TEXT NOT NULL,
+                    source TEXT NOT NULL,
+                    size BIGINT NOT NULL,
+                    mtime DOUBLE PRECISION NOT NULL,
+                    content_hash TEXT NOT NULL,
+                    chunk_count INTEGER NOT NULL,
+                    updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                    PRIMARY KEY (collection_name, source)
+                )
+            """))
+
+    @property
+    def collection_id(self) -> str:
+        if self._collection_id is None:
+            with self.engine.connect() as connection:
+                row = connection.execute(
+                    sqlalchemy.text("SELECT uuid FROM langchain_pg_collection WHERE name = :name"),
+                    {"name": self.collection_name},
+                ).first()
+            if row is None:
+                raise ValueError(f"Collection '{self.collection_name}' not found")
+            self._collection_id = str(row[0])
+        return self._collection_id
+
+    def load_manifest(self) -> Dict[str, FileState]:
+        with self.engine.connect() as connection:
+            rows = connection.execute(
+                sqlalchemy.text(f"SELECT source, size, mtime, content_hash FROM {MANIFEST_TABLE} WHERE collection_name = :name"),
+                {"name": self.collection_name},
+            )
+            return {row.source: FileState(row.source, row.size, row.mtime, row.content_hash) for row in rows}
+
+    def replace_document(self, source: str, chunks: List[Document], vectors: List[List[float]], state: Optional[FileState] = None):
+        """
+        Atomically swaps all chunks of `source` for the new ones and records its manifest entry. Over asyncpg
+        the manifest entry is written after the chunks' transaction: a run interrupted in between leaves the
+        document out of the manifest, so the next sync replaces it again.
+        """
+        chunks = [Document(page_content=chunk.page_content, metadata={**chunk.metadata, "source": source}) for chunk in chunks]
+        if self.vector_store is not None:
+            self._run(self.vector_store.areplace_chunks(chunks, vectors, sources=[source]))
+            if state is not None:
+                with self.engine.begin() as connection:
+                    self._upsert_manifest(connection, state, len(chunks))
+            return
+        with self.engine.begin() as connection:
+            self._delete_chunks(connection, source)
+            if chunks:
+                self._copy_chunks(connection, chunks, vectors)
+            if state is not None:
+                self._upsert_manifest(connection, state, len(chunks))
+
+    def delete_document(self, source: str):
+        with self.engine.begin() as connection:
+            self._delete_chunks(connection, source)
+            connection.execute(
+                sqlalchemy.text(f"DELETE FROM {MANIFEST_TABLE} WHERE collection_name = :name AND source = :source"),
+                {"name": self.collection_name, "source": source},
+            )
+
+    def touch(self, state: FileState):
+        """Records a new size/mtime for a file whose content hash did not change."""
+        with self.engine.begin() as connection:
+            connection.execute(
+                sqlalchemy.text(
+                    f"UPDATE {MANIFEST_TABLE} SET size = :size, mtime = :mtime, updated_at = now() "
+                    "WHERE collection_name = :name AND source = :source"
+                ),
+                {"name": self.collection_name, "source": state.source, "size": state.size, "mtime": state.mtime},
+            )
+
+    def clear_manifest(self):
+        """Forgets every ingested file, so the next sync re-ingests the whole corpus."""
+        with self.engine.begin() as connection:
+            connection.execute(
+                sqlalchemy.text(f"DELETE FROM {MANIFEST_TABLE} WHERE collection_name = :name"),
+                {"name": self.collection_name},
+            )
+
+    def bump_version(self):
+        """Changes the collection metadata so serving-side answer caches notice the new contents."""
+        with self.engine.begin() as connection:
+            connection.execute(
+                sqlalchemy.text("UPDATE langchain_pg_collection SET cmetadata = :cmetadata WHERE uuid = :uuid"),
+                {"cmetadata": json.dumps({"synced_at": datetime.now(timezone.utc).isoformat()}), "uuid": self.collection_id},
+            )
+
+    # --- Internals ---
+    def _run(self, coroutine):
+        """Runs an asyncpg write on the store's event loop (the pipeline stores from one thread at a time)."""
+        if self._loop is None:
+            self._loop = asyncio.new_event_loop()
+        return self._loop.run_until_complete(coroutine)
+
+    def _copy_chunks(self, connection, chunks: List[Document], vectors: List[List[float]]):
+        """Writes the chunks with a single COPY (CSV) on `connection`'s transaction, instead of one INSERT per row."""
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, quoting=csv.QUOTE_ALL, lineterminator="\n")
+        for chunk, vector in zip(chunks, vectors):
+            row = {
+                "uuid": str(uuid.uuid4()),
+                "collection_id": self.collection_id,
+                "embedding": vector_literal(vector),
+                "document": chunk.page_content,
+                "cmetadata": json.dumps(chunk.metadata, default=str),
+                "custom_id": str(uuid.uuid4()),
+            }
+            writer.writerow([row[column] for column in COPY_COLUMNS])
+        buffer.seek(0)
+        with connection.connection.cursor() as cursor:
+            cursor.copy_expert(f"COPY langchain_pg_embedding ({', '.join(COPY_COLUMNS)}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+    def _delete_chunks(self, connection, source: str):
+        connection.execute(
+            sqlalchemy.text(
+                "DELETE FROM langchain_pg_embedding WHERE collection_id = :collection_id AND cmetadata->>'source' = :source"
+            ),
+            {"collection_id": self.collection_id, "source": source},
+        )
+
+    def _upsert_manifest(self, connection, state: FileState, chunk_count: int):
+        connection.execute(
+            sqlalchemy.text(f"""
+                INSERT INTO {MANIFEST_TABLE} (collection_name, source, size, mtime, content_hash, chunk_count, updated_at)
+                VALUES (:name, :source, :size, :mtime, :content_hash, :chunk_count, now())
+                ON CONFLICT (collection_name, source) DO UPDATE SET
+                    size = EXCLUDED.size, mtime = EXCLUDED.mtime, content_hash = EXCLUDED.content_hash,
+                    chunk_count = EXCLUDED.chunk_count, updated_at = EXCLUDED.updated_at
+            """),
+            {
+                "name": self.collection_name, "source": state.source, "size": state.size, "mtime": state.mtime,
+                "content_hash": state.content_hash, "chunk_count": chunk_count,
+            },
+        )
+
+
+def bulk_replace_chunks(
+    engine: sqlalchemy.engine.Engine, collection_name: str, settings, chunks: List[Document], vectors: List[List[float]]
+) -> int:
+    """
+    Entry point for scripts: replaces the stored chunks of every document that `chunks` belong to (by their
+    `source` metadata), one transaction per document, over VECTOR_STORE_DRIVER. Returns the number of chunks
+    written. The engine stays open; only the pool opened here is closed.
+    """
+    by_source: Dict[str, list] = {}
+    for chunk, vector in zip(chunks, vectors):
+        by_source.setdefault(str(chunk.metadata.get("source", "")), []).append((chunk, vector))
+    store = DocumentSyncStore.from_settings(engine, collection_name, settings)
+    try:
+        for source, items in by_source.items():
+            store.replace_document(source, [chunk for chunk, _ in items], [vector for _, vector in items])
+    finally:
+        store.close()
+    return len(chunks)
+
+
+def sync_documents(
+    file_paths: Iterable[str],
+    embeddings: Embeddings,
+    store: DocumentSyncStore,
+    *,
+    prune: bool = True,
+    **pipeline_args,
+) -> PipelineStats:
+    """
+    Brings the collection in line with `file_paths`.
+
+    Files whose size and mtime match the manifest are skipped without being read; files whose bytes
+    are unchanged only get their manifest entry refreshed. New and changed files go through the
+    ingestion pipeline. With `prune`, documents in the manifest that are no longer present are deleted.
+    """
+    store.ensure_schema()
+    manifest = store.load_manifest()
+
+    seen = set()
+    changed: Dict[str, FileState] = {}
+    unchanged = 0
+    for path in file_paths:
+        seen.add(path)
+        stat = os.stat(path)
+        state = FileState(path, stat.st_size, stat.st_mtime)
+        known = manifest.get(path)
+        if known and known.size == state.size and known.mtime == state.mtime:
+            unchanged += 1
+            continue
+        state.content_hash = file_hash(path)
+        if known and known.content_hash == state.content_hash:
+            store.touch(state)
+            unchanged += 1
+            continue
+        changed[path] = state
+
+    removed = sorted(set(manifest) - seen) if prune else []
+    print(f"Sync plan: {len(changed)} new/changed, {unchanged} unchanged, {len(removed)} removed.")
+
+    for source in removed:
+        print(f"Removing deleted document: {source}")
+        store.delete_document(source)
+
+    def store_batch(batch: DocumentBatch):
+        store.replace_document(batch.source, batch.chunks, batch.vectors, changed[batch.source])
+
+    stats = run_pipeline(changed.keys(), embeddings, store_batch, **pipeline_args)
+
+    if changed or removed:
+        store.bump_version()
+    return stats
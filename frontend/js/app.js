@@ -1,12 +1,19 @@
-// frontend/js/script.js (Updated to handle sources)
+// frontend/js/script.js (Updated to stream answers and handle sources)
 
 document.addEventListener("DOMContentLoaded", () => {
     const userInput = document.getElementById("user-input");
     const sendButton = document.getElementById("send-button");
     const chatBox = document.getElementById("chat-box");
     const citationBox = document.getElementById("citation-box"); // Get the citation panel
-    // const apiUrl = "http://localhost:8000/api/v1/chat";
-    const apiUrl = "/api/v1/chat";
+    // const apiUrl = "http://localhost:8000/api/v1/chat/stream";
+    const apiUrl = "/api/v1/chat/stream";
+
+    // Progress text shown after each graph node finishes, until the first answer token arrives.
+    const progressMessages = {
+        router: "Searching the knowledge base...",
+        retrieve: "Checking the retrieved documents...",
+        content_evaluator: "Writing the answer...",
+    };
 
     function addMessage(html, sender) {
         const messageDiv = document.createElement("div");
@@ -57,13 +64,47 @@ document.addEventListener("DOMContentLoaded", () => {
 
             if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
 
-            const data = await response.json();
-            
-            // Update the message with the real answer
-            thinkingMessageDiv.innerHTML = data.answer; // Use innerHTML for citations
-            
-            // Update the context panel with the sources
-            updateContextPanel(data.sources);
+            // Read the Server-Sent Events stream and render tokens as they arrive
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = "";
+            let answer = "";
+
+            const handleEvent = (event, data) => {
+                if (event === "node" && answer === "" && progressMessages[data.node]) {
+                    thinkingMessageDiv.innerText = progressMessages[data.node];
+                } else if (event === "token") {
+                    answer += data.content;
+                    thinkingMessageDiv.innerHTML = answer; // Use innerHTML for citations
+                    chatBox.scrollTop = chatBox.scrollHeight;
+                } else if (event === "sources") {
+                    thinkingMessageDiv.innerHTML = data.answer;
+                    updateContextPanel(data.sources);
+                } else if (event === "error") {
+                    throw new Error(data.message);
+                }
+            };
+
+            while (true) {
+                const { value, done } = await reader.read();
+                if (done) break;
+                buffer += decoder.decode(value, { stream: true });
+
+                // Events are separated by a blank line
+                let boundary;
+                while ((boundary = buffer.indexOf("\n\n")) !== -1) {
+                    const frame = buffer.slice(0, boundary);
+                    buffer = buffer.slice(boundary + 2);
+
+                    let event = "message";
+                    let data = "";
+                    frame.split("\n").forEach((line) => {
+                        if (line.startsWith("event:")) event = line.slice(6).trim();
+                        else if (line.startsWith("data:")) data += line.slice(5).trim();
+                    });
+                    if (data) handleEvent(event, JSON.parse(data));
+                }
+            }
 
         } catch (error) {
             console.error("Error fetching from API:", error);
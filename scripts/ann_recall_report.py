@@ -0,0 +1,73 @@
+# scripts/ann_recall_report.py
+#
+# Measures recall@k and latency of the ANN index against exact search, for a range of
+# ef_search (HNSW) or probes (IVFFlat) values. Stored chunk embeddings are used as queries.
+#
+#   poetry run python scripts/ann_recall_report.py --queries 200 --k 4
+#   poetry run python scripts/ann_recall_report.py --filter source=documents/report.pdf
+
+import argparse
+import json
+
+import sqlalchemy
+
+from app.agent.graph import COLLECTION_NAME
+from app.core.config import settings
+from app.services.retrieval import PgVectorSearch
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall-vs-latency report for the pgvector ANN index.")
+    parser.add_argument("--queries", type=int, default=100, help="Number of sampled query vectors.")
+    parser.add_argument("--k", type=int, default=settings.RETRIEVAL_K)
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[10, 20, 40, 80, 160])
+    parser.add_argument("--probes", type=int, nargs="+", default=[1, 5, 10, 20, 50])
+    parser.add_argument("--rescore-factor", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--filter", action="append", default=[], metavar="KEY=VALUE", help="Metadata pre-filter (repeatable).")
+    parser.add_argument("--ensure-index", action="store_true", help="Build the index first if it is missing.")
+    parser.add_argument("--rebuild-index", action="store_true", help="Drop and rebuild the index first.")
+    parser.add_argument("--output", help="Also write the report as JSON to this path.")
+    args = parser.parse_args()
+
+    filters = {}
+    for item in args.filter:
+        key, _, value = item.partition("=")
+        filters.setdefault(key, []).append(value)
+
+    search = PgVectorSearch.from_settings(sqlalchemy.create_engine(settings.DATABASE_URL), COLLECTION_NAME, settings)
+    if args.rebuild_index:
+        search.rebuild_index()
+    elif args.ensure_index:
+        search.ensure_index()
+
+    query_vectors = search.sample_query_vectors(args.queries)
+    print(
+        f"--- ANN Recall Report: {search.index_type} on {search.index_dimensions}-d {search.index_precision}, "
+        f"{search.storage_type} storage, {len(query_vectors)} queries, k={args.k}, filter={filters or None} ---"
+    )
+    report = search.recall_report(
+        query_vectors,
+        k=args.k,
+        ef_search_values=args.ef_search,
+        probes_values=args.probes,
+        rescore_factor_values=args.rescore_factor,
+        filter=filters or None,
+    )
+
+    recall_key = f"recall@{args.k}"
+    print(f"{'setting':<12}{'value':>8}{recall_key:>12}{'mean ms':>10}{'p95 ms':>10}")
+    for row in report:
+        print(f"{row['setting']:<12}{str(row['value'] or '-'):>8}{row[recall_key]:>12.4f}{row['mean_ms']:>10.2f}{row['p95_ms']:>10.2f}")
+
+    sizes = search.size_report()
+    print("--- Storage ---")
+    for name, size in sizes.items():
+        print(f"{name:<48}{size / 2**20:>10.1f} MiB")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"search": report, "sizes": sizes}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
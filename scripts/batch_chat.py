@@ -0,0 +1,127 @@
+# scripts/batch_chat.py
+#
+# Bulk question answering through /api/v1/chat/batch, e.g. for nightly jobs. Questions come from a text file
+# (one per line) or a JSONL file ({"question": ...}); answers are written as JSONL in input order, with the
+# question's line number as `index`. --compare also sends the same questions one by one to /api/v1/chat at
+# the same concurrency and reports the throughput of both (the answer cache is cleared before each run).
+#
+#   poetry run uvicorn app.main:app --workers 1
+#   poetry run python scripts/batch_chat.py questions.txt --output answers.jsonl --concurrency 32
+#   poetry run python scripts/batch_chat.py questions.txt --compare
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+from typing import Any, Dict, List
+
+import httpx
+
+
+def read_questions(path: str) -> List[str]:
+    with open(path) as f:
+        lines = [line.strip() for line in f if line.strip()]
+    if path.endswith(".jsonl"):
+        return [json.loads(line)["question"] for line in lines]
+    return lines
+
+
+async def post_batch(client: httpx.AsyncClient, base_url: str, questions: List[str], offset: int, concurrency: int) -> List[Dict[str, Any]]:
+    """Sends one batch and collects its NDJSON lines as they arrive; waits and retries while the server answers 429."""
+    while True:
+        results = []
+        payload = {"questions": questions, "max_concurrency": concurrency}
+        async with client.stream("POST", f"{base_url}/api/v1/chat/batch", json=payload) as response:
+            if response.status_code == 429:
+                delay = float(response.headers.get("Retry-After", 1))
+                print(f"Server busy, retrying in {delay:.0f}s", file=sys.stderr)
+                await asyncio.sleep(delay)
+                continue
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line:
+                    continue
+                result = json.loads(line)
+                if "index" in result:
+                    result["index"] += offset
+                results.append(result)
+                print(f"\r{offset + len(results)} answered", end="", file=sys.stderr)
+        return results
+
+
+async def run_batches(base_url: str, questions: List[str], batch_size: int, concurrency: int, timeout: float) -> List[Dict[str, Any]]:
+    results = []
+    async with httpx.AsyncClient(timeout=timeout) as client:
+        for offset in range(0, len(questions), batch_size):
+            results += await post_batch(client, base_url, questions[offset:offset + batch_size], offset, concurrency)
+    print(file=sys.stderr)
+    return results
+
+
+async def run_single(base_url: str, questions: List[str], concurrency: int, timeout: float) -> int:
+    """The same questions through /api/v1/chat, `concurrency` at a time. Returns the number of failures."""
+    failures = 0
+    semaphore = asyncio.Semaphore(concurrency)
+    async with httpx.AsyncClient(timeout=timeout, limits=httpx.Limits(max_connections=concurrency)) as client:
+
+        async def one_question(question: str):
+            nonlocal failures
+            async with semaphore:
+                try:
+                    (await client.post(f"{base_url}/api/v1/chat", json={"question": question})).raise_for_status()
+                except httpx.HTTPError:
+                    failures += 1
+
+        await asyncio.gather(*(one_question(question) for question in questions))
+    return failures
+
+
+def clear_answer_cache(base_url: str):
+    httpx.post(f"{base_url}/api/v1/cache/invalidate").raise_for_status()
+
+
+def per_minute(count: int, seconds: float) -> float:
+    return round(count / seconds * 60, 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Answer a file of questions through the Quasar batch chat API.")
+    parser.add_argument("questions", help="Text file with one question per line, or JSONL with a 'question' field.")
+    parser.add_argument("--output", help="Write the answers here as JSONL (default: stdout).")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Questions per batch request.")
+    parser.add_argument("--concurrency", type=int, default=16, help="Questions answered at once by the server.")
+    parser.add_argument("--timeout", type=float, default=3600.0)
+    parser.add_argument("--compare", action="store_true", help="Also time the questions through /api/v1/chat.")
+    args = parser.parse_args()
+
+    questions = read_questions(args.questions)
+    if args.compare:
+        clear_answer_cache(args.url)
+    started = time.perf_counter()
+    results = asyncio.run(run_batches(args.url, questions, args.batch_size, args.concurrency, args.timeout))
+    batch_seconds = time.perf_counter() - started
+
+    results.sort(key=lambda result: result.get("index", len(questions)))
+    output = open(args.output, "w") if args.output else sys.stdout
+    for result in results:
+        output.write(json.dumps(result) + "\n")
+    if args.output:
+        output.close()
+
+    errors = sum(1 for result in results if result.get("error"))
+    print("--- Batch Chat ---", file=sys.stderr)
+    print(f"Questions:   {len(questions)} ({errors} failed, {sum(1 for r in results if r.get('cached'))} cached)", file=sys.stderr)
+    print(f"Batch API:   {batch_seconds:.1f}s, {per_minute(len(questions), batch_seconds)} questions/min", file=sys.stderr)
+    if args.compare:
+        clear_answer_cache(args.url)
+        started = time.perf_counter()
+        failures = asyncio.run(run_single(args.url, questions, args.concurrency, args.timeout))
+        single_seconds = time.perf_counter() - started
+        print(f"Single API:  {single_seconds:.1f}s, {per_minute(len(questions), single_seconds)} questions/min ({failures} failed)", file=sys.stderr)
+        print(f"Speedup:     {single_seconds / batch_seconds:.2f}x", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
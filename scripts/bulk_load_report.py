@@ -0,0 +1,146 @@
+# scripts/bulk_load_report.py
+#
+# Chunk write throughput into a scratch collection, with random embeddings (no API calls):
+#   insert       one INSERT per chunk, executemany over psycopg2 (the previous ingestion path)
+#   copy_csv     DocumentSyncStore.replace_document over psycopg2: one CSV COPY per document
+#   copy_binary  DocumentSyncStore.replace_document over asyncpg (PgVectorStore): one binary COPY per document
+# The last two are the incremental sync's write paths, with VECTOR_STORE_DRIVER=psycopg2 and asyncpg.
+# Every method replaces the chunks of one document per transaction, as ingestion does.
+#
+#   docker compose up -d db
+#   poetry run python -m scripts.bulk_load_report --chunks 100000 --insert-chunks 5000
+
+import argparse
+import json
+import time
+import uuid
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+
+import numpy as np
+import sqlalchemy
+from langchain_community.vectorstores.pgvector import PGVector
+from langchain_core.documents import Document
+
+from app.agent.stand_ins import DeterministicEmbeddings
+from app.core.config import settings
+from app.services.retrieval import PgVectorSearch, vector_literal
+from app.services.storage import PgVectorStore
+from data_ingestion.sync import DocumentSyncStore
+
+SCRATCH_COLLECTION = "quasar_bulk_load_benchmark"
+WORDS = "vector index chunk page source embedding query recall latency document section table figure".split()
+
+
+def synthetic_documents(chunks: int, chunks_per_document: int, dimensions: int, seed: int) -> Iterator[Tuple[str, List[Document], np.ndarray]]:
+    """Yields (source, chunks, vectors) one document at a time, so 100k chunks never sit in memory at once."""
+    rng = np.random.default_rng(seed)
+    for start in range(0, chunks, chunks_per_document):
+        source = f"benchmark/document-{start // chunks_per_document}.pdf"
+        count = min(chunks_per_document, chunks - start)
+        docs = [
+            Document(
+                page_content=" ".join(rng.choice(WORDS, size=120)),
+                metadata={"source": source, "page_number": i // 4 + 1, "start_index": (i % 4) * 900},
+            )
+            for i in range(count)
+        ]
+        vectors = rng.standard_normal((count, dimensions), dtype=np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        yield source, docs, vectors
+
+
+def insert_rows(store: DocumentSyncStore, source: str, chunks: List[Document], vectors: np.ndarray):
+    """The previous `replace_document`: delete, then one INSERT per chunk."""
+    rows = [
+        {
+            "uuid": str(uuid.uuid4()),
+            "collection_id": store.collection_id,
+            "embedding": vector_literal(vector),
+            "document": chunk.page_content,
+            "cmetadata": json.dumps(chunk.metadata),
+            "custom_id": str(uuid.uuid4()),
+        }
+        for chunk, vector in zip(chunks, vectors)
+    ]
+    with store.engine.begin() as connection:
+        store._delete_chunks(connection, source)
+        connection.execute(
+            sqlalchemy.text(
+                "INSERT INTO langchain_pg_embedding (uuid, collection_id, embedding, document, cmetadata, custom_id) "
+                "VALUES (:uuid, :collection_id, :embedding, :document, :cmetadata, :custom_id)"
+            ),
+            rows,
+        )
+
+
+def measure(name: str, write: Callable[[str, List[Document], np.ndarray], Any], args, clear: Callable[[], None]) -> Dict[str, Any]:
+    """Writes the synthetic corpus with `write`, timing only the writes."""
+    clear()
+    chunks = args.insert_chunks if name == "insert" else args.chunks
+    seconds = 0.0
+    for source, docs, vectors in synthetic_documents(chunks, args.chunks_per_document, settings.EMBEDDING_DIMENSIONS, args.seed):
+        started = time.perf_counter()
+        write(source, docs, vectors)
+        seconds += time.perf_counter() - started
+    row = {"method": name, "chunks": chunks, "seconds": round(seconds, 2), "chunks_per_s": round(chunks / seconds, 1)}
+    print(f"{name:<14}{chunks:>10}{row['seconds']:>12.2f}{row['chunks_per_s']:>14.1f}")
+    return row
+
+
+def run_report(args) -> List[Dict[str, Any]]:
+    engine = sqlalchemy.create_engine(settings.DATABASE_URL)
+    collection = PGVector(
+        connection_string=settings.DATABASE_URL, embedding_function=DeterministicEmbeddings(settings.EMBEDDING_DIMENSIONS),
+        collection_name=SCRATCH_COLLECTION, pre_delete_collection=True,
+    )
+    # Same column type and generated full-text column as the real collection
+    vector_search = PgVectorSearch.from_settings(engine, SCRATCH_COLLECTION, settings)
+    vector_search.ensure_storage()
+    vector_search.ensure_text_search()
+    sync_store = DocumentSyncStore(engine, SCRATCH_COLLECTION)
+    pg_store = PgVectorStore(engine, SCRATCH_COLLECTION, settings.EMBEDDING_DIMENSIONS, pool_min_size=1, pool_max_size=1)
+    binary_store = DocumentSyncStore(engine, SCRATCH_COLLECTION, pg_store)
+
+    def clear():
+        with engine.begin() as connection:
+            connection.execute(
+                sqlalchemy.text("DELETE FROM langchain_pg_embedding WHERE collection_id = :id"), {"id": sync_store.collection_id}
+            )
+
+    print(f"{'method':<14}{'chunks':>10}{'seconds':>12}{'chunks/s':>14}")
+    try:
+        report = [
+            measure("insert", lambda source, docs, vectors: insert_rows(sync_store, source, docs, vectors), args, clear),
+            measure("copy_csv", sync_store.replace_document, args, clear),
+            measure("copy_binary", binary_store.replace_document, args, clear),
+        ]
+    finally:
+        binary_store.close()
+        if not args.keep:
+            collection.delete_collection()
+    baseline = report[0]["chunks_per_s"]
+    for row in report:
+        row["speedup"] = round(row["chunks_per_s"] / baseline, 1)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chunk write throughput: row INSERTs vs. CSV COPY vs. binary COPY.")
+    parser.add_argument("--chunks", type=int, default=100_000, help="Chunks written by the COPY methods.")
+    parser.add_argument("--insert-chunks", type=int, default=5_000, help="Chunks written with row INSERTs (slow).")
+    parser.add_argument("--chunks-per-document", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--keep", action="store_true", help="Keep the scratch collection.")
+    parser.add_argument("--output", help="Also write the report as JSON to this path.")
+    args = parser.parse_args()
+
+    print(f"--- Bulk Load Report: {settings.EMBEDDING_DIMENSIONS}-d {settings.VECTOR_STORAGE_TYPE} embeddings ---")
+    report = run_report(args)
+    print("Speedup over row INSERTs: " + ", ".join(f"{row['method']} {row['speedup']}x" for row in report[1:]))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+# scripts/chunking_report.py
+#
+# Compares the structured chunker (data_ingestion/chunking.py, configured by the CHUNK_* settings) with the
+# former recursive splitter on a documents directory: chunk count, embedded tokens and how many of them are
+# overlap (text embedded twice), chunk sizes, chunks with a page number, and retrieval recall. Each document is
+# parsed once, in "elements" mode; the recursive splitter gets the elements joined by blank lines, as "single"
+# mode would give them.
+#
+# Recall is measured in memory, by cosine top-k over each strategy's chunks, on labeled questions: JSON Lines of
+# {"question": ..., "sources": [...], "evidence": ...}, where the optional `evidence` is a passage answering the
+# question and a hit needs a retrieved chunk of a relevant source containing it (without it, the source is
+# enough). Without --labeled, questions are generated from sentences of the documents. The strategies' chunks
+# differ in size, so recall is reported at k chunks and within CONTEXT_TOKEN_BUDGET tokens of chunks.
+# Embeddings are text-embedding-3-large (through the embedding cache), or bag-of-words stand-ins with --stand-in.
+#
+#   poetry run python -m scripts.chunking_report --documents documents/ --labeled labeled.jsonl
+#   poetry run python -m scripts.chunking_report --stand-in --questions 200 --output chunking.json
+
+import argparse
+import json
+import random
+import re
+import statistics
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from app.agent.stand_ins import DeterministicEmbeddings, content_words
+from app.core.config import settings
+from data_ingestion.chunking import ELEMENT_SEPARATOR, Chunker, RecursiveChunker, chunker_from_settings, count_tokens
+from data_ingestion.loaders import load_document
+
+# (question, relevant sources, evidence)
+LabeledQuestion = Tuple[str, List[str], Optional[str]]
+
+
+def normalize(text: str) -> str:
+    return " ".join(text.lower().split())
+
+
+def load_labeled(path: str) -> List[LabeledQuestion]:
+    labeled = []
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                item = json.loads(line)
+                labeled.append((item["question"], item["sources"], item.get("evidence")))
+    return labeled
+
+
+def generated_questions(elements: Dict[str, List[Document]], count: int, seed: int) -> List[LabeledQuestion]:
+    """One question per sampled sentence of body text, naming a few of its content words; the sentence is the evidence."""
+    sentences = [
+        (source, sentence)
+        for source, items in elements.items()
+        for element in items if element.metadata.get("category") in ("NarrativeText", "ListItem")
+        for sentence in re.split(r"(?<=[.!?])\s+", element.page_content.strip())
+        if 8 <= len(sentence.split()) <= 60
+    ]
+    rng = random.Random(seed)
+    labeled = []
+    for source, sentence in rng.sample(sentences, min(count, len(sentences))):
+        words = sorted(set(content_words(sentence)))
+        terms = rng.sample(words, k=min(4, len(words)))
+        labeled.append((f"What does the documentation say about {' '.join(terms)}?", [source], sentence))
+    return labeled
+
+
+def chunk_corpus(chunker: Chunker, elements: Dict[str, List[Document]]) -> List[Document]:
+    chunks = []
+    for source, items in elements.items():
+        if chunker.mode == "single":
+            text = ELEMENT_SEPARATOR.join(element.page_content for element in items)
+            chunks += chunker.chunk([Document(page_content=text, metadata={"source": source})])
+        else:
+            chunks += chunker.chunk(items)
+    return chunks
+
+
+def chunk_stats(chunks: List[Document], source_tokens: int) -> Dict[str, Any]:
+    sizes = [count_tokens([chunk.page_content]) for chunk in chunks]
+    embedded = sum(sizes)
+    return {
+        "chunks": len(chunks),
+        "embedded_tokens": embedded,
+        "overlap_tokens": max(0, embedded - source_tokens),
+        "mean_chunk_tokens": round(statistics.mean(sizes), 1) if sizes else 0,
+        "max_chunk_tokens": max(sizes, default=0),
+        "with_page_number": round(sum(1 for chunk in chunks if "page_number" in chunk.metadata) / max(len(chunks), 1), 4),
+    }
+
+
+def recall(chunks: List[Document], embeddings: Embeddings, labeled: List[LabeledQuestion], k: int, token_budget: int) -> Dict[str, float]:
+    """Share of questions with a hit in the first k chunks, and in the first chunks fitting in `token_budget` tokens."""
+    matrix = np.asarray(embeddings.embed_documents([chunk.page_content for chunk in chunks]), dtype=np.float32)
+    queries = np.asarray(embeddings.embed_documents([question for question, _, _ in labeled]), dtype=np.float32)
+    sizes = [count_tokens([chunk.page_content]) for chunk in chunks]
+    texts = [normalize(chunk.page_content) for chunk in chunks]
+    at_k, in_budget = [], []
+    for (question, sources, evidence), query in zip(labeled, queries):
+        ranked = np.argsort(-(matrix @ query))
+        hits = [
+            chunks[i].metadata.get("source") in sources and (evidence is None or normalize(evidence) in texts[i])
+            for i in ranked
+        ]
+        at_k.append(any(hits[:k]))
+        used, found = 0, False
+        for position, i in enumerate(ranked):
+            used += sizes[i]
+            if used > token_budget and position:
+                break
+            found = found or hits[position]
+        in_budget.append(found)
+    return {f"recall@{k}": round(statistics.mean(at_k), 4), f"recall@{token_budget}_tokens": round(statistics.mean(in_budget), 4)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the structured chunker with the recursive character splitter.")
+    parser.add_argument("--documents", default="documents", help="Directory of documents (ZIP archives are expanded).")
+    parser.add_argument("--labeled", help="JSONL of {question, sources, evidence}; default: questions generated from the documents.")
+    parser.add_argument("--questions", type=int, default=100, help="Number of generated questions.")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--k", type=int, default=settings.RETRIEVAL_K)
+    parser.add_argument("--token-budget", type=int, default=settings.CONTEXT_TOKEN_BUDGET)
+    parser.add_argument("--stand-in", action="store_true", help="Bag-of-words stand-in embeddings instead of the OpenAI API.")
+    parser.add_argument("--output", help="Also write the report as JSON to this path.")
+    args = parser.parse_args()
+
+    from data_ingestion.ingest_all_types import discover_files
+
+    elements = {path: list(load_document(path, "elements")) for path in discover_files(args.documents)}
+    labeled = load_labeled(args.labeled) if args.labeled else generated_questions(elements, args.questions, args.seed)
+    if args.stand_in:
+        embeddings: Embeddings = DeterministicEmbeddings(settings.EMBEDDING_DIMENSIONS)
+    else:
+        from app.agent.graph import build_embeddings, openai_client_args
+
+        embeddings = build_embeddings(openai_client_args())
+
+    structured = chunker_from_settings(settings.model_copy(update={"CHUNKER": "structured"}))
+    strategies = {"recursive": RecursiveChunker(), "structured": structured}
+    source_tokens = count_tokens([ELEMENT_SEPARATOR.join(element.page_content for element in items) for items in elements.values()])
+    print(
+        f"--- Chunking Report: {len(elements)} documents, {source_tokens} tokens of text, {len(labeled)} questions, "
+        f"max_tokens={structured.max_tokens}, min_tokens={structured.min_tokens}, overlap_tokens={structured.overlap_tokens} ---"
+    )
+
+    report = {}
+    for name, chunker in strategies.items():
+        chunks = chunk_corpus(chunker, elements)
+        report[name] = {**chunk_stats(chunks, source_tokens), **recall(chunks, embeddings, labeled, args.k, args.token_budget)}
+
+    columns = list(report["recursive"])
+    print(f"{'metric':<24}" + "".join(f"{name:>14}" for name in report))
+    for column in columns:
+        print(f"{column:<24}" + "".join(f"{row[column]:>14}" for row in report.values()))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"documents": len(elements), "questions": len(labeled), "source_tokens": source_tokens, **report}, f, indent=2)
+        print(f"Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+# scripts/load_test.py
+#
+# Fires concurrent questions at a running Quasar backend and reports throughput and latency.
+#
+#   poetry run uvicorn app.main:app --workers 1
+#   poetry run python scripts/load_test.py --concurrency 32 --requests 128
+
+import argparse
+import asyncio
+import statistics
+import time
+from typing import List
+
+import httpx
+
+DEFAULT_QUESTIONS = [
+    "What is the main purpose of the ADRD model?",
+    "Summarize the document.",
+    "Which datasets were used in the evaluation?",
+    "Hi there",
+]
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of a list of latencies."""
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+async def run_load_test(url: str, questions: List[str], concurrency: int, total_requests: int, timeout: float):
+    latencies: List[float] = []
+    failures = 0
+    rejected = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with httpx.AsyncClient(timeout=timeout, limits=httpx.Limits(max_connections=concurrency)) as client:
+
+        async def one_request(i: int):
+            nonlocal failures, rejected
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    response = await client.post(url, json={"question": questions[i % len(questions)]})
+                    if response.status_code == 429:
+                        # Shed by admission control; not retried, so the count shows the overload
+                        rejected += 1
+                        return
+                    response.raise_for_status()
+                    latencies.append(time.perf_counter() - started)
+                except httpx.HTTPError as e:
+                    failures += 1
+                    print(f"Request {i} failed: {e}")
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one_request(i) for i in range(total_requests)))
+        elapsed = time.perf_counter() - started
+
+    print("--- Load Test Results ---")
+    print(f"Requests:     {total_requests} ({failures} failed, {rejected} rejected with 429) at concurrency {concurrency}")
+    print(f"Wall time:    {elapsed:.2f}s")
+    print(f"Throughput:   {len(latencies) / elapsed:.2f} req/s")
+    if latencies:
+        print(f"Latency mean: {statistics.mean(latencies):.2f}s")
+        print(f"Latency p50:  {percentile(latencies, 50):.2f}s")
+        print(f"Latency p95:  {percentile(latencies, 95):.2f}s")
+        print(f"Latency max:  {max(latencies):.2f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent load test for the Quasar chat endpoint.")
+    parser.add_argument("--url", default="http://localhost:8000/api/v1/chat")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=128)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--question", action="append", help="Question to send (repeatable). Defaults to a small built-in set.")
+    args = parser.parse_args()
+
+    asyncio.run(run_load_test(args.url, args.question or DEFAULT_QUESTIONS, args.concurrency, args.requests, args.timeout))
+
+
+if __name__ == "__main__":
+    main()
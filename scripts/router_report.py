@@ -0,0 +1,113 @@
+# scripts/router_report.py
+#
+# Compares the embedding router with the gpt-4o LLM router on labeled questions: accuracy,
+# latency and how often the embedding router falls back to the LLM. Without --eval, every
+# labeled example is classified leave-one-out by centroids built from the other examples.
+#
+#   poetry run python scripts/router_report.py
+#   poetry run python scripts/router_report.py --eval labeled_questions.jsonl --min-margin 0.03
+
+import argparse
+import asyncio
+import json
+import time
+from typing import Dict, List
+
+from app.agent.graph import build_embeddings, build_router_chain, openai_client_args, router_examples
+from app.agent.routing import EmbeddingRouter, load_router_examples
+from app.core.config import settings
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of a list of latencies."""
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(name: str, correct: List[bool], latencies: List[float]) -> Dict[str, float]:
+    return {
+        "router": name,
+        "accuracy": round(sum(correct) / len(correct), 4),
+        "mean_ms": round(sum(latencies) / len(latencies), 2),
+        "p50_ms": round(percentile(latencies, 50), 2),
+        "p95_ms": round(percentile(latencies, 95), 2),
+    }
+
+
+async def run_report(eval_path: str, min_margin: float) -> Dict[str, object]:
+    # Only the two routers' OpenAI components are built, the database is not needed.
+    client_args = openai_client_args()
+    embeddings, router_chain = build_embeddings(client_args), build_router_chain(client_args)
+    examples = router_examples()
+    example_vectors = await embeddings.aembed_documents([question for question, _ in examples])
+    routes = [route for _, route in examples]
+
+    if eval_path:
+        labeled = load_router_examples(eval_path)
+        router = EmbeddingRouter(routes, example_vectors, min_margin)
+        routers = [router] * len(labeled)
+    else:
+        labeled = examples
+        routers = [
+            EmbeddingRouter(routes[:i] + routes[i + 1:], example_vectors[:i] + example_vectors[i + 1:], min_margin)
+            for i in range(len(examples))
+        ]
+
+    # Latency is measured against the API, not the embedding cache.
+    api_embeddings = getattr(embeddings, "underlying", embeddings)
+    results = {"embedding": ([], []), "llm": ([], []), "embedding+fallback": ([], [])}
+    fallbacks = 0
+    for (question, label), router in zip(labeled, routers):
+        start = time.perf_counter()
+        decision = router.classify(await api_embeddings.aembed_query(question))
+        embedding_ms = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        llm_route = (await router_chain.ainvoke({"question": question})).route
+        llm_ms = (time.perf_counter() - start) * 1000
+
+        combined_route = decision.route if decision.confident else llm_route
+        fallbacks += not decision.confident
+        for name, route, latency in (
+            ("embedding", decision.route, embedding_ms),
+            ("llm", llm_route, llm_ms),
+            ("embedding+fallback", combined_route, embedding_ms + (0 if decision.confident else llm_ms)),
+        ):
+            results[name][0].append(route == label)
+            results[name][1].append(latency)
+        if decision.route != label or llm_route != label:
+            print(f"  {label:<15} embedding={decision.route} (margin {decision.margin:.3f}) llm={llm_route}  {question!r}")
+
+    return {
+        "questions": len(labeled),
+        "leave_one_out": not eval_path,
+        "min_margin": min_margin,
+        "fallback_rate": round(fallbacks / len(labeled), 4),
+        "routers": [summarize(name, correct, latencies) for name, (correct, latencies) in results.items()],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Accuracy/latency of the embedding router vs. the LLM router.")
+    parser.add_argument("--eval", help="JSON Lines file of labeled questions. Defaults to leave-one-out over the router examples.")
+    parser.add_argument("--min-margin", type=float, default=settings.ROUTER_MIN_MARGIN)
+    parser.add_argument("--output", help="Also write the report as JSON to this path.")
+    args = parser.parse_args()
+
+    print("--- Misrouted questions ---")
+    report = asyncio.run(run_report(args.eval, args.min_margin))
+
+    print(f"--- Router Report: {report['questions']} questions, min margin {report['min_margin']}, "
+          f"fallback rate {report['fallback_rate']:.1%} ---")
+    print(f"{'router':<22}{'accuracy':>10}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}")
+    for row in report["routers"]:
+        print(f"{row['router']:<22}{row['accuracy']:>10.4f}{row['mean_ms']:>10.2f}{row['p50_ms']:>10.2f}{row['p95_ms']:>10.2f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1 +1,319 @@
-# Pytest tests for your agent
\ No newline at end of file
+# tests/test_agent.py
+#
+# Context assembly, embedding routing, relevance grading and session memory: the deterministic parts of the agent. Also the
+# offline stand-ins for the OpenAI models (app/agent/stand_ins.py) that the benchmark and the API tests run on.
+
+import asyncio
+
+import numpy as np
+import pytest
+from langchain_core.documents import Document
+from langchain_core.messages import HumanMessage
+
+from app.agent.context import ContextBuilder
+from app.agent.grading import RelevanceGrader
+from app.agent.memory import ConversationMemory, FollowUpDetector
+from app.agent.routing import EmbeddingRouter, load_router_examples, parse_few_shot_examples
+from app.agent.stand_ins import DeterministicEmbeddings, StandInChatModel, content_words, stand_in_chain
+
+PARAGRAPH = (
+    "Quasar answers questions about enterprise documents by retrieving the most relevant passages "
+    "from a pgvector collection and citing every passage it used in the final answer."
+)
+
+
+def chunk(text: str, source: str = "guide.pdf", page=1, **metadata) -> Document:
+    return Document(page_content=text, metadata={"source": source, "page_number": page, **metadata})
+
+
+# --- Context assembly ---
+def test_merges_overlapping_chunks_by_offset():
+    builder = ContextBuilder()
+    first = chunk("alpha beta gamma delta", start_index=0, similarity=0.4)
+    second = chunk("gamma delta epsilon", start_index=11, similarity=0.9)
+    other_page = chunk("gamma delta epsilon", page=2, start_index=11, similarity=0.5)
+
+    passages = builder.merge_overlapping([second, other_page, first])
+
+    texts = {(doc.metadata["page_number"], doc.page_content): relevance for doc, relevance in passages}
+    assert texts == {(1, "alpha beta gamma delta epsilon"): 0.9, (2, "gamma delta epsilon"): 0.5}
+
+
+def test_joins_chunks_a_separator_apart():
+    builder = ContextBuilder()
+    title = chunk("Installation", start_index=0)
+    body = chunk("Run the installer.", start_index=len("Installation\n\n"))
+
+    passages = builder.merge_overlapping([body, title])
+
+    assert [doc.page_content for doc, _ in passages] == ["Installation\n\nRun the installer."]
+
+
+def test_keeps_distant_chunks_of_a_page_apart():
+    builder = ContextBuilder()
+    passages = builder.merge_overlapping([chunk("alpha beta", start_index=0), chunk("omega", start_index=500)])
+    assert [doc.page_content for doc, _ in passages] == ["alpha beta", "omega"]
+
+
+def test_merges_chunks_without_offsets_on_shared_text():
+    builder = ContextBuilder(min_overlap=20)
+    first = chunk("The retriever embeds every query variant in a single batched request")
+    second = chunk("every query variant in a single batched request, then fuses the rankings")
+    contained = chunk("in a single batched request")
+
+    passages = builder.merge_overlapping([first, second, contained])
+
+    assert [doc.page_content for doc, _ in passages] == [
+        "The retriever embeds every query variant in a single batched request, then fuses the rankings"
+    ]
+
+
+def test_drops_near_duplicates_keeping_the_most_relevant():
+    builder = ContextBuilder(duplicate_threshold=0.8)
+    best = chunk(PARAGRAPH, source="a.pdf")
+    copy = chunk(PARAGRAPH.replace("final answer.", "answer."), source="b.pdf")
+    distinct = chunk("Ingestion parses PDF, Word and HTML files into elements.", source="c.pdf")
+
+    kept = builder.drop_near_duplicates([(copy, 0.7), (best, 0.9), (distinct, 0.2)])
+
+    assert [(doc.metadata["source"], relevance) for doc, relevance in kept] == [("a.pdf", 0.9), ("c.pdf", 0.2)]
+
+
+def test_mmr_puts_a_redundant_passage_after_a_novel_one():
+    builder = ContextBuilder(mmr_lambda=0.5)
+    first = chunk(PARAGRAPH, source="a.pdf")
+    redundant = chunk(PARAGRAPH + " It also streams the answer.", source="b.pdf")
+    novel = chunk("Ingestion parses PDF, Word and HTML files into elements.", source="c.pdf")
+
+    ordered = builder.mmr_order([(first, 0.9), (redundant, 0.85), (novel, 0.6)])
+
+    assert [doc.metadata["source"] for doc in ordered] == ["a.pdf", "c.pdf", "b.pdf"]
+
+
+def test_packs_passages_under_the_token_budget():
+    builder = ContextBuilder(min_truncated_tokens=8)
+    documents = [chunk(PARAGRAPH, source=f"{name}.pdf", page=None) for name in ("a", "b", "c")]
+    header_tokens = len(builder.encoding.encode_ordinary("\n\n[SOURCE 2] (b.pdf)\n"))
+    content_tokens = len(builder.encoding.encode_ordinary(PARAGRAPH))
+    # The first passage fits, the second is truncated to 10 tokens and there is no room for the third
+    builder.token_budget = len(builder.encoding.encode_ordinary("[SOURCE 1] (a.pdf)\n")) + content_tokens + header_tokens + 10
+
+    text, packed, tokens = builder.pack(documents)
+
+    assert tokens <= builder.token_budget
+    assert [doc.metadata["source"] for doc in packed] == ["a.pdf", "b.pdf"]
+    assert packed[0].page_content == PARAGRAPH
+    assert len(builder.encoding.encode_ordinary(packed[1].page_content)) == 10
+    assert text.startswith("[SOURCE 1] (a.pdf)\n" + PARAGRAPH + "\n\n[SOURCE 2] (b.pdf)\n")
+    assert "[SOURCE 3]" not in text
+
+
+def test_build_numbers_sources_in_context_order():
+    builder = ContextBuilder()
+    documents = [
+        chunk("Answers cite their sources.", source="a.pdf", page=3, similarity=0.5),
+        chunk("Chunks never span two pages.", source="b.pdf", page=1, similarity=0.8),
+    ]
+
+    built = builder.build(documents)
+
+    assert built.input_chunks == 2
+    assert [doc.metadata["source"] for doc in built.documents] == ["b.pdf", "a.pdf"]
+    assert built.text.startswith("[SOURCE 1] (b.pdf, page 1)\nChunks never span two pages.")
+    assert "[SOURCE 2] (a.pdf, page 3)\nAnswers cite their sources." in built.text
+
+
+# --- Routing ---
+def test_router_picks_the_nearest_centroid():
+    router = EmbeddingRouter(["vectorstore", "vectorstore", "conversational"], [[1, 0], [1, 0.1], [0, 1]], min_margin=0.05)
+
+    decision = router.classify([1, 0])
+
+    assert decision.route == "vectorstore"
+    assert decision.confident
+    assert decision.similarity == pytest.approx(0.9988, abs=1e-3)
+
+
+def test_router_is_not_confident_between_two_routes():
+    router = EmbeddingRouter(["vectorstore", "vectorstore", "conversational"], [[1, 0], [1, 0.1], [0, 1]], min_margin=0.05)
+
+    decision = router.classify([1, 1])
+
+    assert decision.route == "vectorstore"
+    assert 0 < decision.margin < 0.05
+    assert not decision.confident
+
+
+def test_router_needs_two_routes():
+    with pytest.raises(ValueError):
+        EmbeddingRouter(["vectorstore", "vectorstore"], [[1, 0], [0, 1]])
+
+
+def test_parses_the_router_prompt_examples():
+    prompt = "- User question: 'Hi there', route: 'conversational'\n- User question: 'What is X?', route: 'vectorstore'"
+    assert parse_few_shot_examples(prompt) == [("Hi there", "conversational"), ("What is X?", "vectorstore")]
+
+
+def test_loads_labeled_examples_for_both_routes(tmp_path):
+    path = tmp_path / "examples.jsonl"
+    path.write_text('{"question": "Hello!", "route": "conversational"}\n\n{"question": "What is X?", "route": "vectorstore"}\n')
+
+    assert load_router_examples(str(path)) == [("Hello!", "conversational"), ("What is X?", "vectorstore")]
+
+
+# --- Relevance grading ---
+def scored(name: str, similarity: float, **metadata) -> Document:
+    return Document(page_content=name, metadata={"similarity": similarity, **metadata})
+
+
+def test_grading_keeps_accepted_chunks_best_first():
+    grader = RelevanceGrader(min_similarity=0.25, accept_similarity=0.45, min_lexical_score=0.1, top_k=4)
+    documents = [
+        scored("borderline", 0.3), scored("good", 0.5), scored("best", 0.9),
+        scored("weak", 0.1), scored("keyword match", 0.1, lexical_score=0.4),
+    ]
+
+    result = asyncio.run(grader.grade("question", documents))
+
+    assert [doc.page_content for doc in result.documents] == ["best", "good"]
+    assert result.relevance == "relevant"
+    assert result.borderline == 2
+    assert result.dropped == 3
+    assert not result.used_llm
+
+
+def test_grading_sends_only_borderline_chunks_to_the_llm():
+    graded = []
+
+    async def llm_grader(question, doc):
+        graded.append(doc.page_content)
+        return doc.page_content == "yes"
+
+    grader = RelevanceGrader(min_similarity=0.25, accept_similarity=0.45, llm_grader=llm_grader)
+    documents = [scored("yes", 0.3), scored("no", 0.35), scored("weak", 0.1)]
+
+    result = asyncio.run(grader.grade("question", documents))
+
+    assert sorted(graded) == ["no", "yes"]
+    assert [doc.page_content for doc in result.documents] == ["yes"]
+    assert result.used_llm
+
+
+def test_grading_keeps_borderline_chunks_without_an_llm_grader():
+    grader = RelevanceGrader(min_similarity=0.25, accept_similarity=0.45, top_k=1)
+    result = asyncio.run(grader.grade("question", [scored("lower", 0.3), scored("higher", 0.4)]))
+    assert [doc.page_content for doc in result.documents] == ["higher"]
+
+
+def test_grading_finds_nothing_relevant_below_the_thresholds():
+    grader = RelevanceGrader(min_similarity=0.25, accept_similarity=0.45)
+    result = asyncio.run(grader.grade("question", [scored("weak", 0.1), scored("weaker", 0.05)]))
+    assert result.documents == []
+    assert result.relevance == "irrelevant"
+    assert result.dropped == 2
+
+
+def test_grading_uses_the_reranker_scores():
+    class Reranker:
+        async def ascore(self, question, texts):
+            return [{"relevant": 0.9, "unsure": 0.3, "off-topic": 0.01}[text] for text in texts]
+
+    grader = RelevanceGrader(reranker=Reranker(), reranker_accept=0.5, reranker_reject=0.05)
+    documents = [scored("off-topic", 0.9), scored("unsure", 0.9), scored("relevant", 0.3)]
+
+    result = asyncio.run(grader.grade("question", documents))
+
+    assert [doc.page_content for doc in result.documents] == ["relevant"]
+    assert result.borderline == 1
+
+
+# --- Conversation memory ---
+def test_memory_keeps_the_latest_turns_within_the_limits():
+    memory = ConversationMemory(max_turns=3)
+    history = None
+    for i in range(4):
+        history = memory.remember(history, f"question {i}", f"answer {i}")
+    assert [turn["question"] for turn in history] == ["question 1", "question 2", "question 3"]
+
+    long_turn = {"question": "question 4", "answer": "a much longer answer " * 5}
+    memory.token_budget = memory._tokens(history[-1]) + memory._tokens(long_turn)
+    history = memory.remember(history, long_turn["question"], long_turn["answer"])
+    assert [turn["question"] for turn in history] == ["question 3", "question 4"]
+
+
+def test_memory_truncates_an_oversized_last_answer():
+    memory = ConversationMemory(token_budget=20)
+    answer = "because " * 50
+
+    (turn,) = memory.remember([{"question": "old", "answer": "turn"}], "why?", answer)
+
+    assert turn["question"] == "why?"
+    assert turn["answer"] and answer.startswith(turn["answer"])
+    assert memory._tokens(turn) <= 20
+
+
+def test_memory_formats_the_history_for_the_prompts():
+    history = [{"question": "What is Quasar?", "answer": "A RAG platform."}]
+
+    assert ConversationMemory.format(None) == ""
+    assert ConversationMemory.format(history) == "Conversation so far:\nUser: What is Quasar?\nAssistant: A RAG platform.\n\n"
+    messages = ConversationMemory.messages(history, "Who runs it?")
+    assert [(message.type, message.content) for message in messages] == [
+        ("human", "What is Quasar?"), ("ai", "A RAG platform."), ("human", "Who runs it?"),
+    ]
+
+
+def test_follow_ups_are_decided_on_compact_embeddings():
+    detector = FollowUpDetector(reuse_similarity=0.75, min_similarity=0.3, dimensions=2)
+    context_embedding = detector.compact([3.0, 4.0, 100.0])
+
+    assert context_embedding == pytest.approx([0.6, 0.8])
+    assert detector.decide([0.6, 0.8, -5.0], context_embedding).reuse is True
+    assert detector.decide([-0.8, 0.6, 0.0], context_embedding).reuse is False
+    borderline = detector.decide([1.0, 0.0, 0.0], context_embedding)
+    assert (borderline.reuse, borderline.similarity) == (None, pytest.approx(0.6))
+    assert detector.decide([1.0, 0.0], None).reuse is None
+
+
+# --- Stand-ins ---
+def test_stand_in_embeddings_are_deterministic_unit_vectors():
+    embeddings = DeterministicEmbeddings(dimensions=256)
+
+    refund, refund_again, shipping = embeddings.embed_documents(
+        ["What is the refund policy?", "the refund policy", "Shipping to Canada"]
+    )
+
+    assert refund == embeddings.embed_query("What is the refund policy?")
+    assert sum(x * x for x in refund) == pytest.approx(1.0)
+    assert np.dot(refund, refund_again) > np.dot(refund, shipping)
+    assert content_words("What is the refund policy?") == ["refund", "policy"]
+
+
+def test_stand_in_chat_model_cites_the_first_source():
+    model = StandInChatModel(first_token_latency=0, token_latency=0)
+    prompt = "Cite sources as [SOURCE 1] in the answer.\n\n[SOURCE 1] (a.pdf, page 2)\nRefunds take 30 days.\n\nQuestion: refunds?"
+
+    answer = model.invoke([HumanMessage(content=prompt)])
+
+    assert answer.content == "According to the documents, Refunds take 30 days. [1]"
+    assert answer.usage_metadata["output_tokens"] == len(answer.content.split())
+    assert model.invoke("Hi there").content.startswith("Hello!")
+
+
+def test_stand_in_chat_model_streams_the_same_answer():
+    model = StandInChatModel(first_token_latency=0, token_latency=0)
+    prompt = [HumanMessage(content="[SOURCE 1] (a.pdf)\nRefunds take 30 days.")]
+
+    async def stream():
+        return [chunk async for chunk in model.astream(prompt)]
+
+    chunks = asyncio.run(stream())
+
+    assert "".join(chunk.content for chunk in chunks) == model.invoke(prompt).content
+    assert [chunk.usage_metadata is not None for chunk in chunks][-2:] == [False, True]
+
+
+def test_stand_in_chain_returns_the_response():
+    chain = stand_in_chain(lambda inputs: inputs["question"].upper(), latency=0)
+    assert chain.invoke({"question": "why"}) == "WHY"
+    assert asyncio.run(chain.ainvoke({"question": "how"})) == "HOW"
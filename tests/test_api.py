@@ -1 +1,542 @@
-# Pytest tests for your API
\ No newline at end of file
+# tests/test_api.py
+#
+# Request tracing, metrics, startup, admission control and the chat endpoints. The agent is built from the stand-in chains, chat
+# model and embeddings (app/agent/stand_ins.py) over an in-memory search, so no test calls OpenAI or Postgres.
+
+import asyncio
+import io
+import json
+import logging
+import time
+from types import SimpleNamespace
+from typing import Dict, List
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+from langchain_core.documents import Document
+from langchain_core.messages import AIMessage
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.outputs import ChatGeneration, LLMResult
+from prometheus_client import REGISTRY
+
+from app.agent import graph
+from app.agent.stand_ins import DeterministicEmbeddings, StandInChatModel, content_words, stand_in_chain
+from app.api.v1 import chat
+from app.core.admission import Budget, Limiter, Overloaded, RequestGate, StreamedOutputCallback, TokenBucket
+from app.core.metrics import LLMMetricsCallback, TracedEmbeddings, record_cache, trace_node
+from app.core.tracing import JsonFormatter, get_logger, log_event, trace_id_var
+from app.main import app
+from app.services.sessions import MemorySessionStore
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def sample(name: str, **labels) -> float:
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+# --- Tracing and metrics ---
+def test_log_events_are_json_lines_with_the_trace_id():
+    output = io.StringIO()
+    handler = logging.StreamHandler(output)
+    handler.setFormatter(JsonFormatter())
+    logger = get_logger("test")
+    logger.addHandler(handler)
+    token = trace_id_var.set("trace-1")
+    try:
+        log_event(logger, "cache_hit", level=logging.WARNING, tier="exact", chunks=3)
+    finally:
+        trace_id_var.reset(token)
+        logger.removeHandler(handler)
+
+    entry = json.loads(output.getvalue())
+
+    assert {key: entry[key] for key in ("level", "logger", "event", "trace_id", "tier", "chunks")} == {
+        "level": "WARNING", "logger": "quasar.test", "event": "cache_hit", "trace_id": "trace-1", "tier": "exact", "chunks": 3,
+    }
+
+
+def test_trace_node_times_nodes_and_counts_failures():
+    async def ok(state):
+        return {"seen": state["question"]}
+
+    async def failing(state):
+        raise RuntimeError("boom")
+
+    before = sample("quasar_node_duration_seconds_count", node="test_ok"), sample("quasar_node_errors_total", node="test_failing")
+
+    assert run(trace_node("test_ok", ok)({"question": "q"})) == {"seen": "q"}
+    with pytest.raises(RuntimeError):
+        run(trace_node("test_failing", failing)({}))
+
+    assert sample("quasar_node_duration_seconds_count", node="test_ok") == before[0] + 1
+    assert sample("quasar_node_errors_total", node="test_failing") == before[1] + 1
+    assert trace_node("test_ok", ok).__name__ == "ok"
+
+
+def test_cache_lookups_are_counted():
+    before = sample("quasar_cache_requests_total", cache="test", result="hit")
+
+    record_cache("test", hits=2, misses=1)
+
+    assert sample("quasar_cache_requests_total", cache="test", result="hit") == before + 2
+    assert sample("quasar_cache_requests_total", cache="test", result="miss") >= 1
+
+
+def test_embedding_calls_are_timed_and_counted():
+    underlying = DeterministicEmbeddings(dimensions=8)
+    underlying.model = "test-embedding"
+    embeddings = TracedEmbeddings(underlying)
+    before = sample("quasar_embedding_texts_total", model="test-embedding")
+
+    vectors = run(embeddings.aembed_documents(["a", "b"]))
+
+    assert vectors == underlying.embed_documents(["a", "b"])
+    assert embeddings.dimensions == 8
+    assert sample("quasar_embedding_texts_total", model="test-embedding") == before + 2
+
+
+def test_llm_usage_comes_from_the_streamed_message():
+    message = AIMessage(
+        content="answer", response_metadata={"model_name": "test-model"},
+        usage_metadata={"input_tokens": 12, "output_tokens": 5, "total_tokens": 17},
+    )
+    response = LLMResult(generations=[[ChatGeneration(message=message)]])
+
+    assert LLMMetricsCallback._usage(response) == ("test-model", 12, 5)
+    assert LLMMetricsCallback._usage(LLMResult(generations=[], llm_output={"token_usage": {"prompt_tokens": 3}})) == ("unknown", 3, 0)
+
+
+# --- Admission control ---
+def test_token_bucket_waits_for_the_refill():
+    async def scenario():
+        bucket = TokenBucket(tokens_per_minute=600 * 60)  # 600 tokens per second
+        started = time.perf_counter()
+        await bucket.take(600 * 60)
+        burst = time.perf_counter() - started
+        await bucket.take(60)
+        return burst, time.perf_counter() - started - burst
+
+    burst, wait = run(scenario())
+
+    assert burst < 0.05
+    assert 0.05 <= wait < 1
+
+
+def test_token_bucket_refunds_a_cancelled_wait():
+    async def scenario():
+        bucket = TokenBucket(tokens_per_minute=60)
+        await bucket.take(60)
+        waiting = asyncio.create_task(bucket.take(30))
+        await asyncio.sleep(0.01)
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+        return bucket.level
+
+    assert run(scenario()) == pytest.approx(0, abs=0.1)
+
+
+def test_limiter_queues_then_rejects():
+    async def scenario():
+        limiter = Limiter("test", max_concurrency=1, max_waiting=1)
+        await limiter.acquire()
+        queued = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        assert (limiter.active, limiter.waiting) == (1, 1)
+
+        with pytest.raises(Overloaded) as rejected:
+            await limiter.acquire()
+        assert rejected.value.reason == "full"
+
+        limiter.release()
+        await queued
+        assert (limiter.active, limiter.waiting) == (1, 0)
+
+        with pytest.raises(Overloaded) as timed_out:
+            await limiter.acquire(timeout=0.01)
+        assert timed_out.value.reason == "timed out"
+        limiter.release()
+        return limiter.active, limiter.waiting
+
+    assert run(scenario()) == (0, 0)
+
+
+def test_budget_does_not_retry_a_call_that_streamed_tokens():
+    class RateLimited(Exception):
+        status_code = 429
+
+    model = StandInChatModel(first_token_latency=0, token_latency=0, callbacks=[StreamedOutputCallback()])
+    budget = Budget("chat", max_concurrency=1, max_retries=2, backoff_base=0)
+
+    def failing_call(stream: bool, attempts: List[int]):
+        async def call():
+            attempts.append(1)
+            if stream:
+                async for _ in model.astream("Hi there"):
+                    pass
+            raise RateLimited()
+        return call
+
+    for stream, expected_attempts in ((False, 3), (True, 1)):
+        attempts = []
+        with pytest.raises(RateLimited):
+            run(budget.run(failing_call(stream, attempts)))
+        assert len(attempts) == expected_attempts
+
+
+def test_request_gate_rejects_with_retry_after():
+    async def scenario():
+        gate = RequestGate(max_concurrency=2, max_queued=0)
+        gate.mean_seconds = 3.0
+        await gate.acquire()
+        await gate.acquire()
+        with pytest.raises(Overloaded) as rejected:
+            await gate.acquire()
+        return rejected.value
+
+    rejected = run(scenario())
+
+    assert rejected.stage == "requests"
+    assert rejected.reason == "full"
+    assert rejected.retry_after == 2  # the queue drains in half a mean request
+
+
+# --- Chat endpoints ---
+CHUNKS = [
+    Document(
+        page_content="The refund policy for damaged items allows returns within 30 days of delivery.",
+        metadata={"source": "documents/policies.pdf", "page_number": 2},
+    ),
+    Document(
+        page_content="Shipping to Canada takes five to seven business days with tracked parcels.",
+        metadata={"source": "documents/shipping.pdf", "page_number": 1},
+    ),
+    Document(
+        page_content="Support agents answer chat messages on weekdays between nine and five.",
+        metadata={"source": "documents/support.docx"},
+    ),
+]
+GREETINGS = {"hi", "hello", "hey", "there", "thanks", "thank", "you"}
+
+
+class InMemorySearch:
+    """Cosine search over a few chunks, standing in for PgVectorSearch; the similarity is written to the metadata."""
+
+    def __init__(self, documents: List[Document], embeddings: DeterministicEmbeddings):
+        self.documents = documents
+        self.vectors = np.asarray(embeddings.embed_documents([doc.page_content for doc in documents]))
+
+    async def asearch(self, embedding, k=4, filter: Dict[str, List[str]] = None, **kwargs):
+        similarities = self.vectors @ np.asarray(embedding)
+        results = []
+        for i in np.argsort(-similarities):
+            doc = self.documents[i]
+            if all(doc.metadata.get(key) in values for key, values in (filter or {}).items()):
+                metadata = {**doc.metadata, "similarity": float(similarities[i])}
+                results.append((Document(page_content=doc.page_content, metadata=metadata), float(similarities[i])))
+        return results[:k]
+
+    async def ahybrid_search(self, query_text, embedding, k=4, **kwargs):
+        kwargs = {key: value for key, value in kwargs.items() if key == "filter"}
+        return await self.asearch(embedding, k, **kwargs)
+
+
+def stand_in_components(**overrides) -> graph.AgentComponents:
+    def route(inputs: dict):
+        words = set(content_words(inputs["question"]))
+        return graph.RouteQuery(route="conversational" if words and words <= GREETINGS else "vectorstore")
+
+    def rewrite(inputs: dict):
+        terms = " ".join(content_words(inputs["question"]))
+        return graph.GeneratedQueries(queries=[terms, f"details on {terms}", f"{terms} overview"])
+
+    def grade(inputs: dict):
+        overlap = set(content_words(inputs["question"])) & set(content_words(str(inputs["context"])))
+        return graph.GradeDocuments(decision="relevant" if overlap else "irrelevant")
+
+    embeddings = DeterministicEmbeddings(dimensions=512)
+    chat_model = StandInChatModel(first_token_latency=0, token_latency=0)
+    components = dict(
+        router_chain=stand_in_chain(route, 0),
+        query_transformer_chain=stand_in_chain(rewrite, 0),
+        evaluator_chain=stand_in_chain(grade, 0),
+        rag_chain=graph.rag_prompt | chat_model | StrOutputParser(),
+        conversational_llm=chat_model,
+        embeddings=embeddings,
+        vector_search=InMemorySearch(CHUNKS, embeddings),
+        sessions=MemorySessionStore(),
+    )
+    return graph.build_components(**{**components, **overrides})
+
+
+def stand_in_agent() -> graph.RagAgent:
+    return graph.RagAgent(stand_in_components())
+
+
+@pytest.fixture
+def empty_cache(monkeypatch):
+    async def no_version_check():
+        pass
+
+    # The collection version lives in Postgres; the cache starts empty in every test instead
+    monkeypatch.setattr(chat, "refresh_cache_version", no_version_check)
+    chat.answer_cache.invalidate()
+    yield
+    chat.answer_cache.invalidate()
+
+
+@pytest.fixture
+def agent(empty_cache):
+    agent = stand_in_agent()
+    graph.set_agent(agent)
+    yield agent
+    graph.set_agent(None)
+
+
+@pytest.fixture
+def client(agent):
+    with TestClient(app) as client:
+        yield client
+
+
+def sse_events(body: str) -> List[tuple]:
+    events = []
+    for frame in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in frame.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+def test_chat_answers_with_sources(client):
+    response = client.post("/api/v1/chat", json={"question": "What is the refund policy for damaged items?"})
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["answer"].startswith("According to the documents, The refund policy for damaged items")
+    assert body["sources"][0] == {"source": "documents/policies.pdf", "page": 2}
+    assert response.headers["X-Request-ID"]
+
+
+def test_chat_answers_greetings_without_sources(client):
+    body = client.post("/api/v1/chat", json={"question": "Hi there"}).json()
+    assert body["answer"] == "Hello! How can I help you with the knowledge base today?"
+    assert body["sources"] == []
+
+
+def test_chat_serves_repeated_questions_from_the_cache(client):
+    first = client.post("/api/v1/chat", json={"question": "How long does shipping to Canada take?"}).json()
+    second = client.post("/api/v1/chat", json={"question": "how long does shipping to canada take"}).json()
+
+    assert second == first
+    assert client.get("/api/v1/cache/stats").json()["exact_hits"] == 1
+
+
+def test_chat_applies_metadata_filters(client):
+    question = {"question": "What is the refund policy for damaged items?", "filters": {"source": ["documents/shipping.pdf"]}}
+    body = client.post("/api/v1/chat", json=question).json()
+    assert {source["source"] for source in body["sources"]} <= {"documents/shipping.pdf"}
+
+
+def test_chat_stream_sends_nodes_tokens_and_sources(client):
+    response = client.post("/api/v1/chat/stream", json={"question": "What is the refund policy for damaged items?"})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = sse_events(response.text)
+    nodes = [data["node"] for event, data in events if event == "node"]
+    assert nodes[:2] == ["router", "retrieve"]
+    assert "generate" in nodes
+    tokens = "".join(data["content"] for event, data in events if event == "token")
+    final_event, final = events[-1]
+    assert final_event == "sources"
+    assert final["answer"] == tokens
+    assert final["sources"][0] == {"source": "documents/policies.pdf", "page": 2}
+
+
+def test_chat_stream_reports_a_failed_cache_lookup(client, agent, monkeypatch):
+    async def embedding_api_down(text):
+        raise ConnectionError("embedding API down")
+
+    monkeypatch.setattr(agent.embeddings, "aembed_query", embedding_api_down)
+
+    response = client.post("/api/v1/chat/stream", json={"question": "What is the refund policy for damaged items?"})
+
+    assert response.status_code == 200
+    assert sse_events(response.text) == [("error", {"message": "The agent failed to answer this question."})]
+
+
+def test_request_ids_are_echoed_or_generated(client):
+    assert client.get("/", headers={"X-Request-ID": "caller-id"}).headers["X-Request-ID"] == "caller-id"
+    assert len(client.get("/").headers["X-Request-ID"]) == 32
+
+
+def test_metrics_endpoint_exports_requests_and_nodes(client):
+    client.post("/api/v1/chat", json={"question": "What is the refund policy for damaged items?"})
+
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert 'quasar_request_duration_seconds_count{method="POST",path="/api/v1/chat",status="200"}' in response.text
+    assert 'quasar_node_duration_seconds_count{node="generate"}' in response.text
+    assert 'quasar_startup_duration_seconds{phase="import"}' in response.text
+
+
+def test_chat_batch_answers_every_question_once(client):
+    questions = ["What is the refund policy for damaged items?", "what is the refund policy for damaged items", "Hi there"]
+
+    response = client.post("/api/v1/chat/batch", json={"questions": questions, "max_concurrency": 2})
+
+    assert response.status_code == 200
+    results = sorted((json.loads(line) for line in response.text.splitlines()), key=lambda result: result["index"])
+    assert [result["index"] for result in results] == [0, 1, 2]
+    assert all(result["error"] is None for result in results)
+    assert results[0]["answer"] == results[1]["answer"]
+    assert results[0]["sources"][0]["source"] == "documents/policies.pdf"
+    assert results[2]["answer"].startswith("Hello!")
+
+
+def test_chat_batch_reports_failed_questions_and_cached_answers(client, agent):
+    client.post("/api/v1/chat", json={"question": "How long does shipping to Canada take?"})
+    generate = agent.components.rag_chain
+
+    def failing_refunds(inputs: dict):
+        if "refund" in inputs["question"]:
+            raise RuntimeError("generation failed")
+        return generate.invoke(inputs)
+
+    agent.components.rag_chain = stand_in_chain(failing_refunds, 0)
+    questions = ["What is the refund policy for damaged items?", "How long does shipping to Canada take?", "When do support agents answer chat?"]
+
+    response = client.post("/api/v1/chat/batch", json={"questions": questions})
+
+    results = {result["index"]: result for result in map(json.loads, response.text.splitlines())}
+    assert results[0]["error"] and results[0]["answer"] is None
+    assert results[1]["cached"] and results[1]["error"] is None
+    assert results[2]["answer"].startswith("According to the documents, Support agents")
+
+
+def test_sessions_keep_the_history_until_deleted(client):
+    for question in ("What is the refund policy for damaged items?", "Hi there"):
+        body = client.post("/api/v1/chat", json={"question": question, "session_id": "s1"}).json()
+        assert body["session_id"] == "s1"
+
+    turns = client.get("/api/v1/sessions/s1").json()["turns"]
+    assert [turn["question"] for turn in turns] == ["What is the refund policy for damaged items?", "Hi there"]
+    assert turns[1]["answer"].startswith("Hello!")
+    assert client.get("/api/v1/sessions/s2").json()["turns"] == []
+
+    assert client.delete("/api/v1/sessions/s1").json() == {"session_id": "s1", "deleted": True}
+    assert client.get("/api/v1/sessions/s1").json()["turns"] == []
+
+
+def test_a_follow_up_reuses_the_session_context(client):
+    def nodes(question: str) -> List[str]:
+        response = client.post("/api/v1/chat/stream", json={"question": question, "session_id": "s1"})
+        return [data["node"] for event, data in sse_events(response.text) if event == "node"]
+
+    hits = client.get("/api/v1/cache/stats").json()["exact_hits"]
+    first = nodes("What is the refund policy for damaged items?")
+    follow_up = nodes("What is the refund policy for damaged items?")
+
+    assert "retrieve" in first
+    assert "retrieve" not in follow_up and "generate" in follow_up
+    # Session answers are not cached
+    assert client.get("/api/v1/cache/stats").json()["exact_hits"] == hits
+
+
+def test_a_follow_up_is_recognised_with_the_llm_router(client, monkeypatch):
+    # The router does not embed the first question; retrieval's embedding becomes the session context,
+    # so the follow-up is recognised by similarity alone
+    monkeypatch.setattr(graph.settings, "ROUTER_MODE", "llm")
+    monkeypatch.setattr(graph.settings, "FOLLOWUP_LLM_CHECK", False)
+
+    def nodes(question: str) -> List[str]:
+        response = client.post("/api/v1/chat/stream", json={"question": question, "session_id": "s1"})
+        return [data["node"] for event, data in sse_events(response.text) if event == "node"]
+
+    assert "retrieve" in nodes("What is the refund policy for damaged items?")
+    assert "retrieve" not in nodes("What is the refund policy for damaged items?")
+
+
+def test_sessions_can_be_disabled(empty_cache):
+    graph.set_agent(graph.RagAgent(stand_in_components(sessions=None)))
+    try:
+        with TestClient(app) as client:
+            response = client.post("/api/v1/chat", json={"question": "Hi there", "session_id": "s1"})
+            assert response.status_code == 400
+            assert client.post("/api/v1/chat", json={"question": "Hi there"}).status_code == 200
+    finally:
+        graph.set_agent(None)
+
+
+@pytest.mark.parametrize("path, payload", [
+    ("/api/v1/chat", {"question": "What is the refund policy?"}),
+    ("/api/v1/chat/stream", {"question": "What is the refund policy?"}),
+    ("/api/v1/chat/batch", {"questions": ["What is the refund policy?"]}),
+])
+def test_overloaded_requests_get_429_with_retry_after(client, agent, path, payload):
+    agent.admission.requests = RequestGate(max_concurrency=1, max_queued=0)
+    run(agent.admission.requests.acquire())  # the only slot is taken
+
+    response = client.post(path, json=payload)
+
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+    assert "busy" in response.json()["detail"]
+
+
+# --- Startup ---
+def test_lifespan_warms_up_an_injected_agent(agent, monkeypatch):
+    disposed = []
+    with TestClient(app):
+        assert graph.get_agent() is agent
+        # The embedding router was built before the first request
+        assert agent.embedding_router is not None
+        monkeypatch.setattr(chat, "cache_version_engine", SimpleNamespace(dispose=lambda: disposed.append(True)))
+    # An injected agent is left in place; the version check pool is closed
+    assert graph.has_agent()
+    assert disposed and chat.cache_version_engine is None
+
+
+def test_version_checks_open_their_pool_on_first_use(monkeypatch):
+    monkeypatch.setattr(chat, "fetch_collection_version", lambda engine, collection_name: str(engine.url.database))
+    monkeypatch.setattr(chat, "last_version_check", float("-inf"))
+    monkeypatch.setattr(chat.answer_cache, "version", None)
+    chat.close_cache_version_engine()
+
+    run(chat.refresh_cache_version())
+
+    assert chat.answer_cache.version == "quasar"
+    assert chat.cache_version_engine is not None
+    chat.close_cache_version_engine()
+    assert chat.cache_version_engine is None
+
+
+def test_lifespan_builds_and_closes_its_own_agent(monkeypatch, empty_cache):
+    components = stand_in_components()
+    monkeypatch.setattr(graph, "build_components", lambda: components)
+    graph.set_agent(None)
+
+    with TestClient(app) as client:
+        assert graph.has_agent()
+        assert client.post("/api/v1/chat", json={"question": "Hi there"}).status_code == 200
+    assert not graph.has_agent()
+
+
+def test_warm_up_skips_a_failing_step():
+    class FailingEmbeddings(DeterministicEmbeddings):
+        async def aembed_documents(self, texts):
+            raise ConnectionError("embedding API down")
+
+    agent = graph.RagAgent(stand_in_components(embeddings=FailingEmbeddings(dimensions=512)))
+
+    timings = run(agent.warm_up())
+
+    # The in-memory search has no pool to fill; the in-memory session store has nothing to open
+    assert set(timings) == {"embedding_router", "sessions"}
+    assert agent.embedding_router is None
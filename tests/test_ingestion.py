@@ -0,0 +1,330 @@
+# tests/test_ingestion.py
+#
+# Structured chunking of Unstructured elements (data_ingestion/chunking.py), the ingestion pipeline
+# (data_ingestion/pipeline.py) and incremental sync (data_ingestion/sync.py), run on fake elements, fake files
+# and an in-memory store: no Unstructured parsing, OpenAI or Postgres.
+
+import os
+import pickle
+import re
+import zipfile
+from typing import Dict, List
+
+import pytest
+import tiktoken
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from app.agent.context import ContextBuilder
+from data_ingestion import chunking
+from data_ingestion.chunking import ELEMENT_SEPARATOR, RecursiveChunker, StructuredChunker, chunker_from_settings
+from data_ingestion.pipeline import run_pipeline
+from data_ingestion.loaders import extract_zip
+from data_ingestion.sync import ArchiveManifest, FileState, file_hash, sync_documents
+
+# --- Chunking ---
+SENTENCE = "Every chunk records the page it comes from and its offset in that page."
+
+
+def element(text: str, category: str = "NarrativeText", page=1) -> Document:
+    return Document(page_content=text, metadata={"category": category, "page_number": page, "source": "manual.pdf", "filename": "manual.pdf"})
+
+
+def page_texts(elements):
+    """Each page's text as the chunker indexes it: its kept elements joined by blank lines."""
+    pages = {}
+    for item in elements:
+        if item.metadata["category"] not in ("Header", "Footer"):
+            pages.setdefault(item.metadata["page_number"], []).append(item.page_content.strip())
+    return {page: ELEMENT_SEPARATOR.join(texts) for page, texts in pages.items()}
+
+
+def document_elements():
+    return [
+        element("ACME Corp - Internal", "Header", page=1),
+        element("Installation", "Title", page=1),
+        element(SENTENCE, page=1),
+        element("Run the installer as an administrator.", "ListItem", page=1),
+        element("Configuration", "Title", page=1),
+        element(" ".join([SENTENCE] * 40), page=1),
+        element("Page 1", "Footer", page=1),
+        element("ACME Corp - Internal", "Header", page=2),
+        element("Settings live in the .env file.", page=2),
+        element("Troubleshooting", "Title", page=2),
+        element("Restart the service after changing a setting.", page=2),
+    ]
+
+
+def test_chunk_offsets_point_into_the_page_text():
+    elements = document_elements()
+    chunker = StructuredChunker(max_tokens=200, min_tokens=5, overlap_tokens=20)
+
+    chunks = list(chunker.chunk(elements))
+
+    pages = page_texts(elements)
+    for doc in chunks:
+        start = doc.metadata["start_index"]
+        assert pages[doc.metadata["page_number"]][start:start + len(doc.page_content)] == doc.page_content
+        assert doc.metadata["token_count"] <= 200
+        assert doc.metadata["source"] == "manual.pdf"
+    assert [doc.metadata["chunk_index"] for doc in chunks] == list(range(len(chunks)))
+
+
+def test_chunks_never_span_pages_and_skip_headers_and_footers():
+    chunks = list(StructuredChunker(max_tokens=200, min_tokens=5, overlap_tokens=20).chunk(document_elements()))
+
+    assert {doc.metadata["page_number"] for doc in chunks} == {1, 2}
+    page_2 = [doc for doc in chunks if doc.metadata["page_number"] == 2]
+    assert [doc.page_content for doc in page_2] == [
+        "Settings live in the .env file.",
+        ELEMENT_SEPARATOR.join(["Troubleshooting", "Restart the service after changing a setting."]),
+    ]
+    assert [doc.metadata["start_index"] for doc in page_2] == [0, len("Settings live in the .env file.") + len(ELEMENT_SEPARATOR)]
+    assert all("ACME Corp" not in doc.page_content and "Page 1" not in doc.page_content for doc in chunks)
+
+
+def test_titles_start_chunks_and_name_their_section():
+    chunks = list(StructuredChunker(max_tokens=200, min_tokens=5, overlap_tokens=20).chunk(document_elements()))
+
+    assert chunks[0].page_content == ELEMENT_SEPARATOR.join(["Installation", SENTENCE, "Run the installer as an administrator."])
+    assert chunks[0].metadata["section"] == "Installation"
+    assert chunks[1].page_content.startswith("Configuration" + ELEMENT_SEPARATOR)
+    # A section carries on across the page break
+    assert [doc.metadata["section"] for doc in chunks[-2:]] == ["Configuration", "Troubleshooting"]
+
+
+def test_oversized_elements_are_split_on_sentences():
+    chunker = StructuredChunker(max_tokens=200, min_tokens=20, overlap_tokens=40)
+    long_text = " ".join([SENTENCE] * 40)
+
+    chunks = list(chunker.chunk([element("Reference", "Title"), element(long_text)]))
+
+    assert len(chunks) > 1
+    assert all(doc.metadata["token_count"] <= 200 for doc in chunks)
+    # The first piece fills up the chunk holding the title; the pieces end on sentences
+    assert chunks[0].page_content.startswith("Reference" + ELEMENT_SEPARATOR + SENTENCE)
+    assert all(doc.page_content.endswith(".") for doc in chunks)
+    assert chunks[-1].metadata["start_index"] + len(chunks[-1].page_content) == len("Reference" + ELEMENT_SEPARATOR + long_text)
+
+
+def test_split_pieces_overlap_with_leading_space_tokens(monkeypatch):
+    long_text = " ".join([SENTENCE] * 40)
+    # Like cl100k_base, every word is one token that carries the space before it
+    words = {piece.encode() for piece in re.findall(r" ?\S+", long_text)}
+    ranks = {bytes([i]): i for i in range(256)}
+    for word in sorted(words):
+        for end in range(2, len(word) + 1):
+            ranks.setdefault(word[:end], len(ranks))
+    encoding = tiktoken.Encoding(name="words", pat_str=r" ?\S+|\s+", mergeable_ranks=ranks, special_tokens={})
+    monkeypatch.setattr(chunking, "get_encoding", lambda name: encoding)
+
+    chunks = list(StructuredChunker(max_tokens=60, min_tokens=20, overlap_tokens=10).chunk([element(long_text)]))
+
+    assert len(chunks) > 1
+    for previous, current in zip(chunks, chunks[1:]):
+        # The next piece starts inside the previous one, at a word
+        assert current.metadata["start_index"] < previous.metadata["start_index"] + len(previous.page_content)
+        assert long_text[current.metadata["start_index"] - 1] == " "
+
+
+def test_context_builder_merges_consecutive_chunks_back_into_the_page():
+    elements = document_elements()
+    chunks = list(StructuredChunker(max_tokens=200, min_tokens=5, overlap_tokens=20).chunk(elements))
+
+    passages = ContextBuilder().merge_overlapping(chunks)
+
+    # Elements packed in separate chunks are a separator apart, split pieces overlap: each page is whole again
+    assert sorted((doc.metadata["page_number"], doc.page_content) for doc, _ in passages) == sorted(page_texts(elements).items())
+
+
+def test_small_sections_stay_together():
+    elements = [element("Overview", "Title"), element("Short."), element("Details", "Title"), element("Also short.")]
+    chunks = list(StructuredChunker(max_tokens=200, min_tokens=100, overlap_tokens=0).chunk(elements))
+    assert [doc.page_content for doc in chunks] == [ELEMENT_SEPARATOR.join(["Overview", "Short.", "Details", "Also short."])]
+
+
+def test_chunker_settings_are_validated():
+    with pytest.raises(ValueError):
+        StructuredChunker(max_tokens=10000)
+    with pytest.raises(ValueError):
+        StructuredChunker(max_tokens=100, overlap_tokens=100)
+
+
+def test_chunkers_are_picklable_and_selected_by_settings():
+    class Settings:
+        CHUNKER = "structured"
+        CHUNK_MAX_TOKENS = 300
+        CHUNK_MIN_TOKENS = 50
+        CHUNK_OVERLAP_TOKENS = 30
+
+    chunker = pickle.loads(pickle.dumps(chunker_from_settings(Settings)))
+    assert (chunker.max_tokens, chunker.min_tokens, chunker.overlap_tokens) == (300, 50, 30)
+
+    Settings.CHUNKER = "recursive"
+    assert isinstance(chunker_from_settings(Settings), RecursiveChunker)
+    Settings.CHUNKER = "sentences"
+    with pytest.raises(ValueError):
+        chunker_from_settings(Settings)
+
+
+# --- Ingestion pipeline ---
+def fake_load(path: str):
+    """Stands in for `load_and_chunk` in the worker processes: one chunk per word of the path."""
+    name = os.path.basename(path)
+    if name.startswith("broken"):
+        raise ValueError("unreadable file")
+    chunks = [Document(page_content=word, metadata={"source": path}) for word in name.split("-") if word != "empty"]
+    return path, chunks, len(chunks)
+
+
+class LengthEmbeddings(Embeddings):
+    def __init__(self):
+        self.batches = []
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.batches.append(len(texts))
+        return [[float(len(text))] for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+def test_pipeline_embeds_and_stores_every_document_once():
+    paths = [f"doc{i}-alpha-beta" for i in range(10)]
+    stored = {}
+    embeddings = LengthEmbeddings()
+
+    stats = run_pipeline(
+        paths, embeddings, lambda batch: stored.setdefault(batch.source, batch),
+        load_workers=2, embed_workers=3, embed_batch_size=2, queue_size=2, load_fn=fake_load,
+    )
+
+    assert sorted(stored) == sorted(paths)
+    assert all(batch.vectors == [[4.0], [5.0], [4.0]] for batch in stored.values())
+    # Three chunks per document are embedded in batches of at most two
+    assert sorted(embeddings.batches) == [1] * 10 + [2] * 10
+    assert (stats.files, stats.failed_files, stats.chunks, stats.stored_chunks) == (10, 0, 30, 30)
+
+
+def test_pipeline_counts_failures_and_carries_on():
+    def store(batch):
+        if batch.source.startswith("unstorable"):
+            raise RuntimeError("database is down")
+
+    stats = run_pipeline(["broken-file", "unstorable-file", "good-file"], LengthEmbeddings(), store, load_workers=1, load_fn=fake_load)
+
+    assert (stats.files, stats.failed_files, stats.chunks, stats.stored_chunks) == (3, 2, 4, 2)
+
+
+# --- Incremental sync ---
+class MemorySyncStore:
+    """The DocumentSyncStore interface over dictionaries."""
+
+    def __init__(self, manifest: Dict[str, FileState] = None):
+        self.manifest = dict(manifest or {})
+        self.chunks: Dict[str, List[str]] = {}
+        self.touched = []
+        self.version = 0
+
+    def ensure_schema(self):
+        pass
+
+    def load_manifest(self) -> Dict[str, FileState]:
+        return dict(self.manifest)
+
+    def replace_document(self, source, chunks, vectors, state=None):
+        assert len(chunks) == len(vectors)
+        self.chunks[source] = [chunk.page_content for chunk in chunks]
+        self.manifest[source] = state
+
+    def delete_document(self, source):
+        self.chunks.pop(source, None)
+        self.manifest.pop(source)
+
+    def touch(self, state):
+        self.touched.append(state.source)
+        self.manifest[state.source] = state
+
+    def bump_version(self):
+        self.version += 1
+
+
+def write(path, text: str) -> str:
+    path.write_text(text)
+    return str(path)
+
+
+def state_of(path: str, content_hash: str = None) -> FileState:
+    stat = os.stat(path)
+    return FileState(path, stat.st_size, stat.st_mtime, content_hash or file_hash(path))
+
+
+def test_sync_ingests_only_new_and_changed_files(tmp_path):
+    unchanged = write(tmp_path / "same-size-and-mtime", "v1")
+    touched = write(tmp_path / "same-bytes", "v1")
+    changed = write(tmp_path / "new-bytes", "v2")
+    added = write(tmp_path / "added-file", "v1")
+    store = MemorySyncStore({
+        unchanged: state_of(unchanged, content_hash="not read"),
+        touched: FileState(touched, 2, 0.0, file_hash(touched)),
+        changed: FileState(changed, 2, 0.0, "old hash"),
+        "gone": FileState("gone", 1, 0.0, "hash"),
+    })
+    store.chunks["gone"] = ["old chunk"]
+
+    stats = sync_documents([unchanged, touched, changed, added], LengthEmbeddings(), store, load_workers=1, load_fn=fake_load)
+
+    assert store.chunks == {changed: ["new", "bytes"], added: ["added", "file"]}
+    assert store.touched == [touched]
+    assert store.manifest[changed].content_hash == file_hash(changed)
+    assert sorted(store.manifest) == sorted([unchanged, touched, changed, added])
+    assert (stats.files, store.version) == (2, 1)
+
+
+def test_sync_without_changes_keeps_the_version(tmp_path):
+    path = write(tmp_path / "doc", "v1")
+    store = MemorySyncStore({path: state_of(path), "elsewhere": FileState("elsewhere", 1, 0.0, "hash")})
+
+    stats = sync_documents([path], LengthEmbeddings(), store, prune=False, load_workers=1, load_fn=fake_load)
+
+    assert (stats.files, store.version) == (0, 0)
+    assert "elsewhere" in store.manifest
+
+
+def test_sync_clears_a_document_that_no_longer_has_chunks(tmp_path):
+    path = write(tmp_path / "empty", "now blank")
+    store = MemorySyncStore({path: FileState(path, 1, 0.0, "old hash")})
+    store.chunks[path] = ["old chunk"]
+
+    sync_documents([path], LengthEmbeddings(), store, load_workers=1, load_fn=fake_load)
+
+    assert store.chunks == {path: []}
+    assert store.manifest[path].content_hash == file_hash(path)
+
+
+def test_unchanged_archives_are_not_extracted_again(tmp_path):
+    archive, extract_to = str(tmp_path / "docs.zip"), str(tmp_path / "_extracted")
+    extracted = []
+
+    def extract(path, target):
+        extracted.append(path)
+        return extract_zip(path, target)
+
+    with zipfile.ZipFile(archive, "w") as zf:
+        zf.writestr("a.txt", "alpha")
+        zf.writestr("b.txt", "beta")
+    files = ArchiveManifest(extract_to).expand(archive, extract)
+    mtimes = [os.stat(path).st_mtime_ns for path in files]
+
+    # A new run (fresh manifest object) and a touched archive with the same bytes reuse the extracted files
+    assert ArchiveManifest(extract_to).expand(archive, extract) == files
+    os.utime(archive, (1, 1))
+    assert ArchiveManifest(extract_to).expand(archive, extract) == files
+    assert extracted == [archive]
+    assert [os.stat(path).st_mtime_ns for path in files] == mtimes
+
+    with zipfile.ZipFile(archive, "w") as zf:
+        zf.writestr("a.txt", "alpha, revised")
+    assert ArchiveManifest(extract_to).expand(archive, extract) == [os.path.join(extract_to, "a.txt")]
+    assert len(extracted) == 2
+    assert not os.path.exists(os.path.join(extract_to, "b.txt"))
@@ -0,0 +1,633 @@
+# tests/test_services.py
+#
+# The parts of app/services that run without a database. The asyncpg store runs against a fake pool that
+# records the statements and COPY records it is given, also when the ingestion sync writes through it.
+
+import asyncio
+import json
+import uuid
+from types import SimpleNamespace
+from typing import List
+
+import numpy as np
+
+import pytest
+import sqlalchemy
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from app.services import storage
+from app.services.embedding_cache import CachedEmbeddings, EmbeddingCache, QueryCache, aembed_queries
+from app.services.retrieval import (
+    TEXT_SEARCH_COLUMN_EXISTS, PgVectorSearch, multi_query_search, reciprocal_rank_fusion, vector_literal,
+)
+from app.services.storage import (
+    COPY_COLUMNS, AnswerCache, PgVectorStore, decode_binary_vector, encode_binary_vector, normalize_question, to_positional,
+)
+from data_ingestion.sync import DocumentSyncStore, bulk_replace_chunks
+
+
+def doc(text: str, source: str = "a.pdf") -> Document:
+    return Document(page_content=text, metadata={"source": source})
+
+
+# --- Reciprocal rank fusion ---
+def test_rrf_ranks_documents_the_lists_agree_on_first():
+    a, b, c = doc("a"), doc("b"), doc("c")
+
+    fused = reciprocal_rank_fusion([[a, b], [b, c], [b]], k=60)
+
+    assert [item.page_content for item, _ in fused] == ["b", "a", "c"]
+    assert fused[0][1] == pytest.approx(1 / 62 + 1 / 61 + 1 / 61)
+    assert fused[1][1] == pytest.approx(1 / 61)
+    assert fused[2][1] == pytest.approx(1 / 62)
+
+
+def test_rrf_keys_chunks_on_source_and_text():
+    same_text_elsewhere = doc("a", source="b.pdf")
+
+    fused = reciprocal_rank_fusion([[doc("a")], [doc("a"), same_text_elsewhere]], k=1)
+
+    assert [(item.metadata["source"], score) for item, score in fused] == [("a.pdf", pytest.approx(1.0)), ("b.pdf", pytest.approx(1 / 3))]
+
+
+# --- Multi-query search ---
+class RecordingEmbeddings(Embeddings):
+    """One-hot vectors keyed on the text; records every batch it embeds."""
+
+    def __init__(self, texts: List[str]):
+        self.texts = texts
+        self.calls = []
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.calls.append(list(texts))
+        return [[float(text == known) for known in self.texts] for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+class RankedSearch:
+    """Returns a fixed ranking per query vector and records the search arguments."""
+
+    def __init__(self, queries: List[str], rankings):
+        self.queries = queries
+        self.rankings = rankings
+        self.calls = []
+
+    async def asearch(self, embedding, k=4, filter=None):
+        query = self.queries[embedding.index(1.0)]
+        self.calls.append((query, k, {"filter": filter}))
+        return [(doc(text), 1.0) for text in self.rankings[query][:k]]
+
+    async def ahybrid_search(self, query_text, embedding, k=4, **kwargs):
+        assert self.queries[embedding.index(1.0)] == query_text
+        self.calls.append((query_text, k, kwargs))
+        return [(doc(text), 1.0) for text in self.rankings[query_text][:k]]
+
+
+def test_multi_query_search_embeds_once_and_fuses_the_rankings():
+    queries = ["question", "variant 1", "variant 2"]
+    embeddings = RecordingEmbeddings(queries)
+    search = RankedSearch(queries, {"question": ["x", "y"], "variant 1": ["y", "z"], "variant 2": ["y"]})
+
+    fused = asyncio.run(multi_query_search(
+        search, embeddings, queries, k=2, rrf_k=60, filter={"source": ["a.pdf"]}, hybrid={"semantic_weight": 0.7},
+    ))
+
+    # One embedding batch; every search is hybrid and gets the filter and weights
+    assert embeddings.calls == [queries]
+    assert sorted(search.calls) == [(query, 2, {"filter": {"source": ["a.pdf"]}, "semantic_weight": 0.7}) for query in queries]
+    assert [item.page_content for item, _ in fused] == ["y", "x", "z"]
+
+
+def test_multi_query_search_embeds_only_unknown_queries():
+    queries = ["question", "variant"]
+    embeddings = RecordingEmbeddings(queries)
+    search = RankedSearch(queries, {"question": ["x"], "variant": ["y"]})
+
+    query_vectors = {"question": [1.0, 0.0]}
+    asyncio.run(multi_query_search(search, embeddings, queries, k=1, query_vectors=query_vectors))
+
+    assert embeddings.calls == [["variant"]]
+    assert sorted(query_vectors) == queries
+    assert sorted(call[0] for call in search.calls) == queries
+
+
+def test_multi_query_search_without_hybrid_is_semantic():
+    queries = ["question"]
+    search = RankedSearch(queries, {"question": ["only"]})
+
+    fused = asyncio.run(multi_query_search(search, RecordingEmbeddings(queries), queries, k=1))
+
+    assert search.calls == [("question", 1, {"filter": None})]
+    assert [item.page_content for item, _ in fused] == ["only"]
+
+
+# --- ANN index ---
+def vector_search(dimensions: int = 1536, **options) -> PgVectorSearch:
+    search = PgVectorSearch(engine=None, collection_name="docs", dimensions=dimensions, **options)
+    search._collection_id = "7f1c0d2e-0000-4000-8000-000000000000"
+    return search
+
+
+def test_index_is_a_partial_expression_index_on_the_collection():
+    search = vector_search(index_type="hnsw", hnsw_m=32, hnsw_ef_construction=128)
+
+    statement = search.index_definition()
+
+    assert statement.startswith(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {search.index_name} ON langchain_pg_embedding")
+    assert "hnsw ((embedding::vector(1536)) vector_cosine_ops) WITH (m = 32, ef_construction = 128)" in statement
+    assert statement.endswith("WHERE collection_id = '7f1c0d2e-0000-4000-8000-000000000000'")
+    assert "lists = 50" in vector_search(index_type="ivfflat", ivfflat_lists=50).index_definition()
+    assert not search.rescores
+
+
+def test_compact_index_truncates_and_halves_the_vectors():
+    search = vector_search(dimensions=3072, index_dimensions=1024, index_precision="halfvec")
+
+    assert "(subvector(embedding, 1, 1024)::halfvec(1024)) halfvec_cosine_ops" in search.index_definition()
+    assert search.rescores
+    # Another index expression is another index
+    assert search.index_name != vector_search(dimensions=3072, index_precision="halfvec").index_name
+    # Half-precision storage indexed at half precision loses nothing
+    assert not vector_search(storage_type="halfvec", index_precision="halfvec").rescores
+
+
+def test_index_names_start_with_a_prefix_of_the_collection_name():
+    search = vector_search()
+    rebuilt = vector_search()
+    rebuilt._collection_id = "9a8b7c6d-0000-4000-8000-000000000000"
+    other = PgVectorSearch(engine=None, collection_name="other", dimensions=1536)
+    other._collection_id = search._collection_id
+
+    assert search.index_name.startswith(search.index_prefix + "hnsw_")
+    assert rebuilt.index_name != search.index_name and rebuilt.index_prefix == search.index_prefix
+    assert other.index_prefix != search.index_prefix
+
+
+def test_dropping_indexes_finds_those_of_an_earlier_collection_id():
+    class Engine:
+        def __init__(self, names):
+            self.names = names
+            self.executed = []
+
+        def connect(self):
+            return self
+
+        def execution_options(self, **options):
+            return self
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc_info):
+            return False
+
+        def execute(self, statement, params=None):
+            self.executed.append((str(statement), params))
+            return SimpleNamespace(scalars=lambda: SimpleNamespace(all=lambda: self.names))
+
+    search = vector_search()
+    orphan = search.index_prefix + "hnsw_0123456789"
+    search.engine = Engine([orphan, search.index_name])
+
+    search._drop_indexes(keep=search.index_name)
+
+    (lookup, params), (drop, _) = search.engine.executed
+    assert params["prefix"] == search.index_prefix.replace("_", "\\_") + "%"
+    assert "indexname LIKE :prefix" in lookup
+    assert drop == f"DROP INDEX CONCURRENTLY IF EXISTS {orphan}"
+
+
+def test_index_types_and_dimensions_are_validated():
+    with pytest.raises(ValueError):
+        vector_search(index_type="flat")
+    with pytest.raises(ValueError):
+        vector_search(storage_type="bit")
+    with pytest.raises(ValueError):
+        vector_search(dimensions=3072).index_definition()
+    assert "halfvec(3072)" in vector_search(dimensions=3072, index_precision="halfvec").index_definition()
+    with pytest.raises(ValueError):
+        vector_search(text_search_config="english'); DROP TABLE x; --").ensure_text_search()
+
+
+def test_search_settings_per_query():
+    search = vector_search(ef_search=40, probes=10, iterative_scan="strict_order")
+
+    assert search._session_settings(None, None, 4, filtered=False, exact=False) == [
+        "SET LOCAL hnsw.ef_search = 40", "SET LOCAL ivfflat.probes = 10",
+    ]
+    # ef_search covers the rescoring candidates
+    assert search._session_settings(None, 5, 64, filtered=True, exact=False) == [
+        "SET LOCAL hnsw.ef_search = 64", "SET LOCAL ivfflat.probes = 5",
+        "SET LOCAL hnsw.iterative_scan = strict_order", "SET LOCAL ivfflat.iterative_scan = relaxed_order",
+    ]
+    assert search._session_settings(80, 5, 4, filtered=True, exact=True) == ["SET LOCAL enable_indexscan = off"]
+
+
+class CollectionLookup:
+    """Stands in for the engine: every connection finds the collection under the next id of `ids`."""
+
+    def __init__(self, ids: List[str]):
+        self.ids = list(ids)
+
+    def connect(self):
+        ids = self.ids
+
+        class Connection:
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc):
+                return False
+
+            def execute(self, statement, params):
+                return SimpleNamespace(first=lambda: (ids.pop(0),))
+
+        return Connection()
+
+
+@pytest.mark.parametrize("new_id, queries", [("7f1c0d2e-0000-4000-8000-000000000000", 1), ("9a8b7c6d-0000-4000-8000-000000000000", 2)])
+def test_empty_search_runs_again_only_when_the_collection_moved(monkeypatch, new_id, queries):
+    search = vector_search(dimensions=3)
+    search.engine = CollectionLookup([new_id])
+    executed = []
+    monkeypatch.setattr(search, "_execute", lambda statement, params, settings: executed.append(params["collection_id"]) or [])
+
+    assert search.search([1.0, 0.0, 0.0]) == []
+    assert len(executed) == queries
+    assert search.collection_id == new_id
+
+
+# --- Answer cache ---
+@pytest.fixture
+def clock(monkeypatch):
+    """Replaces the answer cache's clock; advance it with `clock.now += seconds`."""
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(storage, "time", SimpleNamespace(monotonic=lambda: clock.now))
+    return clock
+
+
+def cache(**overrides) -> AnswerCache:
+    options = {"ttl_seconds": 60, "max_entries": 10, "max_bytes": 10_000, "similarity_threshold": 0.95, **overrides}
+    return AnswerCache(**options)
+
+
+def test_exact_tier_matches_normalized_questions():
+    answers = cache()
+    answers.put("What is Quasar?", "a RAG platform")
+
+    assert normalize_question("  what is  QUASAR ") == "what is quasar"
+    assert answers.get_exact("what is quasar") == "a RAG platform"
+    assert answers.get_exact("What is pgvector?") is None
+    assert answers.stats()["exact_hits"] == 1
+
+
+def test_semantic_tier_uses_the_similarity_threshold():
+    answers = cache(similarity_threshold=0.9)
+    answers.put("What is Quasar?", "a RAG platform", embedding=[1.0, 0.0, 0.0])
+
+    assert answers.get_semantic([0.95, 0.05, 0.0]) == "a RAG platform"
+    assert answers.get_semantic([0.5, 0.5, 0.0]) is None
+    assert answers.get_semantic([0.0, 0.0, 0.0]) is None
+    stats = answers.stats()
+    assert (stats["semantic_hits"], stats["misses"]) == (1, 2)
+
+
+def test_entries_expire_after_the_ttl(clock):
+    answers = cache(ttl_seconds=60)
+    answers.put("What is Quasar?", "a RAG platform", embedding=[1.0, 0.0])
+
+    clock.now += 30
+    assert answers.get_exact("What is Quasar?") == "a RAG platform"
+    clock.now += 31
+    assert answers.get_exact("What is Quasar?") is None
+    assert answers.get_semantic([1.0, 0.0]) is None
+    assert len(answers) == 0
+    assert answers.stats()["expirations"] == 1
+
+
+def test_least_recently_used_entries_are_evicted():
+    answers = cache(max_entries=2)
+    answers.put("first", 1)
+    answers.put("second", 2)
+    answers.get_exact("first")
+    answers.put("third", 3)
+
+    assert answers.get_exact("second") is None
+    assert (answers.get_exact("first"), answers.get_exact("third")) == (1, 3)
+    assert answers.stats()["evictions"] == 1
+
+
+def test_entries_are_evicted_beyond_the_byte_budget():
+    answers = cache(max_bytes=1000)
+    answers.put("first", 1, size=600)
+    answers.put("second", 2, size=600)
+
+    assert len(answers) == 1
+    assert answers.get_exact("second") == 2
+    assert answers.stats()["bytes"] <= 1000
+
+
+def test_a_new_collection_version_drops_the_cache(monkeypatch):
+    events = []
+    monkeypatch.setattr(storage, "log_event", lambda logger, event, **fields: events.append((event, fields)))
+    answers = cache()
+    answers.ensure_version("v1")
+    answers.put("What is Quasar?", "a RAG platform")
+
+    answers.ensure_version("v1")
+    assert len(answers) == 1
+    answers.ensure_version("v2")
+    assert len(answers) == 0
+    assert answers.version == "v2"
+    assert answers.stats()["invalidations"] == 1
+    assert events == [("answer_cache_invalidated", {"old": "v1", "new": "v2"})]
+
+
+# --- Embedding cache ---
+def test_embedding_cache_looks_up_batches_in_input_order(tmp_path):
+    embeddings = EmbeddingCache(str(tmp_path), "model", 3)
+    embeddings.put(["a", "b", "a"], [[1, 0, 0], [0, 1, 0], [1, 0, 0]])
+
+    found, vectors = embeddings.lookup(["b", "c", "a"])
+
+    assert found.tolist() == [True, False, True]
+    assert vectors.tolist() == [[0, 1, 0], [1, 0, 0]]
+    assert len(embeddings) == 2
+
+
+def test_embedding_cache_is_shared_through_the_files(tmp_path):
+    writer = EmbeddingCache(str(tmp_path), "model", 2)
+    reader = EmbeddingCache(str(tmp_path), "model", 2)
+    assert len(reader) == 0
+
+    writer.put(["a"], [[0.5, 0.5]])
+
+    found, vectors = reader.lookup(["a"])
+    assert found.tolist() == [True]
+    assert vectors.tolist() == [[0.5, 0.5]]
+    # Another model or dimension count gets its own files
+    assert len(EmbeddingCache(str(tmp_path), "model", 3)) == 0
+
+
+def test_embedding_cache_merges_appended_keys_into_its_index(tmp_path):
+    writer = EmbeddingCache(str(tmp_path), "model", 1)
+    reader = EmbeddingCache(str(tmp_path), "model", 1)
+    writer.put(["m", "c"], [[1.0], [2.0]])
+    assert reader.lookup(["c"])[0].tolist() == [True]
+
+    # Keys sorting before, between and after the indexed ones
+    writer.put(["a", "k", "z"], [[3.0], [4.0], [5.0]])
+
+    found, vectors = reader.lookup(["z", "a", "m", "k", "c", "b"])
+    assert found.tolist() == [True, True, True, True, True, False]
+    assert vectors.ravel().tolist() == [5.0, 3.0, 1.0, 4.0, 2.0]
+
+
+def test_embedding_cache_rejects_a_different_dimension(tmp_path):
+    embeddings = EmbeddingCache(str(tmp_path), "model")
+    embeddings.put(["a"], [[1.0, 0.0]])
+    with pytest.raises(ValueError):
+        embeddings.put(["b"], [[1.0, 0.0, 0.0]])
+
+
+def test_cached_embeddings_send_only_missing_texts(tmp_path):
+    underlying = RecordingEmbeddings(["a", "b", "c"])
+    embeddings = CachedEmbeddings(underlying, EmbeddingCache(str(tmp_path), "model", 3))
+
+    first = embeddings.embed_documents(["a", "b", "a"])
+    second = asyncio.run(embeddings.aembed_documents(["c", "b"]))
+
+    assert underlying.calls == [["a", "b"], ["c"]]
+    assert first == [[1, 0, 0], [0, 1, 0], [1, 0, 0]]
+    assert second == [[0, 0, 1], [0, 1, 0]]
+
+
+def test_query_cache_evicts_the_least_recently_used():
+    queries = QueryCache(max_entries=2)
+    queries.put_many({"a": [1.0], "b": [2.0]})
+    queries.get_many(["a"])
+    queries.put_many({"c": [3.0]})
+
+    assert queries.get_many(["a", "b", "c"]) == {"a": [1.0], "c": [3.0]}
+    assert len(queries) == 2
+
+
+def test_queries_are_cached_in_memory_only(tmp_path):
+    underlying = RecordingEmbeddings(["a", "b"])
+    embeddings = CachedEmbeddings(underlying, EmbeddingCache(str(tmp_path), "model", 2))
+
+    assert embeddings.embed_query("a") == [1, 0]
+    assert asyncio.run(aembed_queries(embeddings, ["b", "a"])) == [[0, 1], [1, 0]]
+    assert asyncio.run(embeddings.aembed_query("b")) == [0, 1]
+
+    assert underlying.calls == [["a"], ["b"]]
+    assert len(embeddings.cache) == 0
+    # Without a query cache the batch is embedded as is
+    assert asyncio.run(aembed_queries(underlying, ["b"])) == [[0, 1]]
+
+
+# --- asyncpg store ---
+COLLECTION_ID = "7f1c0d2e-0000-4000-8000-000000000000"
+
+
+class FakeConnection:
+    """
+    Records what PgVectorStore sends to asyncpg; `fetch` returns the queued results in order, and the
+    collection is found under the next of `collection_ids` (the last one stays). The full-text column
+    exists if `text_search`.
+    """
+
+    def __init__(self, results=None, collection_ids=(COLLECTION_ID,), text_search=True):
+        self.results = list(results or [])
+        self.collection_ids = list(collection_ids)
+        self.text_search = text_search
+        self.text_search_checks = 0
+        self.executed = []
+        self.fetched = []
+        self.copied = []
+        self.closed = False
+
+    async def fetchval(self, statement, *args):
+        if statement == TEXT_SEARCH_COLUMN_EXISTS:
+            self.text_search_checks += 1
+            return self.text_search
+        return uuid.UUID(self.collection_ids.pop(0) if len(self.collection_ids) > 1 else self.collection_ids[0])
+
+    async def execute(self, statement, *args):
+        self.executed.append((statement, args))
+
+    async def fetch(self, statement, *args):
+        self.fetched.append((statement, args))
+        return self.results.pop(0) if self.results else []
+
+    async def copy_records_to_table(self, table, records, columns):
+        self.copied.append((table, records, columns))
+
+    def transaction(self):
+        return self
+
+    async def close(self):
+        self.closed = True
+
+    def acquire(self):
+        return self
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+
+def async_store(connection: FakeConnection, **options) -> PgVectorStore:
+    engine = sqlalchemy.create_engine("postgresql+psycopg2://quasar:secret@db:5432/quasar")
+    store = PgVectorStore(engine, "docs", 3, **options)
+    store._pool = connection  # the fake connection also plays the pool
+    return store
+
+
+def test_named_parameters_become_positional():
+    statement, params = to_positional(
+        "SELECT document FROM t WHERE collection_id = :collection AND embedding <=> :query::vector < :limit "
+        "AND cmetadata->>'time' = '10:30' ORDER BY embedding <=> :query::vector",
+        {"query": "[1,2]", "collection": "c1", "limit": 0.5, "unused": 1},
+    )
+
+    assert statement == (
+        "SELECT document FROM t WHERE collection_id = $1 AND embedding <=> $2::vector < $3 "
+        "AND cmetadata->>'time' = '10:30' ORDER BY embedding <=> $2::vector"
+    )
+    assert params == ["c1", "[1,2]", 0.5]
+
+
+def test_binary_vectors_round_trip():
+    data = encode_binary_vector([1.0, -0.5, 0.25], ">f4")
+
+    assert data[:4] == b"\x00\x03\x00\x00"  # dimension count, unused
+    assert len(data) == 4 + 3 * 4
+    assert decode_binary_vector(data, ">f4").tolist() == [1.0, -0.5, 0.25]
+    assert len(encode_binary_vector([1.0, -0.5, 0.25], ">f2")) == 4 + 3 * 2
+    assert decode_binary_vector(encode_binary_vector([0.1, 0.2], ">f2"), ">f2") == pytest.approx([0.1, 0.2], abs=1e-3)
+    assert vector_literal([1, 0.5, -2]) == "[1.0, 0.5, -2.0]"
+
+
+def test_asyncpg_url_drops_the_sqlalchemy_driver():
+    assert async_store(FakeConnection()).dsn == "postgresql://quasar:secret@db:5432/quasar"
+
+
+def test_asyncpg_search_binds_binary_vectors_and_settings_in_one_round_trip():
+    row = {"uuid": uuid.uuid4(), "document": "text", "cmetadata": json.dumps({"source": "a.pdf"}), "distance": 0.25}
+    connection = FakeConnection(results=[[row]])
+    store = async_store(connection, index_type="hnsw", ef_search=40)
+
+    results = asyncio.run(store.asearch([1.0, 0.0, 0.0], k=2, filter={"source": ["a.pdf"]}))
+
+    (settings_statement, _), = connection.executed
+    assert settings_statement.startswith("SET LOCAL hnsw.ef_search = 40; SET LOCAL ivfflat.probes = 10")
+    (statement, args), = connection.fetched
+    assert "$1" in statement and ":query" not in statement
+    assert [arg for arg in args if isinstance(arg, uuid.UUID)] == [uuid.UUID(COLLECTION_ID)]
+    assert any(isinstance(arg, np.ndarray) and arg.dtype == np.float32 for arg in args)
+    doc, similarity = results[0]
+    assert (doc.metadata, similarity) == ({"source": "a.pdf", "similarity": 0.75}, 0.75)
+
+
+@pytest.mark.parametrize("moved_id, queries", [(COLLECTION_ID, 1), ("9a8b7c6d-0000-4000-8000-000000000000", 2)])
+def test_asyncpg_search_runs_again_only_when_the_collection_moved(moved_id, queries):
+    connection = FakeConnection(results=[[], []], collection_ids=[COLLECTION_ID, moved_id])
+    store = async_store(connection)
+
+    assert asyncio.run(store.asearch([1.0, 0.0, 0.0])) == []
+    assert len(connection.fetched) == queries
+
+
+def test_hybrid_search_falls_back_to_vectors_without_the_full_text_column():
+    connection = FakeConnection(text_search=False)
+    store = async_store(connection)
+
+    for _ in range(2):
+        asyncio.run(store.ahybrid_search("refund policy", [1.0, 0.0, 0.0], k=2))
+
+    # The column is looked for once per recheck interval, not per query
+    assert connection.text_search_checks == 1
+    assert all("document_tsv" not in statement for statement, _ in connection.fetched)
+
+    connection = FakeConnection()
+    asyncio.run(async_store(connection).ahybrid_search("refund policy", [1.0, 0.0, 0.0], k=2))
+    assert "document_tsv" in connection.fetched[0][0]
+
+
+def test_chunks_are_replaced_with_one_delete_and_one_copy():
+    connection = FakeConnection()
+    store = async_store(connection)
+    chunks = [doc("first", "a.pdf"), doc("second", "a.pdf"), doc("other", "b.pdf")]
+
+    written = asyncio.run(store.areplace_chunks(chunks, [[1, 0, 0], [0, 1, 0], [0, 0, 1]]))
+
+    assert written == 3
+    (delete, (collection_id, sources)), = connection.executed
+    assert delete.startswith("DELETE FROM langchain_pg_embedding") and "ANY($2)" in delete
+    assert (collection_id, sources) == (uuid.UUID(COLLECTION_ID), ["a.pdf", "b.pdf"])
+    (table, records, columns), = connection.copied
+    assert (table, columns) == ("langchain_pg_embedding", COPY_COLUMNS)
+    assert [(record[1], record[2], record[3], json.loads(record[4])) for record in records] == [
+        (uuid.UUID(COLLECTION_ID), [1, 0, 0], "first", {"source": "a.pdf"}),
+        (uuid.UUID(COLLECTION_ID), [0, 1, 0], "second", {"source": "a.pdf"}),
+        (uuid.UUID(COLLECTION_ID), [0, 0, 1], "other", {"source": "b.pdf"}),
+    ]
+
+
+def test_sync_store_writes_through_the_asyncpg_store():
+    connection = FakeConnection()
+    vector_store = async_store(connection)
+    disposed = []
+    vector_store.engine.dispose = lambda: disposed.append(True)
+    store = DocumentSyncStore(vector_store.engine, "docs", vector_store)
+
+    store.replace_document("a.pdf", [doc("first", "elsewhere.pdf")], [[1, 0, 0]])
+    store.replace_document("b.pdf", [], [])
+    store.close()
+
+    # Every chunk is filed under its document; a document without chunks is cleared
+    assert [args[1] for _, args in connection.executed] == [["a.pdf"], ["b.pdf"]]
+    (_, records, _), = connection.copied
+    assert json.loads(records[0][4]) == {"source": "a.pdf"}
+    # Only the pool is closed: the engine is the caller's
+    assert connection.closed
+    assert not disposed
+
+
+def test_sync_store_follows_the_driver_setting():
+    engine = sqlalchemy.create_engine("postgresql+psycopg2://quasar:secret@db:5432/quasar")
+
+    def store(driver: str) -> DocumentSyncStore:
+        return DocumentSyncStore.from_settings(engine, "docs", SimpleNamespace(VECTOR_STORE_DRIVER=driver, EMBEDDING_DIMENSIONS=3))
+
+    assert isinstance(store("asyncpg").vector_store, PgVectorStore)
+    assert store("psycopg2").vector_store is None
+    with pytest.raises(ValueError):
+        store("psycopg3")
+
+
+def test_bulk_replace_closes_only_its_own_pool(monkeypatch):
+    connection = FakeConnection()
+
+    async def fake_open(store):
+        store._pool = connection
+        return connection
+
+    monkeypatch.setattr(PgVectorStore, "open", fake_open)
+    engine = sqlalchemy.create_engine("postgresql+psycopg2://quasar:secret@db:5432/quasar")
+    disposed = []
+    engine.dispose = lambda: disposed.append(True)
+    chunks = [doc("first", "a.pdf"), doc("other", "b.pdf"), doc("second", "a.pdf")]
+
+    written = bulk_replace_chunks(engine, "docs", SimpleNamespace(VECTOR_STORE_DRIVER="asyncpg", EMBEDDING_DIMENSIONS=3), chunks, [[1, 0, 0]] * 3)
+
+    assert written == 3
+    assert [args[1] for _, args in connection.executed] == [["a.pdf"], ["b.pdf"]]
+    assert [[record[3] for record in records] for _, records, _ in connection.copied] == [["first", "second"], ["other"]]
+    assert connection.closed and not disposed